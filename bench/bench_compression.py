@@ -0,0 +1,96 @@
+# bench/bench_compression.py
+"""
+Bytes no ar com e sem compressão para a mistura típica de mensagens dos sensores.
+
+Para cada mensagem conta-se a frame completa (cabeçalho de 22 bytes + payload),
+partida em escritas ATT de MTU-3 bytes (common/fragments.py), e soma-se o custo
+fixo de cada escrita: 3 (ATT) + 4 (L2CAP) + 10 (preâmbulo, access address,
+cabeçalho e CRC da camada de ligação).
+
+Uso: python bench/bench_compression.py [--messages 2000] [--json]
+"""
+import argparse
+import json
+import os
+import random
+import sys
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from common.frames import encode_frame, TYPE_DATA
+from common.fragments import fragment
+from common.compression import maybe_compress
+
+PER_WRITE_OVERHEAD = 3 + 4 + 10
+NID = bytes(16)
+
+
+def message_mix(count, seed=1):
+    """ Mistura de leituras periódicas, estados e alertas como as que os Nodes enviam. """
+    rng = random.Random(seed)
+    for i in range(count):
+        kind = rng.random()
+        if kind < 0.6:
+            yield (f"temp={rng.uniform(18, 24):.1f};hum={rng.uniform(35, 65):.1f};"
+                   f"batt={rng.uniform(3.6, 4.1):.2f}")
+        elif kind < 0.8:
+            yield f"status=OK uptime={rng.randint(100, 99999)} rssi={rng.randint(-90, -55)}"
+        elif kind < 0.9:
+            yield (f"light={rng.randint(0, 900)} lux;co2={rng.randint(400, 1500)} ppm;"
+                   f"press={rng.uniform(990, 1030):.1f} hPa")
+        elif kind < 0.97:
+            yield f"ALERT temp={rng.uniform(30, 45):.1f} C alarm=1 seq={i}"
+        else:
+            yield f"Mensagem manual {i}: porta aberta na sala {rng.randint(1, 20)}"
+
+
+def on_air(frame, mtu):
+    max_write = mtu - 3
+    writes = [frame] if len(frame) <= max_write else fragment(frame, max_write, 0)
+    return len(writes), sum(len(w) + PER_WRITE_OVERHEAD for w in writes)
+
+
+def run(messages, mtus=(23, 185, 247)):
+    results = {'messages': messages, 'mtu': {}}
+    payload_raw = payload_packed = 0
+    frames_raw, frames_packed = [], []
+    for text in message_mix(messages):
+        raw = text.encode("utf-8")
+        packed, flags = maybe_compress(raw)
+        payload_raw += len(raw)
+        payload_packed += len(packed)
+        frames_raw.append(encode_frame(TYPE_DATA, NID, 0, raw))
+        frames_packed.append(encode_frame(TYPE_DATA, NID, 0, packed, flags))
+    results['payload_bytes'] = {'raw': payload_raw, 'compressed': payload_packed}
+
+    for mtu in mtus:
+        raw = [on_air(f, mtu) for f in frames_raw]
+        packed = [on_air(f, mtu) for f in frames_packed]
+        air_raw = sum(b for _, b in raw)
+        air_packed = sum(b for _, b in packed)
+        results['mtu'][mtu] = {
+            'writes': {'raw': sum(w for w, _ in raw), 'compressed': sum(w for w, _ in packed)},
+            'air_bytes': {'raw': air_raw, 'compressed': air_packed},
+            'saved_pct': round(100.0 * (air_raw - air_packed) / air_raw, 1),
+        }
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark de compressão por ligação")
+    parser.add_argument("--messages", type=int, default=2000)
+    parser.add_argument("--json", action="store_true", help="saída em JSON")
+    args = parser.parse_args()
+
+    result = run(args.messages)
+    if args.json:
+        print(json.dumps(result, indent=2))
+    else:
+        p = result['payload_bytes']
+        print(f"[BENCH] {args.messages} mensagens | payload {p['raw']} -> {p['compressed']} bytes")
+        print(f"{'MTU':<5} | {'ESCRITAS':<15} | {'BYTES NO AR':<17} | POUPANÇA")
+        print("-" * 55)
+        for mtu, r in result['mtu'].items():
+            writes = f"{r['writes']['raw']} -> {r['writes']['compressed']}"
+            air = f"{r['air_bytes']['raw']} -> {r['air_bytes']['compressed']}"
+            print(f"{mtu:<5} | {writes:<15} | {air:<17} | {r['saved_pct']}%")
@@ -0,0 +1,198 @@
+# bench/bench_mesh.py
+"""
+Suite de benchmarks da malha (cadeia, estrela e árvore) sobre o transporte loopback,
+com os mesmos node.py/sink.py que correm nos rádios (ver bench/mesh.py).
+
+Por cenário mede:
+    - latência fim-a-fim (envio na folha -> entrega no Sink): p50/p90/p99/máx
+    - mensagens/s entregues no Sink
+    - atraso na fila de encaminhamento de cada hop (node/forwarding.py)
+    - CPU por mensagem (todo o processo: Nodes, Sink e rede emulada)
+    - tempo de reconvergência depois de cortar o uplink de um filho do Sink
+
+O resultado é JSON, para comparar entre versões.
+
+Uso: python bench/bench_mesh.py [--chain 1,2,5,10] [--star 4,8] [--tree 2x2,3x2]
+                                [--messages 50] [--mtu 23] [--out resultado.json]
+"""
+import argparse
+import asyncio
+import contextlib
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+
+sys.path.insert(0, os.path.abspath(os.path.dirname(__file__)))
+
+from mesh import ROOT, Mesh
+from common.loopback import LoopbackNetwork
+from common.frames import decode_frame
+from common.compression import frame_payload
+
+
+def percentile(values, pct):
+    """ Percentil pelo método nearest-rank (valores já ordenados). """
+    if not values:
+        return None
+    rank = max(1, -(-len(values) * pct // 100))
+    return values[int(rank) - 1]
+
+
+def git_version():
+    try:
+        return subprocess.run(["git", "describe", "--always", "--dirty"], cwd=ROOT,
+                              capture_output=True, text=True, timeout=5).stdout.strip() or None
+    except Exception:
+        return None
+
+
+async def build(mesh, topology, size, args):
+    if topology == "chain":
+        return await mesh.build_chain(size)
+    if topology == "star":
+        return await mesh.build_star(size)
+    depth, fanout = size
+    return await mesh.build_tree(depth, fanout, redundant=args.redundant)
+
+
+async def run_scenario(topology, size, args):
+    network = LoopbackNetwork(mtu=args.mtu, scan_time=0.0, seed=1, max_children=args.max_children)
+    mesh = Mesh(network, args.coalesce_ms, args.stream_window, args.compress, args.alias, args.standby)
+    try:
+        await build(mesh, topology, size, args)
+        sources = mesh.leaves()
+
+        # --- CARGA: cada folha envia `messages` mensagens seguidas, todas em paralelo ---
+        sent_at = {}
+
+        async def source(adapter, index):
+            for i in range(args.messages):
+                msg_id = f"{index}.{i}"
+                sent_at[msg_id] = time.perf_counter()
+                await mesh.send(adapter, f"bench {msg_id} ".ljust(args.size, "x"))
+
+        total = len(sources) * args.messages
+        cpu_start = time.process_time()
+        start = time.perf_counter()
+        await asyncio.gather(*(source(adapter, n) for n, adapter in enumerate(sources)))
+        await mesh.wait_received(total, timeout=args.timeout)
+        cpu = time.process_time() - cpu_start
+
+        latencies = []
+        last = start
+        for received_at, raw in mesh.received:
+            try:
+                text = frame_payload(decode_frame(raw)).decode("utf-8")
+                sent = sent_at[text.split()[1]]
+            except Exception:
+                continue
+            latencies.append(received_at - sent)
+            last = max(last, received_at)
+        latencies.sort()
+        delivered = len(latencies)
+
+        # --- FILAS POR HOP ---
+        queues = []
+        per_hop = {}
+        for adapter, node in mesh.nodes.items():
+            stats = node.forward_queue.stats()
+            queues.append({'node': adapter, 'hop': node.current_hop, **stats})
+            if stats['forwarded']:
+                per_hop.setdefault(node.current_hop, []).append(stats['wait_avg'])
+
+        # --- RECONVERGÊNCIA: corta o ramo da primeira folha junto ao Sink ---
+        top = sources[0]
+        while mesh.parents[top] in mesh.nodes:
+            top = mesh.parents[top]
+        mesh.network.kill_link(mesh.parents[top], top)
+        reconverge = await mesh.reconverge(sources[0], timeout=args.timeout)
+
+        ms = lambda v: None if v is None else round(v * 1000, 3)
+        return {
+            'topology': topology,
+            'size': size if topology != "tree" else {'depth': size[0], 'fanout': size[1]},
+            'nodes': len(mesh.nodes),
+            'sources': len(sources),
+            'messages': total,
+            'delivered': delivered,
+            'throughput_msg_s': round(delivered / (last - start), 1) if last > start else None,
+            'latency_ms': {
+                'p50': ms(percentile(latencies, 50)),
+                'p90': ms(percentile(latencies, 90)),
+                'p99': ms(percentile(latencies, 99)),
+                'max': ms(latencies[-1] if latencies else None),
+                'mean': ms(sum(latencies) / delivered if delivered else None),
+            },
+            'queue_wait_ms_per_hop': {hop: ms(sum(w) / len(w)) for hop, w in sorted(per_hop.items())},
+            'queues': [{**q, 'wait_avg': ms(q['wait_avg']), 'wait_max': ms(q['wait_max'])} for q in queues],
+            'cpu_us_per_msg': round(cpu / delivered * 1e6, 1) if delivered else None,
+            'air_bytes': mesh.network.stats['bytes'],
+            'reconverge_s': None if reconverge is None else round(reconverge, 3),
+        }
+    finally:
+        mesh.close()
+
+
+def scenarios(args):
+    for hops in args.chain:
+        yield "chain", hops
+    for children in args.star:
+        yield "star", children
+    for tree in args.tree:
+        yield "tree", tree
+
+
+def int_list(text):
+    return [int(v) for v in text.split(",") if v]
+
+
+def tree_list(text):
+    """ "2x2,3x2" -> [(2, 2), (3, 2)] (profundidade x filhos por nó). """
+    return [tuple(int(v) for v in item.split("x")) for item in text.split(",") if item]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmarks da malha (cadeia, estrela, árvore)")
+    parser.add_argument("--chain", type=int_list, default=[1, 2, 5, 10], help="hops de cada cadeia")
+    parser.add_argument("--star", type=int_list, default=[4, 8], help="filhos diretos do Sink")
+    parser.add_argument("--tree", type=tree_list, default=[(2, 2), (3, 2)], help="profundidade x filhos")
+    parser.add_argument("--messages", type=int, default=50, help="mensagens por folha")
+    parser.add_argument("--size", type=int, default=0, help="tamanho mínimo de cada mensagem (bytes)")
+    parser.add_argument("--mtu", type=int, default=23)
+    parser.add_argument("--coalesce-ms", type=float, default=0)
+    parser.add_argument("--stream-window", type=int, default=0)
+    parser.add_argument("--compress", action="store_true")
+    parser.add_argument("--alias", action="store_true")
+    parser.add_argument("--standby", type=float, default=0, help="sem scanner contínuo: intervalo dos scans do pai de reserva (s)")
+    parser.add_argument("--redundant", action="store_true", help="nas árvores, cada Node ouve os irmãos do pai")
+    parser.add_argument("--max-children", type=int, default=16,
+                        help="slots anunciados por servidor (um adaptador BlueZ aceita ~7)")
+    parser.add_argument("--timeout", type=float, default=60.0)
+    parser.add_argument("--out", help="ficheiro JSON (por omissão vai para o stdout)")
+    args = parser.parse_args()
+
+    result = {
+        'version': git_version(),
+        'timestamp': time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        'python': platform.python_version(),
+        'params': {k: v for k, v in vars(args).items() if k not in ('chain', 'star', 'tree', 'out')},
+        'scenarios': [],
+    }
+    for topology, size in scenarios(args):
+        # Os Nodes e o Sink imprimem cada mensagem; aqui só interessa o resultado
+        with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+            scenario = asyncio.run(run_scenario(topology, size, args))
+        result['scenarios'].append(scenario)
+        print(f"[BENCH] {topology} {size}: {scenario['delivered']}/{scenario['messages']} msgs, "
+              f"{scenario['throughput_msg_s']} msg/s, p99 {scenario['latency_ms']['p99']}ms, "
+              f"reconv {scenario['reconverge_s']}s", file=sys.stderr)
+
+    output = json.dumps(result, indent=2)
+    if args.out:
+        with open(args.out, 'w') as f:
+            f.write(output + "\n")
+    else:
+        print(output)
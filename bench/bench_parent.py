@@ -0,0 +1,179 @@
+# bench/bench_parent.py
+"""
+Compara as funções de custo da escolha do pai (node/selection.py) numa topologia
+simulada: N Nodes espalhados ao acaso num quadrado, o Sink num dos lados e ligações
+entre todos os pares ao alcance rádio.
+
+Em cada ligação a distância dá o RSSI (path loss log-distância + sombreamento fixo
+por par, e ruído em cada anúncio) e a probabilidade de entrega; as retransmissões
+da camada de ligação aparecem como latência (latência base x ETX real da ligação).
+Assim o RSSI é só um indicador imperfeito da qualidade, como nos rádios.
+
+Por função de custo, e por ronda (a partir da 2.ª os Nodes já têm o histórico RTT/perdas
+das ligações da ronda anterior):
+    - profundidade da árvore (hop máximo e médio)
+    - mensagens/s entregues no Sink e latência fim-a-fim p50/p99
+
+Uso: python bench/bench_parent.py [--nodes 16] [--scoring hop,etx] [--rounds 2]
+                                  [--messages 20] [--seed 1] [--out resultado.json]
+"""
+import argparse
+import asyncio
+import contextlib
+import json
+import math
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.abspath(os.path.dirname(__file__)))
+
+from mesh import Mesh
+from bench_mesh import percentile, git_version
+from common.loopback import LoopbackNetwork
+from common.frames import decode_frame
+from common.compression import frame_payload
+
+SIDE = 100.0          # lado do quadrado (m)
+RADIO_RANGE = 60.0    # acima disto não há ligação
+BASE_LATENCY = 0.005  # um sentido, ligação sem retransmissões (s)
+SHADOWING_DB = 4.0    # desvio padrão do sombreamento de cada par
+ADV_RSSI_JITTER = 6   # ruído de cada anúncio (dB)
+
+
+def make_topology(nodes, seed):
+    """ Posições e ligações (a, b, RSSI, ETX real), iguais para todas as funções de custo. """
+    rng = random.Random(seed)
+    pos = {'sink': (0.0, SIDE / 2)}
+    for i in range(1, nodes + 1):
+        pos[f"lo{i}"] = (rng.uniform(0, SIDE), rng.uniform(0, SIDE))
+    links = []
+    names = list(pos)
+    for i, a in enumerate(names):
+        for b in names[i + 1:]:
+            d = math.dist(pos[a], pos[b])
+            if d > RADIO_RANGE:
+                continue
+            rssi = -45 - 25 * math.log10(max(d, 1.0)) + rng.gauss(0, SHADOWING_DB)
+            delivery = 1.0 - 0.85 * (d / RADIO_RANGE) ** 3
+            links.append((a, b, round(rssi), 1.0 / delivery))
+    order = sorted((n for n in pos if n != 'sink'), key=lambda n: math.dist(pos[n], pos['sink']))
+    return order, links
+
+
+async def join(mesh, order, timeout):
+    """ Liga os Nodes por ordem de distância ao Sink, repetindo os que ainda não têm pai. """
+    pending = list(order)
+    deadline = time.perf_counter() + timeout
+    while pending and time.perf_counter() < deadline:
+        for adapter in list(pending):
+            if await mesh.connect(adapter):
+                pending.remove(adapter)
+        if pending:
+            await asyncio.sleep(0.1)
+    return pending
+
+
+async def measure(mesh, messages, timeout):
+    sent_at = {}
+    before = len(mesh.received)
+
+    async def source(adapter):
+        for i in range(messages):
+            msg_id = f"{adapter}.{i}.{len(sent_at)}"
+            sent_at[msg_id] = time.perf_counter()
+            await mesh.send(adapter, f"bench {msg_id}")
+
+    sources = [a for a, n in mesh.nodes.items() if n.current_hop > 0]
+    start = time.perf_counter()
+    await asyncio.gather(*(source(a) for a in sources))
+    await mesh.wait_received(before + len(sources) * messages, timeout=timeout)
+    latencies = []
+    last = start
+    for received_at, raw in mesh.received[before:]:
+        try:
+            sent = sent_at[frame_payload(decode_frame(raw)).decode("utf-8").split()[1]]
+        except Exception:
+            continue
+        latencies.append(received_at - sent)
+        last = max(last, received_at)
+    latencies.sort()
+    hops = [n.current_hop for n in mesh.nodes.values() if n.current_hop > 0]
+    ms = lambda v: None if v is None else round(v * 1000, 3)
+    return {
+        'joined': len(hops),
+        'depth_max': max(hops, default=0),
+        'depth_mean': round(sum(hops) / len(hops), 2) if hops else None,
+        'messages': len(sources) * messages,
+        'delivered': len(latencies),
+        'throughput_msg_s': round(len(latencies) / (last - start), 1) if last > start else None,
+        'latency_ms': {'p50': ms(percentile(latencies, 50)), 'p99': ms(percentile(latencies, 99))},
+    }
+
+
+async def run_scoring(scoring, order, links, args):
+    network = LoopbackNetwork(mtu=args.mtu, scan_time=0.0, seed=args.seed)
+    network.set_topology([(a, b) for a, b, _, _ in links])
+    for a, b, rssi, etx in links:
+        network.set_link(a, b, rssi=rssi, rssi_jitter=ADV_RSSI_JITTER, latency=BASE_LATENCY * etx)
+    mesh = Mesh(network, scoring=scoring)
+    try:
+        mesh.add_sink("sink")
+        for adapter in order:
+            await mesh.add_node(adapter)
+        # Primeiros anúncios na tabela de candidatos (e algumas amostras de RSSI)
+        await asyncio.sleep(1.0)
+
+        rounds = []
+        for r in range(args.rounds):
+            if r:
+                # Todos voltam a escolher pai, agora com o histórico das ligações anteriores
+                for adapter in reversed(order):
+                    await mesh.nodes[adapter].manual_disconnect()
+            unjoined = await join(mesh, order, args.timeout)
+            result = await measure(mesh, args.messages, args.timeout)
+            result['unjoined'] = unjoined
+            result['parents'] = {a: n.my_node_client.uplink_address for a, n in mesh.nodes.items()}
+            rounds.append(result)
+        return rounds
+    finally:
+        mesh.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Funções de custo da escolha do pai em topologia simulada")
+    parser.add_argument("--nodes", type=int, default=16)
+    parser.add_argument("--scoring", default="hop,etx", help="funções de custo a comparar")
+    parser.add_argument("--rounds", type=int, default=2)
+    parser.add_argument("--messages", type=int, default=20, help="mensagens por Node")
+    parser.add_argument("--mtu", type=int, default=23)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--timeout", type=float, default=60.0)
+    parser.add_argument("--out", help="ficheiro JSON (por omissão vai para o stdout)")
+    args = parser.parse_args()
+
+    order, links = make_topology(args.nodes, args.seed)
+    result = {
+        'version': git_version(),
+        'timestamp': time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        'params': {k: v for k, v in vars(args).items() if k != 'out'},
+        'links': len(links),
+        'scorings': {},
+    }
+    for scoring in args.scoring.split(","):
+        # Os Nodes e o Sink imprimem cada mensagem; aqui só interessa o resultado
+        with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+            rounds = asyncio.run(run_scoring(scoring, order, links, args))
+        result['scorings'][scoring] = rounds
+        for r, res in enumerate(rounds, 1):
+            print(f"[BENCH] {scoring} ronda {r}: hop máx {res['depth_max']} (média {res['depth_mean']}), "
+                  f"{res['delivered']}/{res['messages']} msgs, {res['throughput_msg_s']} msg/s, "
+                  f"p50 {res['latency_ms']['p50']}ms", file=sys.stderr)
+
+    output = json.dumps(result, indent=2)
+    if args.out:
+        with open(args.out, 'w') as f:
+            f.write(output + "\n")
+    else:
+        print(output)
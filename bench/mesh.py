@@ -0,0 +1,245 @@
+# bench/mesh.py
+"""
+Harness para correr uma malha completa (Sink + N Nodes) num só processo, sobre o
+transporte loopback. Cada Node é uma cópia independente do módulo node/node.py,
+por isso a lógica de routing/reset é exatamente a mesma que corre nos rádios.
+
+Uso: python bench/mesh.py --hops 5 --messages 200 [--mtu 247 --size 200]
+"""
+import argparse
+import asyncio
+import contextlib
+import importlib.util
+import os
+import sys
+import time
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, 'node'))
+# Depois do node/: os dois têm um ble_interface.py e o Node precisa do seu
+sys.path.append(os.path.join(ROOT, 'sink'))
+
+# RSSI das ligações alternativas: mais fraco, para o primeiro connect escolher o pai pedido
+BACKUP_RSSI = -70
+
+from common.transport import set_transport
+from common.loopback import LoopbackNetwork, set_network
+
+
+def load_script(path, name):
+    """ Carrega uma cópia nova de um script (globais próprias por instância). """
+    spec = importlib.util.spec_from_file_location(name, path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+class Mesh:
+    def __init__(self, network=None, coalesce_ms=0, stream_window=0, compress=False, alias=False, standby_s=0,
+                 scoring=None):
+        set_transport("loopback")
+        self.scoring = scoring
+        self.compress = compress
+        self.alias = alias
+        self.standby_s = standby_s
+        self.coalesce_ms = coalesce_ms
+        self.stream_window = stream_window
+        self.network = set_network(network or LoopbackNetwork(scan_time=0.0))
+        self.sink = None
+        self.sink_server = None
+        self.nodes = {}        # adapter -> módulo node.py
+        self.parents = {}      # adapter -> pai na topologia construída
+        self.received = []     # (instante, raw) tratados pela pipeline do Sink
+        self._waiters = []
+        self._loop = None
+
+    # --- CONSTRUÇÃO ---
+    def add_sink(self, adapter="sink"):
+        # Cópia nova do sink.py: cada Mesh tem a sua pipeline (fila de ingestão, workers)
+        self.sink = load_script(os.path.join(ROOT, 'sink', 'sink.py'), f"sink_{adapter}")
+        self._loop = asyncio.get_running_loop()
+        original = self.sink.process_batch
+
+        def process_batch(batch):
+            # Worker da fila de ingestão: a entrega conta depois do tratamento, não no put()
+            original(batch)
+            now = time.perf_counter()
+            self.received.extend((now, raw_data) for _, _, raw_data in batch)
+            self._loop.call_soon_threadsafe(self._wake_waiters)
+
+        self.sink.process_batch = process_batch
+        self.sink_server = self.sink.start_sink(adapter)
+        return self.sink
+
+    def _wake_waiters(self):
+        for waiter in list(self._waiters):
+            waiter()
+
+    def close(self):
+        """ Esvazia e pára a pipeline do Sink (os workers não podem sobreviver ao cenário). """
+        if self.sink and self.sink.ingest:
+            self.sink_server.stop()
+            self.sink.stop_pipeline()
+            self.sink.ingest = None
+
+    async def add_node(self, adapter):
+        node = load_script(os.path.join(ROOT, 'node', 'node.py'), f"node_{adapter}")
+        node.COALESCE_MS = self.coalesce_ms
+        node.STREAM_WINDOW = self.stream_window
+        node.COMPRESS = self.compress
+        node.ALIAS = self.alias
+        node.STANDBY_S = self.standby_s
+        if self.scoring:
+            node.PARENT_SCORING = self.scoring
+        await node.init_node(adapter)
+        self.nodes[adapter] = node
+        return node
+
+    async def connect(self, adapter):
+        """ Equivalente às opções 1 + 2 do menu do Node. """
+        node = self.nodes[adapter]
+        await node.my_node_client.scan_network_controls()
+        return await node.auto_connect()
+
+    async def build(self, parents, sink="sink", links=()):
+        """
+        Constrói a malha a partir de pares (node, pai), com os pais sempre antes dos
+        filhos. Cada Node só vê o pai e os filhos, por isso liga-se onde deve; `links`
+        junta pares extra ao alcance rádio (pais alternativos, para o failover).
+        """
+        self.network.set_topology(list(parents) + list(links))
+        for a, b in links:
+            self.network.set_link(a, b, rssi=BACKUP_RSSI)
+        self.parents.update(parents)
+        self.add_sink(sink)
+        for name, _ in parents:
+            await self.add_node(name)
+            if not await self.connect(name):
+                raise RuntimeError(f"{name} não conseguiu ligar-se")
+        return [name for name, _ in parents]
+
+    async def build_chain(self, hops, sink="sink"):
+        """ Sink <- lo1 <- lo2 <- ... <- loN. """
+        names = [sink] + [f"lo{i}" for i in range(1, hops + 1)]
+        return await self.build(list(zip(names[1:], names)), sink)
+
+    async def build_star(self, children, sink="sink"):
+        """ N Nodes ligados diretamente ao Sink. """
+        return await self.build([(f"lo{i}", sink) for i in range(1, children + 1)], sink)
+
+    async def build_tree(self, depth, fanout, sink="sink", redundant=False):
+        """
+        Árvore equilibrada: `fanout` filhos por nó, `depth` níveis de Nodes abaixo do Sink.
+        Com `redundant`, cada Node também ouve os irmãos do pai (pais de reserva).
+        """
+        parents = []
+        links = []
+        level = [sink]
+        for _ in range(depth):
+            next_level = []
+            for parent in level:
+                for _ in range(fanout):
+                    name = f"lo{len(parents) + 1}"
+                    parents.append((name, parent))
+                    next_level.append(name)
+                    if redundant:
+                        links += [(name, other) for other in level if other != parent]
+            level = next_level
+        return await self.build(parents, sink, links)
+
+    def leaves(self):
+        """ Nodes sem filhos na topologia atual. """
+        parents = set(self.parents.values())
+        return [adapter for adapter in self.nodes if adapter not in parents]
+
+    # --- MEDIÇÕES ---
+    async def send(self, adapter, message):
+        await self.nodes[adapter].my_node_client.send_message(message)
+
+    async def wait_received(self, count, timeout=30.0):
+        """ Espera até o Sink ter recebido `count` mensagens no total. """
+        if len(self.received) >= count:
+            return True
+        event = asyncio.Event()
+        check = lambda: len(self.received) >= count and event.set()
+        self._waiters.append(check)
+        try:
+            await asyncio.wait_for(event.wait(), timeout)
+            return True
+        except asyncio.TimeoutError:
+            return False
+        finally:
+            self._waiters.remove(check)
+
+    async def reconverge(self, probe_from, timeout=30.0):
+        """
+        Faz de operador: volta a ligar, por ordem, os Nodes isolados (Hop -1) até uma
+        mensagem de `probe_from` chegar de novo ao Sink. Devolve o tempo gasto ou None.
+        """
+        start = time.perf_counter()
+        while time.perf_counter() - start < timeout:
+            await asyncio.sleep(0.05)
+            for adapter, node in self.nodes.items():
+                if node.current_hop == -1:
+                    await self.connect(adapter)
+            client = self.nodes[probe_from].my_node_client.client
+            if client and client.is_connected:
+                before = len(self.received)
+                await self.send(probe_from, "probe")
+                if await self.wait_received(before + 1, timeout=0.5):
+                    return time.perf_counter() - start
+        return None
+
+
+async def run_chain(hops, messages, mtu=23, size=0, coalesce_ms=0, stream_window=0, alias=False):
+    mesh = Mesh(LoopbackNetwork(mtu=mtu, scan_time=0.0), coalesce_ms, stream_window,
+                alias=alias)
+    try:
+        nodes = await mesh.build_chain(hops)
+        leaf = nodes[-1]
+
+        start = time.perf_counter()
+        for i in range(messages):
+            await mesh.send(leaf, f"msg {i} ".ljust(size, "x"))
+        await mesh.wait_received(messages)
+        elapsed = time.perf_counter() - start
+        air_bytes = mesh.network.stats['bytes']
+
+        # Corta o uplink do primeiro Node e mede até a folha voltar a chegar ao Sink
+        mesh.network.kill_link("sink", nodes[0])
+        reconverge = await mesh.reconverge(leaf)
+    finally:
+        mesh.close()
+    return {
+        'hops': hops,
+        'delivered': min(len(mesh.received), messages),
+        'messages': messages,
+        'throughput': min(len(mesh.received), messages) / elapsed,
+        'air_bytes': air_bytes,
+        'reconverge_s': reconverge,
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Malha em memória (loopback)")
+    parser.add_argument("--hops", type=int, default=3)
+    parser.add_argument("--messages", type=int, default=100)
+    parser.add_argument("--mtu", type=int, default=23)
+    parser.add_argument("--size", type=int, default=0, help="tamanho mínimo de cada mensagem (bytes)")
+    parser.add_argument("--coalesce-ms", type=float, default=0, help="janela de coalescing dos Nodes")
+    parser.add_argument("--stream-window", type=int, default=0, help="créditos do modo write-without-response")
+    parser.add_argument("--alias", action="store_true", help="aliases de NID nos uplinks")
+    args = parser.parse_args()
+
+    # Os Nodes e o Sink imprimem cada mensagem; aqui só interessa o resultado
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        result = asyncio.run(run_chain(args.hops, args.messages, args.mtu, args.size,
+                                     args.coalesce_ms, args.stream_window, args.alias))
+
+    print(f"[BENCH] Cadeia de {result['hops']} hops: {result['delivered']}/{result['messages']} msgs "
+          f"({result['throughput']:.1f} msg/s, {result['air_bytes']} bytes escritos)")
+    if result['reconverge_s'] is None:
+        print("[BENCH] Reconvergência: FALHOU")
+    else:
+        print(f"[BENCH] Reconvergência: {result['reconverge_s']:.2f}s")
@@ -0,0 +1,54 @@
+# common/advert.py
+"""
+Estado do Node anunciado em ServiceData (sob CHAT_SERVICE_UUID), para os scanners
+escolherem o pai sem olhar para o LocalName.
+
+6 bytes, big-endian:
+    byte 0     versão do formato
+    byte 1     hop (i8; 0 = Sink, -1 = isolado)
+    byte 2     slots livres para filhos (u8)
+    byte 3     nível de carga (0 = livre ... LOAD_LEVELS-1 = saturado)
+    bytes 4-5  NID curto (últimos 2 bytes do NID)
+
+Num anúncio legacy de 31 bytes isto ocupa 24 (2 de cabeçalho AD + UUID de 128 bits +
+6), por isso o ServiceUUIDs deixa de ir no anúncio: o próprio ServiceData identifica
+o serviço. O filtro de UUIDs do BlueZ/Bleak só vê o ServiceUUIDs, por isso o scanner
+dos Nodes corre sem filtro e reconhece o serviço pela chave do ServiceData.
+Scanners antigos continuam a ver o serviço pelo nome e pelo ServiceUUIDs de Nodes antigos.
+"""
+import struct
+
+ADV_VERSION = 1
+ADV_DATA = struct.Struct("!BbBB2s")
+# Ligações simultâneas que um adaptador BlueZ aceita como periférico (típico)
+MAX_CHILDREN = 7
+LOAD_LEVELS = 4
+
+
+def encode_adv_data(hop, free_slots, load=0, nid_short=b"\x00\x00"):
+    hop = max(min(hop, 127), -1)
+    return ADV_DATA.pack(ADV_VERSION, hop, max(min(free_slots, 255), 0), min(load, LOAD_LEVELS - 1),
+                         bytes(nid_short[-2:]).rjust(2, b"\x00"))
+
+
+def decode_adv_data(data):
+    """ Devolve (hop, slots livres, carga, NID curto) ou None se não perceber o formato. """
+    if not data or len(data) < ADV_DATA.size or data[0] != ADV_VERSION:
+        return None
+    _, hop, free_slots, load, nid_short = ADV_DATA.unpack_from(bytes(data))
+    return hop, free_slots, load, nid_short
+
+
+def load_level(depth, capacity, current=0):
+    """
+    Ocupação da fila de encaminhamento reduzida a LOAD_LEVELS níveis. Com `current`
+    (o nível anunciado) há histerese: sobe logo, mas só desce quando a fila fica meio
+    nível abaixo da fronteira, para uma fila a oscilar numa fronteira não reiniciar o
+    anúncio a cada frame.
+    """
+    if capacity <= 0:
+        return 0
+    level = min(depth * LOAD_LEVELS // capacity, LOAD_LEVELS - 1)
+    if level < current and depth * LOAD_LEVELS * 2 >= (2 * current - 1) * capacity:
+        return current
+    return level
@@ -0,0 +1,97 @@
+# common/alias.py
+"""
+Aliases de NID por ligação: troca os 16 bytes do NID do originador por 1 byte.
+
+Cada ligação (cliente -> servidor) tem a sua tabela. A primeira frame de um NID
+anuncia o alias (bind) e as seguintes levam só o alias:
+    bind    (23 bytes)  versão|tipo, flags|FLAG_ALIAS|FLAG_ALIAS_BIND, alias, NID, seq, tamanho
+    alias   (7 bytes)   versão|tipo, flags|FLAG_ALIAS, alias, seq, tamanho
+O servidor (LinkReceiver) repõe o cabeçalho normal de 22 bytes antes de entregar a
+frame, por isso nada acima da ligação vê aliases.
+
+As duas tabelas são limitadas e com LRU. O cliente limpa a sua a cada ligação nova e
+o servidor esquece a do emissor quando este se desliga. Se o servidor receber um
+alias que não conhece, descarta a frame e notifica TYPE_ALIAS_RESET: o cliente volta
+a anunciar os NIDs.
+"""
+import struct
+from collections import OrderedDict
+
+from common.frames import (FRAME_VERSION, TYPE_ALIAS_RESET, FLAG_ALIAS, FLAG_ALIAS_BIND, HEADER,
+                           HEADER_LEN, FrameError)
+
+ALIAS_HEADER = struct.Struct("!BBBHH")
+BIND_HEADER = struct.Struct("!BBB16sHH")
+MAX_ALIASES = 256
+_RESET = bytes([(FRAME_VERSION << 4) | TYPE_ALIAS_RESET])
+
+
+def is_aliased(data):
+    return len(data) >= ALIAS_HEADER.size and bool(data[1] & FLAG_ALIAS)
+
+
+def is_alias_reset(data):
+    return bytes(data) == _RESET
+
+
+def encode_alias_reset():
+    return _RESET
+
+
+class AliasEncoder:
+    """ Lado cliente: NID -> alias, com os `capacity` NIDs usados mais recentemente. """
+    def __init__(self, capacity=64):
+        if not 0 < capacity <= MAX_ALIASES:
+            raise ValueError(f"Capacidade de aliases inválida: {capacity}")
+        self.capacity = capacity
+        self.table = OrderedDict()  # NID -> alias
+        self.binds = 0
+        self.hits = 0
+
+    def reset(self):
+        self.table.clear()
+
+    def encode(self, frame):
+        """ Recebe uma frame normal e devolve-a com o cabeçalho curto (o payload não é descodificado). """
+        ver_type, flags, nid, seq, length = HEADER.unpack_from(frame)
+        payload = memoryview(frame)[HEADER_LEN:]
+        alias = self.table.get(nid)
+        if alias is not None:
+            self.table.move_to_end(nid)
+            self.hits += 1
+            return ALIAS_HEADER.pack(ver_type, flags | FLAG_ALIAS, alias, seq, length) + payload
+
+        if len(self.table) < self.capacity:
+            alias = len(self.table)
+        else:
+            _, alias = self.table.popitem(last=False)  # reaproveita o alias do NID mais antigo
+        self.table[nid] = alias
+        self.binds += 1
+        return BIND_HEADER.pack(ver_type, flags | FLAG_ALIAS | FLAG_ALIAS_BIND, alias, nid, seq, length) + payload
+
+
+class AliasDecoder:
+    """ Lado servidor: alias -> NID para um emissor. """
+    def __init__(self):
+        self.slots = [None] * MAX_ALIASES
+
+    def decode(self, data):
+        """ Devolve a frame com o cabeçalho normal, ou None se o alias não for conhecido. """
+        flags = data[1]
+        if flags & FLAG_ALIAS_BIND:
+            if len(data) < BIND_HEADER.size:
+                raise FrameError(f"Bind de alias curto ({len(data)} bytes)")
+            ver_type, _, alias, nid, seq, length = BIND_HEADER.unpack_from(data)
+            self.slots[alias] = nid
+            offset = BIND_HEADER.size
+        else:
+            ver_type, _, alias, seq, length = ALIAS_HEADER.unpack_from(data)
+            nid = self.slots[alias]
+            if nid is None:
+                return None
+            offset = ALIAS_HEADER.size
+        if len(data) - offset != length:
+            raise FrameError(f"Tamanho inválido: cabeçalho diz {length}, recebidos {len(data) - offset}")
+        flags &= ~(FLAG_ALIAS | FLAG_ALIAS_BIND)
+        return HEADER.pack(ver_type, flags, nid, seq, length) + data[offset:]
+
@@ -6,6 +6,11 @@ from gi.repository import GLib
 import threading
 import time
 
+from common.link import LinkReceiver
+from common.children import WHEEL_TICK
+from common.advert import encode_adv_data, MAX_CHILDREN
+from common.frames import encode_capabilities
+
 # UUIDs
 CHAT_SERVICE_UUID = "12345678-1234-5678-1234-56789abcdef0"
 CHAT_MSG_UUID     = "12345678-1234-5678-1234-56789abcdef1"
@@ -18,6 +23,11 @@ LE_ADVERTISING_MANAGER_IFACE = 'org.bluez.LEAdvertisingManager1'
 LE_ADVERTISEMENT_IFACE = 'org.bluez.LEAdvertisement1'
 GATT_CHARACTERISTIC_IFACE = 'org.bluez.GattCharacteristic1'
 GATT_SERVICE_IFACE = 'org.bluez.GattService1'
+DEVICE_IFACE = 'org.bluez.Device1'
+
+def _address(device_path):
+    """ '/org/bluez/hci0/dev_AA_BB_CC_DD_EE_FF' -> 'AA:BB:CC:DD:EE:FF' """
+    return device_path.rsplit('dev_', 1)[-1].replace('_', ':')
 
 class InvalidArgsException(dbus.exceptions.DBusException):
     _dbus_error_name = 'org.freedesktop.DBus.Error.InvalidArgs'
@@ -79,19 +89,41 @@ class Characteristic(dbus.service.Object):
 
 class ChatChrc(Characteristic):
     def __init__(self, bus, index, service, callback):
-        Characteristic.__init__(self, bus, index, CHAT_MSG_UUID, ['write', 'write-without-response', 'notify'], service)
+        Characteristic.__init__(self, bus, index, CHAT_MSG_UUID, ['read', 'write', 'write-without-response', 'notify'], service)
         self.callback = callback 
+        self.notifying = False
+        self.link = LinkReceiver(notify=self.notify)
 
     @dbus.service.method(GATT_CHARACTERISTIC_IFACE, in_signature='aya{sv}', out_signature='ay')
     def WriteValue(self, value, options):
         try:
-            raw = bytes(value).decode("utf-8", errors="ignore")
-            if self.callback:
-                self.callback(raw)
+            # Frames binárias (common/frames.py); fragmentos/batches são tratados por dispositivo emissor
+            command = str(options.get('type', '')) == 'command'
+            device_path = str(options.get('device', ''))
+            for frame in self.link.receive(device_path, bytes(value), command):
+                if self.callback:
+                    self.callback(frame, _address(device_path))
         except Exception as e:
             print(f"[SERVER-ERR] {e}")
         return dbus.Array([], signature='y')
 
+    # A leitura devolve as capacidades do servidor (codecs de compressão suportados)
+    @dbus.service.method(GATT_CHARACTERISTIC_IFACE, in_signature='a{sv}', out_signature='ay')
+    def ReadValue(self, options):
+        return dbus.Array([dbus.Byte(b) for b in encode_capabilities()], signature='y')
+
+    # --- NOTIFICAÇÕES (créditos do modo write-without-response) ---
+    @dbus.service.method(GATT_CHARACTERISTIC_IFACE, in_signature='', out_signature='')
+    def StartNotify(self): self.notifying = True
+    @dbus.service.method(GATT_CHARACTERISTIC_IFACE, in_signature='', out_signature='')
+    def StopNotify(self): self.notifying = False
+    @dbus.service.signal(DBUS_PROP_IFACE, signature='sa{sv}as')
+    def PropertiesChanged(self, interface, changed, invalidated): pass
+
+    def notify(self, value):
+        if not self.notifying: return
+        self.PropertiesChanged(GATT_CHARACTERISTIC_IFACE, {'Value': dbus.Array([dbus.Byte(b) for b in value], signature='y')}, [])
+
 class Advertisement(dbus.service.Object):
     PATH_BASE = '/org/bluez/example/advertisement'
     def __init__(self, bus, index, advertising_type):
@@ -99,15 +131,16 @@ class Advertisement(dbus.service.Object):
         self.bus = bus
         self.ad_type = advertising_type
         self.local_name = "Init"
-        self.service_uuids = [CHAT_SERVICE_UUID]
+        # Hop, slots, carga e NID curto (common/advert.py); identifica também o serviço
+        self.service_data = encode_adv_data(-1, MAX_CHILDREN)
         dbus.service.Object.__init__(self, bus, self.path)
 
     def get_properties(self):
         properties = dict()
         properties['Type'] = self.ad_type
         properties['LocalName'] = dbus.String(self.local_name)
-        properties['ServiceUUIDs'] = dbus.Array(self.service_uuids, signature='s')
-        properties['Includes'] = dbus.Array(["tx-power"], signature='s')
+        properties['ServiceData'] = dbus.Dictionary(
+            {CHAT_SERVICE_UUID: dbus.Array([dbus.Byte(b) for b in self.service_data], signature='y')}, signature='sv')
         return {LE_ADVERTISEMENT_IFACE: properties}
 
     def get_path(self): return dbus.ObjectPath(self.path)
@@ -115,26 +148,119 @@ class Advertisement(dbus.service.Object):
     def update_local_name(self, new_name):
         self.local_name = new_name
 
+    def content(self):
+        """ O que vai no ar: se não mudar, não é preciso voltar a registar. """
+        return (self.local_name, self.service_data)
+
     @dbus.service.method(DBUS_PROP_IFACE, in_signature='s', out_signature='a{sv}')
     def GetAll(self, interface): return self.get_properties()[LE_ADVERTISEMENT_IFACE]
     @dbus.service.method(LE_ADVERTISEMENT_IFACE, in_signature='', out_signature='')
     def Release(self): pass
 
+# --- MÁQUINA DE ESTADOS DO ANÚNCIO ---
+ADV_MIN_BACKOFF = 1.0
+ADV_MAX_BACKOFF = 60.0
+
+class AdvertisingController:
+    """
+    Único ponto que faz Unregister/RegisterAdvertisement (corre no loop GLib).
+
+    Há um só reinício pendente: pedidos que chegam com um já agendado juntam-se a ele
+    (contados em `coalesced`). Se o conteúdo não mudou e o anúncio continua ativo, o
+    reinício é saltado; uma ligação nova marca o anúncio como suspeito (alguns
+    controladores deixam de anunciar quando aceitam uma ligação). Erros do BlueZ
+    voltam a tentar com backoff exponencial.
+    """
+    def __init__(self, ad_manager, adv, refresh=None):
+        self.ad_manager = ad_manager
+        self.adv = adv
+        self.refresh = refresh  # chamado antes de cada reinício para atualizar o conteúdo
+        self.active = False
+        self.registered = None  # conteúdo do último registo com sucesso
+        self.backoff = ADV_MIN_BACKOFF
+        self._pending = None    # (id da fonte GLib, instante previsto)
+        self._busy = False      # pedido D-Bus em curso
+        self.counters = {'requests': 0, 'coalesced': 0, 'skipped': 0, 'restarts': 0, 'errors': 0}
+
+    def request(self, delay=0.0):
+        """ Pede que o anúncio fique ativo e atualizado daqui a `delay` segundos. """
+        self.counters['requests'] += 1
+        due = time.monotonic() + delay
+        if self._pending:
+            self.counters['coalesced'] += 1
+            source, pending_due = self._pending
+            if pending_due <= due:
+                return
+            GLib.source_remove(source)
+        self._pending = (GLib.timeout_add(int(delay * 1000), self._run), due)
+
+    def invalidate(self, delay):
+        """ O anúncio pode ter sido parado pelo controlador: reinicia mesmo sem mudanças. """
+        self.active = False
+        self.request(delay)
+
+    def _run(self):
+        self._pending = None
+        if self._busy:
+            self.request(self.backoff)
+            return False
+        if self.refresh:
+            self.refresh()
+        content = self.adv.content()
+        if self.active and content == self.registered:
+            self.counters['skipped'] += 1
+            return False
+
+        self.counters['restarts'] += 1
+        self._busy = True
+        try: self.ad_manager.UnregisterAdvertisement(self.adv.get_path())
+        except: pass
+        try:
+            self.ad_manager.RegisterAdvertisement(self.adv.get_path(), {},
+                                                  reply_handler=lambda: self._on_registered(content),
+                                                  error_handler=self._on_error)
+        except Exception as e:
+            self._on_error(e)
+        return False
+
+    def _on_registered(self, content):
+        self._busy = False
+        self.active = True
+        self.registered = content
+        self.backoff = ADV_MIN_BACKOFF
+
+    def _on_error(self, error):
+        self._busy = False
+        self.active = False
+        self.counters['errors'] += 1
+        if "AlreadyExists" not in str(error):
+            print(f"[SERVER] Erro no anúncio: {error}. Nova tentativa em {self.backoff:.0f}s")
+        self.request(self.backoff)
+        self.backoff = min(self.backoff * 2, ADV_MAX_BACKOFF)
+
+    def stats(self):
+        return dict(self.counters, active=self.active, backoff=self.backoff)
+
 # --- CLASSE GERAL DO SERVIDOR ---
 class BLEServer:
-    def __init__(self, adapter_interface, on_data_received, local_name):
+    def __init__(self, adapter_interface, on_data_received, local_name, hop=-1, nid=b""):
         self.adapter_interface = adapter_interface
         self.on_data_received = on_data_received
         self.local_name = local_name
+        self.hop = hop
+        self.load = 0
+        self.nid = nid
         self.mainloop = None
         self.bus = None
         self.thread = None
+        self.keep = set()  # endereços que o servidor nunca desliga (o nosso uplink)
         
         self.ad_manager = None
         self.service_manager = None
         self.app = None
         self.adv = None
-        self.retry_count = 0
+        self.advertising = None
+        self.chat_chrc = None
 
     def _run(self):
         dbus.mainloop.glib.DBusGMainLoop(set_as_default=True)
@@ -151,7 +277,8 @@ class BLEServer:
 
         self.app = Application(self.bus)
         service = Service(self.bus, '/org/bluez/example/service', 0, CHAT_SERVICE_UUID, True)
-        service.add_characteristic(ChatChrc(self.bus, 0, service, self.on_data_received))
+        self.chat_chrc = ChatChrc(self.bus, 0, service, self.on_data_received)
+        service.add_characteristic(self.chat_chrc)
         self.app.add_service(service)
 
         self.adv = Advertisement(self.bus, 0, 'peripheral')
@@ -163,103 +290,113 @@ class BLEServer:
 
         # Registo inicial
         self.service_manager.RegisterApplication(self.app.get_path(), {}, reply_handler=register_cb, error_handler=register_error_cb)
-        self.ad_manager.RegisterAdvertisement(self.adv.get_path(), {}, reply_handler=register_cb, error_handler=register_error_cb)
+        self.advertising = AdvertisingController(self.ad_manager, self.adv, refresh=self._refresh_adv)
+        self.advertising.request()
 
         # --- CORREÇÃO DE VISIBILIDADE PERSISTENTE ---
+        # Só os dispositivos deste adaptador (outros adaptadores e processos usam o mesmo bus)
+        device_prefix = adapter_path + "/"
+
         def device_connected_handler(interface, changed, invalidated, path):
+            if not str(path).startswith(device_prefix):
+                return
             if interface == 'org.bluez.Device1' and 'Connected' in changed:
                 connected = changed['Connected']
                 if connected:
-                    # Se alguém se conecta, tenta restaurar a visibilidade após 2s e 5s
-                    # print(f"[SERVER] Conexão detetada. A restaurar visibilidade...")
-                    GLib.timeout_add_seconds(2, self._force_restart_adv_internal)
-                    GLib.timeout_add_seconds(5, self._force_restart_adv_internal)
+                    self.chat_chrc.link.children.connected(str(path))
+                    # Se alguém se conecta, o controlador pode ter parado o anúncio
+                    self.advertising.invalidate(2.0)
                 else:
-                    # Se desconecta, restaura imediatamente
-                    GLib.timeout_add_seconds(1, self._force_restart_adv_internal)
+                    self.chat_chrc.link.forget(str(path))
+                    self.advertising.invalidate(1.0)
 
         self.bus.add_signal_receiver(device_connected_handler, dbus_interface="org.freedesktop.DBus.Properties", signal_name="PropertiesChanged", path_keyword="path")
 
+        # Um só timer para todos os downlinks (roda de temporização em common/children.py)
+        GLib.timeout_add(int(WHEEL_TICK * 1000), self._reap_idle_children)
+
         self.mainloop = GLib.MainLoop()
         try:
             self.mainloop.run()
         except:
             pass
 
+    # --- DOWNLINKS INATIVOS ---
+    def _reap_idle_children(self):
+        # Filho calado há demasiado tempo: liberta o slot de ligação sem esperar pelo BlueZ
+        for path in self.chat_chrc.link.children.expire():
+            if _address(path) in self.keep:
+                continue
+            print(f"[SERVER] Downlink inativo: {path}. A desligar...")
+            self.chat_chrc.link.forget(path)
+            self._disconnect_device(path)
+        return True
+
+    def children(self):
+        """ Estado dos downlinks (última escrita, frames, bytes, tempo de ligação). """
+        return self.chat_chrc.link.children.stats() if self.chat_chrc else []
+
     def start(self):
         self.thread = threading.Thread(target=self._run, daemon=True)
         self.thread.start()
 
-    def update_advertisement(self, new_name):
+    def update_advertisement(self, new_name, hop=None, load=None):
+        # Só a carga mudou: não há pressa, e as mudanças seguintes juntam-se ao mesmo reinício
+        delay = ADV_MIN_BACKOFF if new_name == self.local_name and hop is None else 0.0
         self.local_name = new_name
-        if self.adv: self.adv.update_local_name(new_name)
-        if self.mainloop: GLib.idle_add(self._force_restart_adv_internal)
-
-    # --- TENTA FORÇAR O ANÚNCIO A FICAR ATIVO ---
-    def _force_restart_adv_internal(self):
-        # 1. Tenta Parar
-        try: self.ad_manager.UnregisterAdvertisement(self.adv.get_path())
-        except: pass
-        
-        # 2. Tenta Iniciar
-        try: 
-            self.ad_manager.RegisterAdvertisement(self.adv.get_path(), {}, reply_handler=lambda:None, error_handler=self._adv_error_handler)
-            # print(f"[SERVER] Visibilidade restaurada: {self.local_name}")
-            return False # Pára o timeout se tiver sucesso
-        except:
-            return True # Tenta de novo se falhar imediatamente
+        if hop is not None: self.hop = hop
+        if load is not None: self.load = load
+        if self.mainloop: GLib.idle_add(self._advertise_name, delay)
 
-    def _adv_error_handler(self, error):
-        # Se der erro (ex: AlreadyExists), agendamos nova tentativa
-        # print(f"[SERVER] Aviso Adv: {error}. A tentar de novo...")
-        GLib.timeout_add_seconds(2, self._force_restart_adv_internal)
+    def _advertise_name(self, delay=0.0):
+        # Corre no loop GLib: a máquina de estados decide se é preciso voltar a registar
+        self.advertising.request(delay)
+        return False
 
-    # --- RESTART TOTAL (RESET) ---
-    def restart_server(self, new_name):
+    def _refresh_adv(self):
+        free = MAX_CHILDREN - len(self.chat_chrc.link.children.connected_keys())
+        self.adv.update_local_name(self.local_name)
+        self.adv.service_data = encode_adv_data(self.hop, free, self.load, self.nid)
+
+    def adv_stats(self):
+        """ Contadores do anúncio (pedidos, juntos, saltados, reinícios, erros). """
+        return self.advertising.stats() if self.advertising else {}
+
+    def keep_connected(self, addresses):
+        """ Dispositivos ligados a este adaptador que não são downlinks (ex: o uplink). """
+        self.keep = {a for a in addresses if a}
+
+    # --- RESET DE TOPOLOGIA ---
+    def restart_server(self, new_name, keep=(), hop=-1):
+        """
+        Desliga só os downlinks (Device1.Disconnect) e muda o hop anunciado; a aplicação
+        GATT continua registada. `keep` são endereços a não desligar (o nosso uplink,
+        que também aparece como dispositivo ligado neste adaptador).
+        """
         self.local_name = new_name
-        self.retry_count = 0
+        self.hop = hop
+        self.keep_connected(keep)
         if self.mainloop:
-            GLib.idle_add(self._step1_shutdown)
-    
-    def _step1_shutdown(self):
-        print(f"[SERVER] A desligar serviços (Kick)...")
-        if self.ad_manager:
-            try: self.ad_manager.UnregisterAdvertisement(self.adv.get_path())
-            except: pass
-        if self.service_manager:
-            try: self.service_manager.UnregisterApplication(self.app.get_path())
-            except: pass
-        
-        print(f"[SERVER] A aguardar 5s para garantir desconexão...")
-        GLib.timeout_add_seconds(5, self._step2_start_services)
+            GLib.idle_add(self._kick_children, set(keep))
+
+    def _kick_children(self, keep):
+        # Todos os ligados, mesmo os que ainda não escreveram (ficariam com o hop antigo);
+        # o uplink está protegido por `keep` / keep_connected()
+        keep = keep | self.keep
+        children = [p for p in self.chat_chrc.link.children.connected_keys() if _address(p) not in keep]
+        print(f"[SERVER] A desligar {len(children)} downlink(s) e a anunciar '{self.local_name}'")
+        for path in children:
+            self.chat_chrc.link.forget(path)
+            self._disconnect_device(path)
+        self._advertise_name()
         return False
 
-    def _step2_start_services(self):
-        print(f"[SERVER] Tentativa {self.retry_count+1}: A iniciar como '{self.local_name}'")
-        self.adv.update_local_name(self.local_name)
-        
+    def _disconnect_device(self, path):
         try:
-            self.service_manager.RegisterApplication(self.app.get_path(), {}, reply_handler=lambda:None, error_handler=self._on_register_error)
-            self.ad_manager.RegisterAdvertisement(self.adv.get_path(), {}, reply_handler=lambda:None, error_handler=self._on_register_error)
+            device = dbus.Interface(self.bus.get_object(BLUEZ_SERVICE_NAME, path), DEVICE_IFACE)
+            device.Disconnect(reply_handler=lambda: None, error_handler=lambda e: None)
         except Exception as e:
-            self._on_register_error(e)
-        return False
-
-    def _on_register_error(self, error):
-        err_str = str(error)
-        if "AlreadyExists" in err_str or "NoReply" in err_str:
-            try: self.ad_manager.UnregisterAdvertisement(self.adv.get_path())
-            except: pass
-            try: self.service_manager.UnregisterApplication(self.app.get_path())
-            except: pass
-            
-            self.retry_count += 1
-            if self.retry_count < 10: 
-                GLib.timeout_add_seconds(2, self._step2_start_services)
-            else:
-                print("[SERVER] FALHA: Não foi possível reiniciar.")
-        else:
-            print(f"[SERVER] Erro: {err_str}")
+            print(f"[SERVER] Falha ao desligar {path}: {e}")
 
     def stop(self):
         if self.mainloop:
@@ -0,0 +1,127 @@
+# common/children.py
+"""
+Tabela de downlinks (filhos) do lado servidor.
+
+Cada dispositivo que se liga ou escreve na característica de Chat fica com:
+instante da ligação, última escrita, frames e bytes recebidos. Um filho calado há
+mais de `idle_timeout` segundos é dado como morto, para o servidor o desligar
+ativamente em vez de esperar pelo supervision timeout do BlueZ. O prazo conta
+desde a ligação: um dispositivo que se liga e nunca escreve também é expirado (o
+servidor não desliga os que quer manter, como o próprio uplink).
+
+O prazo por omissão vem do SIC_HEARTBEAT_S deste processo; um filho que anuncia o
+seu intervalo de heartbeat (common/frames.py) fica com IDLE_HEARTBEATS intervalos
+dele, se for mais do que isso, para um filho com heartbeats mais espaçados do que
+os do pai não ser desligado estando vivo.
+
+Os prazos ficam numa roda de temporização (uma só para todos os filhos): cada
+escrita só atualiza `last_seen` (O(1)); quando a roda passa pelo slot de um
+filho, este é expirado ou reagendado para o seu novo prazo.
+"""
+import os
+import time
+
+# Os Nodes enviam heartbeat ao fim de SIC_HEARTBEAT_S sem tráfego (node/liveness.py):
+# três períodos calado é um filho morto. SIC_CHILD_IDLE_S fixa outro valor.
+IDLE_HEARTBEATS = 3
+HEARTBEAT_S = float(os.environ.get("SIC_HEARTBEAT_S", "2.0"))
+CHILD_IDLE_TIMEOUT = float(os.environ.get("SIC_CHILD_IDLE_S", "0")) or IDLE_HEARTBEATS * HEARTBEAT_S
+WHEEL_TICK = 1.0
+
+
+class Child:
+    __slots__ = ('key', 'connected_at', 'last_seen', 'frames', 'bytes', 'slot', 'timeout')
+
+    def __init__(self, key, connected_at, now, timeout):
+        self.key = key
+        self.timeout = timeout
+        self.connected_at = connected_at
+        self.last_seen = now
+        self.frames = 0
+        self.bytes = 0
+        self.slot = None
+
+
+class ChildTable:
+    def __init__(self, idle_timeout=CHILD_IDLE_TIMEOUT, tick=WHEEL_TICK):
+        self.idle_timeout = idle_timeout
+        self.tick = tick
+        self.children = {}       # emissor -> Child
+        self.evicted = 0
+        self._wheel = [set() for _ in range(int(idle_timeout / tick) + 2)]
+        self._tick_done = int(time.monotonic() / tick)
+
+    def _add(self, key, now):
+        child = self.children[key] = Child(key, now, now, self.idle_timeout)
+        self._schedule(child, int((now + self.idle_timeout) / self.tick) + 1)
+        return child
+
+    def connected(self, key):
+        """ Sinal de ligação: o prazo começa já, mesmo que o dispositivo nunca escreva. """
+        now = time.monotonic()
+        child = self.children.get(key)
+        if child is None:
+            self._add(key, now)
+        else:
+            child.last_seen = now
+
+    def touch(self, key, nbytes):
+        """ Chamado em cada escrita recebida; devolve o Child. """
+        now = time.monotonic()
+        child = self.children.get(key)
+        if child is None:
+            child = self._add(key, now)
+        child.last_seen = now
+        child.bytes += nbytes
+        return child
+
+    def heartbeat(self, key, interval):
+        """ Intervalo de heartbeat anunciado pelo filho: o prazo nunca fica abaixo do por omissão. """
+        child = self.children.get(key)
+        if child is not None:
+            child.timeout = max(self.idle_timeout, IDLE_HEARTBEATS * interval)
+
+    def connected_keys(self):
+        """ Todos os dispositivos ligados que conhecemos (com ou sem escritas). """
+        return list(self.children)
+
+    def remove(self, key):
+        child = self.children.pop(key, None)
+        if child is not None and child.slot is not None:
+            self._wheel[child.slot].discard(key)
+
+    def _schedule(self, child, tick):
+        child.slot = tick % len(self._wheel)
+        self._wheel[child.slot].add(child.key)
+
+    def expire(self):
+        """ Avança a roda até agora e devolve os filhos inativos (já retirados da tabela). """
+        now = time.monotonic()
+        current = int(now / self.tick)
+        # Se o relógio saltou mais do que uma volta, basta percorrer a roda uma vez
+        start = max(self._tick_done + 1, current - len(self._wheel) + 1)
+        self._tick_done = current
+        idle = []
+        for t in range(start, current + 1):
+            slot = self._wheel[t % len(self._wheel)]
+            for key in list(slot):
+                slot.discard(key)
+                child = self.children[key]
+                deadline = child.last_seen + child.timeout
+                if deadline <= now:
+                    del self.children[key]
+                    self.evicted += 1
+                    idle.append(key)
+                else:
+                    self._schedule(child, max(int(deadline / self.tick) + 1, current + 1))
+        return idle
+
+    def stats(self):
+        now = time.monotonic()
+        return [{
+            'device': c.key,
+            'connected_s': round(now - c.connected_at, 1),
+            'idle_s': round(now - c.last_seen, 1),
+            'frames': c.frames,
+            'bytes': c.bytes,
+        } for c in self.children.values()]
@@ -0,0 +1,71 @@
+# common/compression.py
+"""
+Compressão opcional do payload das frames DATA.
+
+Codec único (por agora): deflate "raw" (sem cabeçalho zlib nem adler32) com um
+dicionário pré-definido com o vocabulário típico das mensagens dos sensores, para
+que mesmo mensagens de 20-40 bytes encolham. Uma frame comprimida leva FLAG_COMPRESSED;
+os relays encaminham-na tal como está e só o Sink a descomprime.
+
+A negociação é feita por ligação: o NodeClient só comprime se o uplink anunciar
+CAP_DEFLATE_DICT nas capacidades devolvidas pelo ReadValue (common/frames.py).
+"""
+import zlib
+
+from common.frames import FLAG_COMPRESSED, HEADER_LEN, MAX_PAYLOAD, FrameError, decode_frame, encode_frame
+
+# O deflate procura repetições primeiro no fim do dicionário: o mais frequente vai no fim.
+# Alterar este dicionário parte a compatibilidade com Nodes antigos.
+PRESET_DICTIONARY = (
+    b"ERROR WARN INFO status=OK status=FAIL alarm=0 alarm=1 "
+    b"lat=38.7 lon=-9.1 alt= uptime= seq= id=node- "
+    b"light= lux= co2= ppm press= hPa rssi=-6 rssi=-7 rssi=-8 "
+    b"batt=3.7 batt=3.8 batt=3.9 bat=4.0 V mV "
+    b"hum=40. hum=50. hum=60. % temp=19. temp=20. temp=21. temp=22. C "
+    b"0123456789.;,=:-"
+)
+
+
+def compress(payload):
+    c = zlib.compressobj(9, zlib.DEFLATED, -15, zdict=PRESET_DICTIONARY)
+    return c.compress(payload) + c.flush()
+
+
+def decompress(payload):
+    d = zlib.decompressobj(-15, zdict=PRESET_DICTIONARY)
+    try:
+        data = d.decompress(payload, MAX_PAYLOAD)
+    except zlib.error as e:
+        raise FrameError(f"Payload comprimido inválido: {e}")
+    if d.unconsumed_tail:
+        raise FrameError("Payload descomprimido excede o tamanho máximo")
+    return data
+
+
+def maybe_compress(payload):
+    """ Devolve (payload, flags): só comprime se ficar mais pequeno. """
+    if len(payload) < 8:
+        return payload, 0
+    packed = compress(payload)
+    if len(packed) < len(payload):
+        return packed, FLAG_COMPRESSED
+    return payload, 0
+
+
+def is_compressed(data):
+    """ Olha só para o byte de flags de uma frame codificada. """
+    return len(data) >= HEADER_LEN and bool(data[1] & FLAG_COMPRESSED)
+
+
+def frame_payload(frame):
+    """ Payload em claro de uma Frame descodificada (descomprime se for preciso). """
+    if frame.flags & FLAG_COMPRESSED:
+        return decompress(frame.payload)
+    return frame.payload
+
+
+def decompress_frame(data):
+    """ Para relays cujo uplink não suporta compressão: devolve a frame em claro. """
+    frame = decode_frame(data)
+    return encode_frame(frame.type, frame.nid, frame.seq, decompress(frame.payload),
+                        frame.flags & ~FLAG_COMPRESSED)
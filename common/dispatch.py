@@ -0,0 +1,36 @@
+# common/dispatch.py
+from common.frames import peek_header, TYPE_COUNT
+
+
+def ignore(data, *header):
+    pass
+
+
+class Dispatcher:
+    """
+    Tabela de despacho por tipo de frame: lê só o cabeçalho (peek_header) e chama o
+    handler registado para o tipo, sem tocar no payload. Os tipos sem handler vão
+    para `default` (ex: um relay encaminha-os tal como estão).
+
+    Handlers: handler(data, tipo, flags, nid, seq, tamanho, *contexto), onde o
+    contexto é o que foi passado a dispatch() depois da frame (ex: o emissor).
+    """
+    def __init__(self, default=ignore):
+        self.handlers = [None] * TYPE_COUNT
+        self.default = default
+        self.counts = [0] * TYPE_COUNT
+
+    def register(self, ftype, handler=None):
+        """ Regista `handler` para `ftype`; sem handler funciona como decorador. """
+        if handler is None:
+            return lambda h: self.register(ftype, h)
+        self.handlers[ftype] = handler
+        return handler
+
+    def dispatch(self, data, *context):
+        """ Pode lançar FrameError se o cabeçalho for inválido. """
+        header = peek_header(data)
+        ftype = header[0]
+        self.counts[ftype] += 1
+        handler = self.handlers[ftype] or self.default
+        return handler(data, *header, *context)
@@ -0,0 +1,121 @@
+# common/fragments.py
+"""
+Fragmentação de frames maiores que o MTU negociado (MTU - 3 bytes por escrita ATT).
+
+Cada fragmento leva um cabeçalho de 6 bytes:
+    byte 0     versão | TYPE_FRAGMENT
+    byte 1     id da mensagem (u8, por emissor)
+    bytes 2-3  offset do fragmento dentro da frame original (u16)
+    bytes 4-5  tamanho total da frame original (u16)
+O servidor junta os fragmentos por emissor (Reassembler) e só entrega frames completas.
+"""
+import struct
+import time
+
+from common.frames import FRAME_VERSION, TYPE_FRAGMENT
+
+FRAG_HEADER = struct.Struct("!BBHH")
+FRAG_HEADER_LEN = FRAG_HEADER.size
+MAX_FRAGMENTED = 0xFFFF
+_FRAG_BYTE0 = (FRAME_VERSION << 4) | TYPE_FRAGMENT
+
+
+def is_fragment(data):
+    return len(data) > 0 and data[0] == _FRAG_BYTE0
+
+
+def fragment(data, max_write, msg_id):
+    """ Divide `data` em fragmentos de no máximo `max_write` bytes (cabeçalho incluído). """
+    if len(data) > MAX_FRAGMENTED:
+        raise ValueError(f"Frame demasiado grande para fragmentar ({len(data)} bytes)")
+    chunk = max_write - FRAG_HEADER_LEN
+    if chunk <= 0:
+        raise ValueError(f"MTU demasiado pequeno ({max_write} bytes por escrita)")
+    view = memoryview(data)
+    total = len(data)
+    return [
+        FRAG_HEADER.pack(_FRAG_BYTE0, msg_id & 0xFF, offset, total) + view[offset:offset + chunk]
+        for offset in range(0, total, chunk)
+    ]
+
+
+class _Partial:
+    __slots__ = ('msg_id', 'buf', 'received', 'deadline')
+
+    def __init__(self, msg_id, total, deadline):
+        self.msg_id = msg_id
+        self.buf = bytearray(total)
+        self.received = 0
+        self.deadline = deadline
+
+
+class Reassembler:
+    """
+    Junta fragmentos por emissor. Só há uma mensagem em curso por emissor (a ligação
+    ATT é ordenada), limitada a `max_senders` emissores e com `timeout` segundos para
+    chegar ao fim; o que passar disso é descartado.
+    """
+    def __init__(self, max_senders=32, timeout=5.0):
+        self.max_senders = max_senders
+        self.timeout = timeout
+        self.partials = {}  # emissor -> _Partial
+        self.dropped = 0
+        self._next_purge = 0.0
+
+    def feed(self, sender, data):
+        """ Devolve a frame completa (bytes) ou None se ainda faltam fragmentos. """
+        if not is_fragment(data):
+            return data
+        if len(data) < FRAG_HEADER_LEN:
+            self.dropped += 1
+            return None
+
+        now = time.monotonic()
+        if now >= self._next_purge:
+            self._purge(now)
+
+        _, msg_id, offset, total = FRAG_HEADER.unpack_from(data)
+        chunk = memoryview(data)[FRAG_HEADER_LEN:]
+        partial = self.partials.get(sender)
+
+        if offset == 0:
+            if partial is not None:
+                self.dropped += 1  # mensagem anterior ficou a meio
+            elif len(self.partials) >= self.max_senders:
+                self._evict_oldest()
+            partial = _Partial(msg_id, total, now + self.timeout)
+            self.partials[sender] = partial
+        elif partial is None or partial.msg_id != msg_id or partial.received != offset:
+            # Fragmento fora de ordem ou de uma mensagem que já descartámos
+            if partial is not None:
+                del self.partials[sender]
+            self.dropped += 1
+            return None
+
+        end = offset + len(chunk)
+        if end > len(partial.buf):
+            del self.partials[sender]
+            self.dropped += 1
+            return None
+        partial.buf[offset:end] = chunk
+        partial.received = end
+
+        if end == len(partial.buf):
+            del self.partials[sender]
+            return bytes(partial.buf)
+        return None
+
+    def forget(self, sender):
+        """ Chamado quando o emissor se desliga. """
+        self.partials.pop(sender, None)
+
+    def _evict_oldest(self):
+        oldest = min(self.partials, key=lambda s: self.partials[s].deadline)
+        del self.partials[oldest]
+        self.dropped += 1
+
+    def _purge(self, now):
+        for sender in [s for s, p in self.partials.items() if p.deadline <= now]:
+            del self.partials[sender]
+            self.dropped += 1
+        self._next_purge = now + self.timeout / 2
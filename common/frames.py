@@ -0,0 +1,213 @@
+# common/frames.py
+"""
+Formato binário das frames trocadas na característica de Chat.
+
+Cabeçalho fixo (22 bytes, big-endian):
+    byte 0      versão (4 bits altos) | tipo (4 bits baixos)
+    byte 1      flags
+    bytes 2-17  NID do originador (16 bytes em bruto)
+    bytes 18-19 número de sequência (u16, por originador)
+    bytes 20-21 tamanho do payload (u16)
+Seguido de `tamanho` bytes de payload.
+
+Frames maiores do que uma escrita ATT são partidas em fragmentos (common/fragments.py),
+cujo primeiro byte segue o mesmo formato (versão | TYPE_FRAGMENT).
+
+Várias frames pequenas podem seguir numa só escrita como batch:
+    byte 0      versão | TYPE_BATCH
+    depois, por cada frame: tamanho (u16) + frame completa
+
+Controlo de fluxo do modo write-without-response (5 bytes, nos dois sentidos):
+    byte 0      versão | TYPE_CREDIT
+    bytes 1-2   token da ligação (u16, escolhido pelo cliente)
+    bytes 3-4   créditos (u16): janela pedida (cliente -> servidor) ou concedidos (notificação)
+
+Heartbeat (só na ligação, nunca encaminhado): versão | TYPE_HEARTBEAT, de 1 byte ou
+de 3 com o intervalo de heartbeat do cliente (u16, em décimas de segundo), para o
+servidor saber ao fim de quanto tempo calado o dar como morto.
+Frames TYPE_HEARTBEAT completas (Nodes antigos) continuam a ser aceites e ignoradas.
+
+Os tipos 0x2-0x6 só existem dentro de uma ligação (LinkReceiver) e nunca chegam às
+aplicações. Os restantes são despachados por tipo (common/dispatch.py); os relays
+encaminham sem olhar para o payload os tipos que não tratam.
+
+Dentro de uma ligação o cabeçalho pode levar um alias de 1 byte em vez do NID
+(FLAG_ALIAS, ver common/alias.py); o servidor repõe o cabeçalho acima antes de entregar.
+"""
+import struct
+
+FRAME_VERSION = 1
+
+# --- TIPOS ---
+TYPE_DATA = 0x0
+TYPE_HEARTBEAT = 0x1
+TYPE_PING = TYPE_HEARTBEAT  # nome antigo
+TYPE_FRAGMENT = 0x2
+TYPE_BATCH = 0x3
+TYPE_CREDIT = 0x4
+TYPE_CAPS = 0x5  # capacidades devolvidas pelo ReadValue
+TYPE_ALIAS_RESET = 0x6  # notificação: o servidor perdeu a tabela de aliases (common/alias.py)
+TYPE_ACK = 0x7      # confirmação fim-a-fim (payload definido por quem a usa)
+TYPE_CONTROL = 0x8  # mensagens de controlo fim-a-fim (payload: código + argumentos)
+TYPE_COUNT = 16     # o tipo ocupa 4 bits
+
+# --- FLAGS ---
+FLAG_PRIORITY_MASK = 0x03  # bits 0-1: prioridade (0 = normal ... 3 = máxima), usada pelos relays
+FLAG_COMPRESSED = 0x04     # payload comprimido (common/compression.py)
+FLAG_ALIAS = 0x08          # cabeçalho curto, NID trocado por um alias da ligação (common/alias.py)
+FLAG_ALIAS_BIND = 0x10     # cabeçalho curto que também anuncia o NID do alias
+
+NID_LEN = 16
+HEADER = struct.Struct("!BB16sHH")
+HEADER_LEN = HEADER.size
+MAX_PAYLOAD = 0xFFFF
+BATCH_ITEM = struct.Struct("!H")
+BATCH_ITEM_OVERHEAD = BATCH_ITEM.size
+_BATCH_BYTE0 = (FRAME_VERSION << 4) | TYPE_BATCH
+CREDIT = struct.Struct("!BHH")
+_CREDIT_BYTE0 = (FRAME_VERSION << 4) | TYPE_CREDIT
+_HEARTBEAT = bytes([(FRAME_VERSION << 4) | TYPE_HEARTBEAT])
+HEARTBEAT_INTERVAL = struct.Struct("!H")
+
+
+class FrameError(ValueError):
+    pass
+
+
+class Frame:
+    __slots__ = ('type', 'flags', 'nid', 'seq', 'payload')
+
+    def __init__(self, ftype, nid, seq=0, payload=b"", flags=0):
+        self.type = ftype
+        self.flags = flags
+        self.nid = nid
+        self.seq = seq
+        self.payload = payload
+
+    @property
+    def nid_hex(self):
+        return self.nid.hex()
+
+    def encode(self):
+        return encode_frame(self.type, self.nid, self.seq, self.payload, self.flags)
+
+    def __repr__(self):
+        return f"Frame(type={self.type}, nid={self.nid_hex}, seq={self.seq}, len={len(self.payload)})"
+
+
+def encode_frame(ftype, nid, seq, payload=b"", flags=0):
+    if len(nid) != NID_LEN:
+        raise FrameError(f"NID tem de ter {NID_LEN} bytes")
+    if len(payload) > MAX_PAYLOAD:
+        raise FrameError(f"Payload demasiado grande ({len(payload)} bytes)")
+    header = HEADER.pack((FRAME_VERSION << 4) | (ftype & 0x0F), flags, nid, seq & 0xFFFF, len(payload))
+    return header + bytes(payload)
+
+
+def peek_header(data):
+    """
+    Lê e valida só o cabeçalho, sem copiar o payload (aceita bytes ou memoryview).
+    Devolve (tipo, flags, nid, seq, tamanho). É o que os relays usam para encaminhar.
+    """
+    if len(data) < HEADER_LEN:
+        raise FrameError(f"Frame curta ({len(data)} bytes)")
+    ver_type, flags, nid, seq, length = HEADER.unpack_from(data)
+    if ver_type >> 4 != FRAME_VERSION:
+        raise FrameError(f"Versão de frame desconhecida: {ver_type >> 4}")
+    if len(data) - HEADER_LEN != length:
+        raise FrameError(f"Tamanho inválido: cabeçalho diz {length}, recebidos {len(data) - HEADER_LEN}")
+    return ver_type & 0x0F, flags, nid, seq, length
+
+
+def decode_frame(data):
+    ftype, flags, nid, seq, _ = peek_header(data)
+    return Frame(ftype, nid, seq, bytes(data[HEADER_LEN:]), flags)
+
+
+# --- BATCHES ---
+def is_batch(data):
+    return len(data) > 0 and data[0] == _BATCH_BYTE0
+
+
+def encode_batch(frames):
+    parts = [bytes([_BATCH_BYTE0])]
+    for frame in frames:
+        parts.append(BATCH_ITEM.pack(len(frame)))
+        parts.append(frame)
+    return b"".join(parts)
+
+
+def split_batch(data):
+    """
+    Devolve a lista de frames contidas num batch (ou [data] se não for batch).
+    As frames são fatias memoryview do buffer original: nada é copiado.
+    """
+    if not is_batch(data):
+        return [data]
+    data = memoryview(data)
+    frames = []
+    offset = 1
+    while offset + BATCH_ITEM_OVERHEAD <= len(data):
+        (length,) = BATCH_ITEM.unpack_from(data, offset)
+        offset += BATCH_ITEM_OVERHEAD
+        if offset + length > len(data):
+            raise FrameError("Batch truncado")
+        frames.append(data[offset:offset + length])
+        offset += length
+    if offset != len(data):
+        raise FrameError("Batch truncado")
+    return frames
+
+
+# --- HEARTBEAT ---
+def encode_heartbeat(interval=None):
+    """ `interval` (s) anuncia o intervalo de heartbeat do cliente. """
+    if interval is None:
+        return _HEARTBEAT
+    return _HEARTBEAT + HEARTBEAT_INTERVAL.pack(min(max(round(interval * 10), 1), 0xFFFF))
+
+
+def is_heartbeat(data):
+    return len(data) in (1, 1 + HEARTBEAT_INTERVAL.size) and data[0] == _HEARTBEAT[0]
+
+
+def decode_heartbeat(data):
+    """ Intervalo anunciado (s), ou None num heartbeat de 1 byte. """
+    if len(data) != 1 + HEARTBEAT_INTERVAL.size:
+        return None
+    return HEARTBEAT_INTERVAL.unpack_from(data, 1)[0] / 10
+
+
+# --- CAPACIDADES (devolvidas pelo ReadValue da característica de Chat) ---
+CAP_DEFLATE_DICT = 0x01  # descomprime payloads com FLAG_COMPRESSED (common/compression.py)
+CAP_ALIAS = 0x02         # aceita cabeçalhos com alias de NID (common/alias.py)
+SERVER_CAPS = CAP_DEFLATE_DICT | CAP_ALIAS
+
+CAPS = struct.Struct("!BB")
+_CAPS_BYTE0 = (FRAME_VERSION << 4) | TYPE_CAPS
+
+
+def encode_capabilities(caps=SERVER_CAPS):
+    return CAPS.pack(_CAPS_BYTE0, caps)
+
+
+def decode_capabilities(data):
+    """ Devolve a máscara de capacidades do servidor (0 se não perceber a resposta). """
+    if len(data) != CAPS.size or data[0] != _CAPS_BYTE0:
+        return 0
+    return data[1]
+
+
+# --- CRÉDITOS ---
+def is_credit(data):
+    return len(data) == CREDIT.size and data[0] == _CREDIT_BYTE0
+
+
+def encode_credit(token, credits):
+    return CREDIT.pack(_CREDIT_BYTE0, token & 0xFFFF, min(credits, 0xFFFF))
+
+
+def decode_credit(data):
+    """ Devolve (token, créditos). """
+    _, token, credits = CREDIT.unpack(bytes(data))
+    return token, credits
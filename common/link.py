@@ -0,0 +1,128 @@
+# common/link.py
+import time
+from collections import OrderedDict
+
+from common.alias import AliasDecoder, is_aliased, encode_alias_reset
+from common.children import ChildTable
+from common.fragments import Reassembler
+from common.frames import (split_batch, is_credit, is_heartbeat, decode_heartbeat, decode_credit, encode_credit,
+                           FrameError)
+
+# Janela de créditos por emissor no modo write-without-response
+DEFAULT_WINDOW = 16
+# Tabelas de aliases guardadas (uma por emissor, LRU) e intervalo mínimo entre resets
+MAX_ALIAS_SENDERS = 64
+ALIAS_RESET_INTERVAL = 0.5
+
+
+class LinkReceiver:
+    """
+    Lado servidor da característica de Chat: recebe as escritas ATT de cada
+    dispositivo, junta fragmentos e desfaz batches, devolvendo frames completas.
+    Usado pelo ChatChrc, pelo ChatQueue do Sink e pelo servidor loopback.
+
+    Se `notify` for dado (função que envia uma notificação na característica), os
+    emissores podem pedir o modo com créditos: cada escrita sem resposta consumida
+    devolve um crédito, concedido em lotes de meia janela (a concedida a esse emissor).
+
+    Frames com alias de NID (common/alias.py) são devolvidas já com o cabeçalho normal.
+    Cada escrita atualiza a tabela de filhos (`children`, common/children.py).
+    """
+    def __init__(self, notify=None, window=DEFAULT_WINDOW):
+        self.reassembler = Reassembler()
+        self.notify = notify
+        self.window = window
+        self.credits = {}  # emissor -> [token, escritas por creditar, janela concedida]
+        self.aliases = OrderedDict()  # emissor -> AliasDecoder
+        self.alias_misses = 0
+        self._last_reset = {}  # emissor -> instante do último ALIAS_RESET
+        self.children = ChildTable()
+
+    def receive(self, sender, data, command=False):
+        """ `command` indica uma escrita sem resposta (as únicas que gastam créditos). """
+        child = self.children.touch(sender, len(data))
+        if is_credit(data):
+            self._open_stream(sender, data)
+            return []
+
+        if is_heartbeat(data):
+            interval = decode_heartbeat(data)
+            if interval:
+                self.children.heartbeat(sender, interval)
+            return []
+
+        if command:
+            state = self.credits.get(sender)
+            if state is not None:
+                state[1] += 1
+                # Meia janela do emissor (pode ter pedido menos do que self.window)
+                if state[1] >= max(1, state[2] // 2):
+                    self._grant(state, state[1])
+
+        data = self.reassembler.feed(sender, data)
+        if data is None:
+            return []
+        try:
+            frames = split_batch(data)
+            if any(is_aliased(f) for f in frames):
+                frames = self._expand_aliases(sender, frames)
+            child.frames += len(frames)
+            return frames
+        except FrameError as e:
+            print(f"[LINK] Batch inválido de {sender}: {e}")
+            return []
+
+    def _expand_aliases(self, sender, frames):
+        decoder = self.aliases.get(sender)
+        if decoder is None:
+            if len(self.aliases) >= MAX_ALIAS_SENDERS:
+                self.aliases.popitem(last=False)
+            decoder = self.aliases[sender] = AliasDecoder()
+        else:
+            self.aliases.move_to_end(sender)
+
+        expanded = []
+        for frame in frames:
+            if not is_aliased(frame):
+                expanded.append(frame)
+                continue
+            frame = decoder.decode(frame)
+            if frame is None:
+                self.alias_misses += 1
+                self._reset_aliases(sender)
+            else:
+                expanded.append(frame)
+        return expanded
+
+    def _reset_aliases(self, sender):
+        # Alias desconhecido (tabela perdida): o cliente tem de voltar a anunciar os NIDs.
+        # A notificação chega a todos os subscritores, que limpam todos a sua tabela.
+        now = time.monotonic()
+        if self.notify is None or now - self._last_reset.get(sender, 0.0) < ALIAS_RESET_INTERVAL:
+            return
+        self._last_reset[sender] = now
+        try: self.notify(encode_alias_reset())
+        except Exception as e: print(f"[LINK] Falha a notificar reset de aliases: {e}")
+
+    def _open_stream(self, sender, data):
+        # Pedido (ou ressincronização) do modo com créditos: concede a janela toda
+        if self.notify is None:
+            return
+        token, requested = decode_credit(data)
+        state = [token, 0, min(requested, self.window)]
+        self.credits[sender] = state
+        self._grant(state, state[2])
+
+    def _grant(self, state, credits):
+        state[1] = 0
+        # A notificação chega a todos os subscritores; o token identifica o destinatário
+        try: self.notify(encode_credit(state[0], credits))
+        except Exception as e: print(f"[LINK] Falha a notificar créditos: {e}")
+
+    def forget(self, sender):
+        """ Chamado quando o dispositivo se desliga. """
+        self.reassembler.forget(sender)
+        self.credits.pop(sender, None)
+        self.aliases.pop(sender, None)
+        self._last_reset.pop(sender, None)
+        self.children.remove(sender)
@@ -0,0 +1,436 @@
+# common/loopback.py
+"""
+Transporte em memória que emula o BlueZ/Bleak dentro de um único processo.
+
+Cada "adaptador" (ex: 'lo1') corresponde a um Node ou ao Sink. O LoopbackNetwork
+guarda os servidores registados e as características de cada ligação (latência,
+jitter, perda, RSSI), o que permite correr a lógica de node.py e sink.py sem rádios.
+"""
+import asyncio
+import random
+
+from common.messages import CHAT_SERVICE_UUID, CHAT_MSG_UUID, ATT_DEFAULT_MTU
+from common.link import LinkReceiver
+from common.frames import encode_capabilities
+from common.advert import encode_adv_data, MAX_CHILDREN
+
+
+class LoopbackError(Exception):
+    pass
+
+
+class LinkProfile:
+    """ Características de uma ligação emulada (simétrica). """
+    def __init__(self, latency=0.005, jitter=0.0, loss=0.0, rssi=-50, rssi_jitter=0.0):
+        self.latency = latency  # atraso de um sentido por PDU (s)
+        self.jitter = jitter    # atraso extra aleatório [0, jitter] (s)
+        self.loss = loss        # probabilidade de perder um PDU
+        self.rssi = rssi
+        self.rssi_jitter = rssi_jitter  # variação de cada anúncio [-j, +j] (dB)
+
+
+class LoopbackNetwork:
+    def __init__(self, mtu=ATT_DEFAULT_MTU, scan_time=None, seed=None, max_children=MAX_CHILDREN):
+        self.mtu = mtu
+        self.max_children = max_children    # slots anunciados por servidor
+        self.scan_time = scan_time          # None = respeita o timeout pedido ao scanner
+        self.adv_interval = 0.25            # entre anúncios de cada servidor (scanner contínuo)
+        self.rng = random.Random(seed)
+        self.default_link = LinkProfile()
+        self.links = {}
+        self.topology = None  # None = todos se veem; senão conjunto de pares visíveis
+        self.servers = {}     # adapter -> LoopbackServer
+        self.clients = set()  # LoopbackClient com ligação ativa
+        self.stats = {'writes': 0, 'pdus': 0, 'bytes': 0, 'lost': 0}
+        self._next_addr = 1
+
+    @staticmethod
+    def _key(a, b):
+        return (a, b) if a <= b else (b, a)
+
+    # --- TOPOLOGIA ---
+    def set_link(self, a, b, **params):
+        self.links[self._key(a, b)] = LinkProfile(**params)
+
+    def link(self, a, b):
+        return self.links.get(self._key(a, b), self.default_link)
+
+    def set_topology(self, pairs):
+        """ Restringe o alcance rádio aos pares indicados (ex: [('sink', 'lo1'), ('lo1', 'lo2')]). """
+        self.topology = {self._key(a, b) for a, b in pairs}
+
+    def visible(self, a, b):
+        return self.topology is None or self._key(a, b) in self.topology
+
+    def delay(self, link):
+        return link.latency + (self.rng.uniform(0, link.jitter) if link.jitter else 0.0)
+
+    # --- REGISTO ---
+    def register(self, server):
+        self.servers[server.adapter_interface] = server
+        if server.address is None:
+            server.address = "02:00:00:00:%02X:%02X" % (self._next_addr >> 8, self._next_addr & 0xFF)
+            self._next_addr += 1
+        return server.address
+
+    def unregister(self, server):
+        if self.servers.get(server.adapter_interface) is server:
+            del self.servers[server.adapter_interface]
+
+    def server_by_address(self, address):
+        for server in self.servers.values():
+            if server.address == address:
+                return server
+        return None
+
+    # --- FALHAS ---
+    def kill_link(self, a, b):
+        """ Corta as ligações ativas entre dois adaptadores (ex: uplink fora de alcance). """
+        for client in list(self.clients):
+            if self._key(client.adapter, client.server.adapter_interface) == self._key(a, b):
+                client._drop()
+
+    def kill_node(self, adapter):
+        """ Desliga um adaptador por completo (servidor e cliente). """
+        server = self.servers.get(adapter)
+        if server:
+            server.stop()
+        for client in list(self.clients):
+            if client.adapter == adapter:
+                client._drop()
+
+
+_network = None
+
+def get_network():
+    global _network
+    if _network is None:
+        _network = LoopbackNetwork()
+    return _network
+
+def set_network(network):
+    global _network
+    _network = network
+    return network
+
+
+# --- OBJETOS DEVOLVIDOS PELO SCANNER (mesma forma que BLEDevice/AdvertisementData) ---
+class LoopbackDevice:
+    def __init__(self, address, name):
+        self.address = address
+        self.name = name
+
+    def __repr__(self):
+        return f"LoopbackDevice({self.address}, {self.name})"
+
+
+class LoopbackAdvertisementData:
+    def __init__(self, local_name, service_uuids, rssi, service_data=None):
+        self.local_name = local_name
+        self.service_uuids = service_uuids
+        self.service_data = service_data or {}
+        self.manufacturer_data = {}
+        self.tx_power = None
+        self.rssi = rssi
+
+
+class LoopbackCharacteristic:
+    def __init__(self, uuid):
+        self.uuid = uuid
+
+
+class LoopbackService:
+    def __init__(self, uuid, characteristics):
+        self.uuid = uuid
+        self.characteristics = characteristics
+
+
+# =========================================
+# SERVIDOR (mesma interface que o BLEServer)
+# =========================================
+class LoopbackServer:
+    def __init__(self, adapter_interface, on_data_received, local_name, hop=-1, nid=b"", network=None):
+        self.adapter_interface = adapter_interface
+        self.on_data_received = on_data_received
+        self.local_name = local_name
+        self.hop = hop
+        self.load = 0
+        self.nid = nid
+        self.network = network or get_network()
+        self.address = None
+        self.connections = set()
+        self.online = False  # aplicação GATT registada e anúncio ativo
+        self.link = LinkReceiver(notify=self._notify)
+        self.keep = set()
+        self._reaper = None
+
+    def start(self):
+        self.network.register(self)
+        self.online = True
+        self._schedule_reaper()
+
+    def stop(self):
+        self.online = False
+        self.network.unregister(self)
+        if self._reaper:
+            self._reaper.cancel()
+            self._reaper = None
+        self._kick_all()
+
+    def update_advertisement(self, new_name, hop=None, load=None):
+        self.local_name = new_name
+        if hop is not None: self.hop = hop
+        if load is not None: self.load = load
+
+    def service_data(self):
+        # Mesmo conteúdo que o Advertisement do BLEServer
+        return encode_adv_data(self.hop, self.network.max_children - len(self.connections), self.load, self.nid)
+
+    def keep_connected(self, addresses):
+        # Aqui o uplink nunca aparece nas ligações do servidor; guardado só pela interface
+        self.keep = {a for a in addresses if a}
+
+    def restart_server(self, new_name, keep=(), hop=-1):
+        # Como o BLEServer: Device1.Disconnect a cada downlink e anúncio novo,
+        # sem nunca deixar de aceitar ligações
+        self.local_name = new_name
+        self.hop = hop
+        self.keep_connected(keep)
+        for client in list(self.connections):
+            child = self.network.servers.get(client.adapter)
+            if child is None or child.address not in keep:
+                client._drop()
+
+    def _schedule_reaper(self):
+        # Mesmo papel que o timer GLib do BLEServer: uma verificação por tick para todos
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            return
+        self._reaper = loop.call_later(self.link.children.tick, self._reap_idle_children)
+
+    def _reap_idle_children(self):
+        for adapter in self.link.children.expire():
+            # Equivalente ao Device1.Disconnect
+            for client in [c for c in self.connections if c.adapter == adapter]:
+                client._drop()
+        self._schedule_reaper()
+
+    def children(self):
+        return self.link.children.stats()
+
+    def _kick_all(self):
+        for client in list(self.connections):
+            client._drop()
+
+    def _read(self):
+        # Mesmo valor que o ChatChrc.ReadValue
+        return encode_capabilities()
+
+    def _notify(self, value):
+        # Como no BlueZ, a notificação chega a todos os clientes subscritos
+        for client in list(self.connections):
+            client._notify_later(bytes(value))
+
+    def _deliver(self, data, client, command=False):
+        # Mesmo tratamento que o ChatChrc.WriteValue
+        try:
+            for frame in self.link.receive(client.adapter, bytes(data), command):
+                if self.on_data_received:
+                    self.on_data_received(frame, client.adapter)
+        except Exception as e:
+            print(f"[SERVER-ERR] {e}")
+
+
+# =========================================
+# CLIENTE (mesma interface que o BleakClient)
+# =========================================
+class LoopbackClient:
+    def __init__(self, address_or_ble_device, disconnected_callback=None, timeout=10.0,
+                 adapter=None, network=None, **kwargs):
+        self.address = getattr(address_or_ble_device, "address", address_or_ble_device)
+        self.adapter = adapter
+        self.network = network or get_network()
+        self.disconnected_callback = disconnected_callback
+        self.timeout = timeout
+        self.server = None
+        self.services = []
+        self.mtu_size = self.network.mtu
+        self._notify_callback = None
+        self._last_delivery = 0.0
+
+    @property
+    def is_connected(self):
+        return self.server is not None
+
+    async def connect(self, **kwargs):
+        server = self.network.server_by_address(self.address)
+        if server is None or not self.network.visible(self.adapter, server.adapter_interface):
+            await asyncio.sleep(self.timeout)
+            raise LoopbackError(f"Dispositivo {self.address} não encontrado")
+        await asyncio.sleep(2 * self.network.delay(self.network.link(self.adapter, server.adapter_interface)))
+        if not server.online:
+            raise LoopbackError(f"Dispositivo {self.address} não aceita ligações")
+        self.server = server
+        self.services = [LoopbackService(CHAT_SERVICE_UUID, [LoopbackCharacteristic(CHAT_MSG_UUID)])]
+        server.connections.add(self)
+        server.link.children.connected(self.adapter)
+        self.network.clients.add(self)
+        return True
+
+    async def disconnect(self):
+        self._drop()
+        return True
+
+    def _drop(self):
+        server = self.server
+        if server is None:
+            return
+        self.server = None
+        self._notify_callback = None
+        server.connections.discard(self)
+        server.link.forget(self.adapter)
+        self.network.clients.discard(self)
+        if self.disconnected_callback:
+            self.disconnected_callback(self)
+
+    def _check_connected(self):
+        if self.server is None or not self.server.online:
+            raise LoopbackError("Não conectado")
+
+    async def write_gatt_char(self, char_specifier, data, response=False):
+        self._check_connected()
+        data = bytes(data)
+        net = self.network
+        server = self.server
+        link = net.link(self.adapter, server.adapter_interface)
+
+        # Acima de MTU-3 o ATT recorre a Prepare Write (MTU-5 por PDU) + Execute Write
+        if len(data) > self.mtu_size - 3:
+            if not response:
+                raise LoopbackError(f"Payload de {len(data)} bytes excede o MTU ({self.mtu_size})")
+            pdus = -(-len(data) // (self.mtu_size - 5)) + 1
+        else:
+            pdus = 1
+
+        net.stats['writes'] += 1
+        net.stats['pdus'] += pdus
+        net.stats['bytes'] += len(data)
+        lost = link.loss and any(net.rng.random() < link.loss for _ in range(pdus))
+
+        if not response:
+            # Sem resposta: o PDU segue e o emissor não espera
+            if lost:
+                net.stats['lost'] += 1
+                return
+            # O ATT entrega por ordem: nunca antes de uma escrita anterior
+            loop = asyncio.get_running_loop()
+            self._last_delivery = max(loop.time() + net.delay(link), self._last_delivery)
+            loop.call_at(self._last_delivery, self._deliver_later, server, data)
+            return
+
+        # Com resposta: cada PDU custa um RTT
+        for _ in range(pdus - 1):
+            await asyncio.sleep(2 * net.delay(link))
+        await asyncio.sleep(net.delay(link))
+        self._check_connected()
+        if lost:
+            net.stats['lost'] += 1
+            raise LoopbackError("ATT: PDU perdido")
+        server._deliver(data, self)
+        await asyncio.sleep(net.delay(link))
+
+    def _deliver_later(self, server, data):
+        if self.server is server and server.online:
+            server._deliver(data, self, command=True)
+
+    async def read_gatt_char(self, char_specifier, **kwargs):
+        self._check_connected()
+        server = self.server
+        await asyncio.sleep(2 * self.network.delay(self.network.link(self.adapter, server.adapter_interface)))
+        self._check_connected()
+        return bytearray(server._read())
+
+    # --- NOTIFICAÇÕES ---
+    async def start_notify(self, char_specifier, callback, **kwargs):
+        self._check_connected()
+        self._notify_callback = callback
+
+    async def stop_notify(self, char_specifier):
+        self._notify_callback = None
+
+    def _notify_later(self, value):
+        if self._notify_callback is None:
+            return
+        net = self.network
+        link = net.link(self.adapter, self.server.adapter_interface)
+        net.stats['pdus'] += 1
+        if link.loss and net.rng.random() < link.loss:
+            net.stats['lost'] += 1
+            return
+        callback = self._notify_callback
+        asyncio.get_running_loop().call_later(net.delay(link), self._fire_notify, callback, value)
+
+    def _fire_notify(self, callback, value):
+        if self._notify_callback is callback:
+            callback(self.services[0].characteristics[0], bytearray(value))
+
+
+# =========================================
+# SCANNER (mesma interface que o BleakScanner)
+# =========================================
+class LoopbackScanner:
+    def __init__(self, detection_callback=None, service_uuids=None, adapter=None, network=None, **kwargs):
+        self.detection_callback = detection_callback
+        self.service_uuids = {u.lower() for u in service_uuids or ()}
+        self.adapter = adapter
+        self.network = network or get_network()
+        self._task = None
+
+    @staticmethod
+    def _adverts(net, adapter):
+        """ Um anúncio de cada servidor ao alcance de `adapter`. """
+        for server in list(net.servers.values()):
+            if not server.online or server.adapter_interface == adapter:
+                continue
+            if not net.visible(adapter, server.adapter_interface):
+                continue
+            link = net.link(adapter, server.adapter_interface)
+            device = LoopbackDevice(server.address, server.local_name)
+            # Como no BLEServer: o serviço vai no ServiceData, sem ServiceUUIDs
+            rssi = link.rssi + (net.rng.uniform(-link.rssi_jitter, link.rssi_jitter) if link.rssi_jitter else 0)
+            adv = LoopbackAdvertisementData(server.local_name, [], round(rssi),
+                                            {CHAT_SERVICE_UUID: server.service_data()})
+            yield device, adv
+
+    @classmethod
+    async def discover(cls, timeout=5.0, return_adv=False, adapter=None, network=None, **kwargs):
+        net = network or get_network()
+        await asyncio.sleep(timeout if net.scan_time is None else net.scan_time)
+        found = {device.address: (device, adv) for device, adv in cls._adverts(net, adapter)}
+        if return_adv:
+            return found
+        return [d for d, _ in found.values()]
+
+    # --- SCAN CONTÍNUO (detection_callback, como no BleakScanner) ---
+    def _wanted(self, adv):
+        # Como o filtro de UUIDs do BlueZ/Bleak: só o ServiceUUIDs conta, não as chaves do ServiceData
+        if not self.service_uuids:
+            return True
+        return bool(self.service_uuids & {u.lower() for u in adv.service_uuids})
+
+    async def _run(self):
+        while True:
+            for device, adv in self._adverts(self.network, self.adapter):
+                if self.detection_callback and self._wanted(adv):
+                    self.detection_callback(device, adv)
+            await asyncio.sleep(self.network.adv_interval)
+
+    async def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            self._task = None
@@ -1,3 +1,6 @@
 # UUIDs partilhados entre o Node (Servidor) e o Sink (Cliente)
 CHAT_SERVICE_UUID = "12345678-1234-5678-1234-56789abcdef0"
-CHAT_MSG_UUID     = "12345678-1234-5678-1234-56789abcdef1"
\ No newline at end of file
+CHAT_MSG_UUID     = "12345678-1234-5678-1234-56789abcdef1"
+
+# MTU ATT por defeito (antes de negociação): 23 bytes -> 20 de payload por escrita
+ATT_DEFAULT_MTU = 23
@@ -0,0 +1,55 @@
+# common/transport.py
+import asyncio
+import os
+
+# Backend por defeito (pode ser trocado com SIC_TRANSPORT=loopback)
+DEFAULT_TRANSPORT = os.environ.get("SIC_TRANSPORT", "bluez")
+
+
+class Transport:
+    """
+    Agrupa as três peças que dependem do rádio:
+      - Server:  servidor GATT + advertising (interface do BLEServer)
+      - Client:  cliente GATT (interface do BleakClient)
+      - Scanner: descoberta de vizinhos (interface do BleakScanner)
+    `errors` são as exceções que indicam uma ligação perdida (o resto é erro local).
+    """
+    def __init__(self, name, server_cls, client_cls, scanner_cls, errors=()):
+        self.name = name
+        self.Server = server_cls
+        self.Client = client_cls
+        self.Scanner = scanner_cls
+        self.errors = (asyncio.TimeoutError, EOFError, OSError) + tuple(errors)
+
+
+# Os imports são feitos só quando o backend é pedido, para que o loopback
+# funcione numa máquina sem dbus/bleak instalados.
+def _load_bluez():
+    from bleak import BleakClient, BleakScanner
+    from bleak.exc import BleakError
+    from common.ble_server import BLEServer
+    return Transport("bluez", BLEServer, BleakClient, BleakScanner, (BleakError,))
+
+def _load_loopback():
+    from common.loopback import LoopbackServer, LoopbackClient, LoopbackScanner, LoopbackError
+    return Transport("loopback", LoopbackServer, LoopbackClient, LoopbackScanner, (LoopbackError,))
+
+BACKENDS = {
+    "bluez": _load_bluez,
+    "loopback": _load_loopback,
+}
+
+_active = None
+
+def set_transport(name):
+    """ Escolhe o backend usado por todos os Nodes/Sinks criados a partir daqui. """
+    global _active
+    if name not in BACKENDS:
+        raise ValueError(f"Transporte desconhecido: {name}")
+    _active = BACKENDS[name]()
+    return _active
+
+def get_transport():
+    if _active is None:
+        return set_transport(DEFAULT_TRANSPORT)
+    return _active
@@ -1,64 +1,203 @@
 import asyncio
 import os  # alterado para usar os.urandom
-from bleak import BleakClient, BleakScanner
+import time
+from collections import deque
+from common.transport import get_transport
+from common.frames import (encode_frame, encode_batch, BATCH_ITEM_OVERHEAD, TYPE_DATA,
+                           FLAG_PRIORITY_MASK, FrameError, encode_credit, decode_credit, is_credit, encode_heartbeat,
+                           decode_capabilities, CAP_DEFLATE_DICT, CAP_ALIAS)
+from common.alias import AliasEncoder, is_alias_reset
+from common.advert import decode_adv_data
+from liveness import Liveness
+from candidates import CandidateTable
+from selection import LinkHistory, ParentSelector, make_score
+from common.fragments import fragment
+from common.messages import ATT_DEFAULT_MTU
+from common.compression import maybe_compress, is_compressed, decompress_frame
 
 # UUIDs do Projeto
 CHAT_SERVICE_UUID = "12345678-1234-5678-1234-56789abcdef0"
 CHAT_MSG_UUID     = "12345678-1234-5678-1234-56789abcdef1"
 
+# Tempo máximo à espera de créditos antes de pedir a janela de novo
+CREDIT_TIMEOUT = 1.0
+# Duração do scan a pedido (menu), que é também a espera máxima pelos primeiros
+# anúncios quando o scanner contínuo acabou de arrancar
+SCAN_TIME = 3.0
+# Pai de reserva: duração de cada scan periódico (sem scanner contínuo) e timeout da
+# ligação durante o failover
+STANDBY_SCAN_TIME = 2.0
+FAILOVER_CONNECT_TIMEOUT = 2.0
+# Coalescing: escritas de MTU-3 bytes que podem esperar na fila de envio; cheia, quem
+# envia espera, para a contrapressão chegar à fila de encaminhamento (node/forwarding.py)
+TX_QUEUE_WRITES = 4
+
 class NodeClient:
-    def __init__(self, adapter: str = "hci0"):
+    def __init__(self, adapter: str = "hci0", transport=None, coalesce_linger=None, stream_window=None,
+                 compress=False, alias=False, heartbeat_interval=2.0, standby_interval=None, scoring="hop"):
         self.adapter = adapter
+        self.transport = transport or get_transport()
         self.client = None
         self.chat_char = None
         self.candidates = []
+        # Vizinhos vistos pelo scanner contínuo (ou pelos scans a pedido, sem ele),
+        # ordenados pela função de custo `scoring` (node/selection.py)
+        self.history = LinkHistory()
+        self.score = make_score(scoring, self.history)
+        self.table = CandidateTable(rank=self.score)
+        self.selector = ParentSelector(self.table, self.score)
+        self._scanner = None
+        self._advert_seen = asyncio.Event()
         self.on_disconnect_callback = None
         self._watchdog_task = None 
+        self.liveness = Liveness(heartbeat_interval)
+        self.mtu = ATT_DEFAULT_MTU
+        self._frag_id = 0
+        self._frag_lock = asyncio.Lock()
+
+        # Coalescing (opcional): frames esperam até `coalesce_linger` segundos para
+        # seguirem juntas numa só escrita de MTU-3 bytes
+        self.coalesce_linger = coalesce_linger
+        self._tx_queue = deque()  # (frame, on_sent)
+        self._tx_bytes = 0
+        self._tx_full = asyncio.Event()
+        self._tx_space = asyncio.Event()
+        self._flush_task = None
+
+        # Streaming (opcional): escritas sem resposta, limitadas pelos créditos
+        # que o servidor vai concedendo por notificação
+        self.stream_window = stream_window
+        self._streaming = False
+        self._stream_token = 0
+        self._credits = 0
+        self._credit_event = asyncio.Event()
+        self._resyncing = False
+
+        # Compressão (opcional): só se o uplink anunciar o codec no ReadValue
+        self.compress = compress
+        self.peer_caps = 0
 
-        # NID único de 128 bits (16 bytes)
-        self.nid = os.urandom(16).hex()  # hex string de 32 caracteres
+        # Aliases de NID (opcional): cabeçalho de 7 bytes em vez de 22 no uplink.
+        # Precisa das notificações para receber os pedidos de reset do servidor
+        self.alias = alias
+        self._aliasing = False
+        self._alias_encoder = AliasEncoder()
+        self._subscribed = False
+
+        # Pai de reserva: o failover escolhe da tabela de candidatos. Sem scanner contínuo,
+        # um scan a cada `standby_interval` segundos mantém a tabela atualizada
+        self.standby_interval = standby_interval
+        self.uplink_hop = None
+        self.uplink_address = None
+        self._standby_task = None
+
+        # NID único de 128 bits (16 bytes): em bruto nas frames, em hex para display
+        self.nid_bytes = os.urandom(16)
+        self.nid = self.nid_bytes.hex()  # hex string de 32 caracteres
+        self.seq = 0
         print(f"[NODE] NID atribuído: {self.nid}")
 
+    def _next_frame(self, ftype, payload=b"", flags=0):
+        if ftype == TYPE_DATA and self.compress and self.peer_caps & CAP_DEFLATE_DICT:
+            payload, compressed = maybe_compress(payload)
+            flags |= compressed
+        frame = encode_frame(ftype, self.nid_bytes, self.seq, payload, flags)
+        self.seq = (self.seq + 1) & 0xFFFF
+        return frame
+
     def set_disconnect_handler(self, callback):
         self.on_disconnect_callback = callback
 
+    def _on_advert(self, d, adv):
+        """ Um anúncio (do scanner contínuo ou de um scan): atualiza a tabela de candidatos. """
+        local_name = d.name or adv.local_name or "Unknown"
+        # Nodes novos: hop, slots livres e carga vêm no ServiceData (common/advert.py)
+        info = decode_adv_data((adv.service_data or {}).get(CHAT_SERVICE_UUID))
+        if info is not None:
+            hop_count, free_slots, load, _ = info
+            if free_slots == 0:
+                self.table.remove(d.address)
+                return
+            self.table.update(d, local_name, hop_count, adv.rssi, free_slots, load)
+        elif CHAT_SERVICE_UUID.lower() in [u.lower() for u in adv.service_uuids or []]:
+            # Nodes antigos: o hop só vem no LocalName
+            hop_count = 0 if "Sink" in local_name else 99
+            try:
+                if "[Hop:" in local_name:
+                    part = local_name.split("[Hop:")[1]
+                    hop_count = int(part.split("]")[0])
+            except: pass
+            self.table.update(d, local_name, hop_count, adv.rssi)
+        else:
+            return
+        self._advert_seen.set()
+
+    async def _discover(self, timeout):
+        """ Scan BLE a pedido (sem scanner contínuo): junta o que vir à tabela. """
+        devices_dict = await self.transport.Scanner.discover(
+            timeout=timeout, adapter=self.adapter, return_adv=True 
+        )
+        for d, adv in devices_dict.values():
+            self._on_advert(d, adv)
+
+    async def start_scanner(self):
+        """
+        Scanner contínuo: cada anúncio com o serviço de Chat atualiza a tabela, por isso
+        escolher um pai (menu, ligação automática, failover) já não espera por um scan.
+        Sem filtro de UUIDs: o do BlueZ só olha para o ServiceUUIDs, que os anúncios
+        novos já não levam (common/advert.py); é o _on_advert que reconhece o ServiceData.
+        """
+        if self._scanner:
+            return True
+        try:
+            scanner = self.transport.Scanner(detection_callback=self._on_advert, adapter=self.adapter)
+            await scanner.start()
+            self._scanner = scanner
+            print("[SCAN] Scanner contínuo ativo.")
+        except Exception as e:
+            print(f"[SCAN] Scanner contínuo indisponível ({type(e).__name__}). Scans a pedido.")
+        return self._scanner is not None
+
+    @property
+    def scanning(self):
+        return self._scanner is not None
+
+    async def stop_scanner(self):
+        if self._scanner:
+            try: await self._scanner.stop()
+            except Exception: pass
+            self._scanner = None
+
     async def scan_network_controls(self):
         print("\n--- [SCAN] A procurar Uplinks... ---")
         self.candidates = [] 
         try:
-            devices_dict = await BleakScanner.discover(
-                timeout=3.0, adapter=self.adapter, return_adv=True 
-            )
+            if not self._scanner:
+                await self._discover(SCAN_TIME)
+            elif not self.table:
+                # Scanner acabado de arrancar: espera pelos primeiros anúncios
+                self._advert_seen.clear()
+                try: await asyncio.wait_for(self._advert_seen.wait(), SCAN_TIME)
+                except asyncio.TimeoutError: pass
+            self.candidates = self.table.ranked()
             print(f"\n{'ID':<3} | {'DEVICE NAME':<25} | {'HOP':<5} | {'RSSI'}")
             print("-" * 60)
-            count = 0
-            for d, adv in devices_dict.values():
-                uuids = adv.service_uuids or []
-                if CHAT_SERVICE_UUID.lower() in [u.lower() for u in uuids]:
-                    local_name = d.name or adv.local_name or "Unknown"
-                    hop_count = 0 if "Sink" in local_name else 99
-                    try:
-                        if "[Hop:" in local_name:
-                            part = local_name.split("[Hop:")[1]
-                            hop_count = int(part.split("]")[0])
-                    except: pass
-                    self.candidates.append({'device': d, 'hop': hop_count, 'name': local_name, 'rssi': adv.rssi})
-                    print(f"{count:<3} | {local_name:<25} | {hop_count:<5} | {adv.rssi}")
-                    count += 1
+            for count, c in enumerate(self.candidates):
+                print(f"{count:<3} | {c['name']:<25} | {c['hop']:<5} | {c['rssi']:.0f}")
         except Exception as e:
             print(f"[ERRO SCAN] {e}")
 
-    async def _connect_logic(self, device_obj):
+    async def _connect_logic(self, device_obj, timeout=10.0):
         if self.client and self.client.is_connected:
             await self.disconnect()
 
         print(f"[CONNECT] A conectar a {device_obj.address}...")
         try:
-            self.client = BleakClient(
+            self.client = self.transport.Client(
                 device_obj, 
                 adapter=self.adapter, 
                 disconnected_callback=self._internal_on_disconnect,
-                timeout=10.0
+                timeout=timeout
             )
             await self.client.connect()
             
@@ -66,23 +205,247 @@ class NodeClient:
                 for char in service.characteristics:
                     if char.uuid.lower() == CHAT_MSG_UUID.lower():
                         self.chat_char = char
-                        print(f"[CONNECT] Serviço de Chat encontrado!")
+                        self.mtu = await self._read_mtu()
+                        self.peer_caps = await self._read_capabilities()
+                        print(f"[CONNECT] Serviço de Chat encontrado! (MTU {self.mtu}, caps {self.peer_caps:#x})")
+                        self._alias_encoder.reset()
+                        self._subscribed = False
+                        self.liveness.reset()
+                        # O pai fica a saber o nosso intervalo de heartbeat antes de nos achar calados
+                        await self._write_pdu(encode_heartbeat(self.liveness.base_interval), response=True)
+                        if self.stream_window:
+                            self._streaming = await self._open_stream()
+                        if self.alias and self.peer_caps & CAP_ALIAS:
+                            self._aliasing = await self._subscribe()
+                        self.uplink_address = self.client.address
+                        self.history.connect_result(device_obj.address, True)
                         self._start_watchdog()
+                        self._start_standby()
                         return True
             
             print("[ERRO] Serviço não encontrado.")
+            self.history.connect_result(device_obj.address, False)
             await self.client.disconnect()
             return False
             
         except Exception as e:
             print(f"[ERRO CONEXÃO] {e}")
+            self.history.connect_result(device_obj.address, False)
             self.client = None
             return False
 
+    async def _read_mtu(self):
+        # No BlueZ o Bleak só conhece o MTU negociado depois de _acquire_mtu()
+        backend = getattr(self.client, "_backend", None)
+        if hasattr(backend, "_acquire_mtu"):
+            try: await backend._acquire_mtu()
+            except Exception: pass
+        try:
+            return self.client.mtu_size or ATT_DEFAULT_MTU
+        except Exception:
+            return ATT_DEFAULT_MTU
+
+    async def _read_capabilities(self):
+        # Servidores antigos não suportam leitura: ficam sem compressão
+        try:
+            return decode_capabilities(await self.client.read_gatt_char(self.chat_char))
+        except Exception:
+            return 0
+
+    async def _write_frame(self, frame, response=False):
+        """ Escreve uma frame no uplink; acima de MTU-3 bytes parte-a em fragmentos. """
+        max_write = self.mtu - 3
+        if len(frame) <= max_write:
+            await self._write_pdu(frame, response)
+            return
+        # Os fragmentos de uma frame não se podem misturar com os de outra
+        async with self._frag_lock:
+            msg_id = self._frag_id
+            self._frag_id = (self._frag_id + 1) & 0xFF
+            for chunk in fragment(frame, max_write, msg_id):
+                await self._write_pdu(chunk, response)
+
+    async def _write_pdu(self, pdu, response=False):
+        """ Uma escrita ATT: sem resposta (gasta um crédito) em streaming, com resposta no resto. """
+        if self._streaming and not response:
+            await self._take_credit()
+            await self.client.write_gatt_char(self.chat_char, pdu, response=False)
+        else:
+            start = time.monotonic()
+            await self.client.write_gatt_char(self.chat_char, pdu, response=True)
+            # Escrita confirmada pelo servidor: prova de vida e amostra de RTT
+            self.liveness.sample(time.monotonic() - start)
+
+    async def _subscribe(self):
+        """ Subscreve as notificações da característica (créditos e resets de aliases). """
+        if not self._subscribed:
+            try:
+                await self.client.start_notify(self.chat_char, self._on_notify)
+                self._subscribed = True
+            except Exception as e:
+                print(f"[CONNECT] Notificações indisponíveis ({type(e).__name__}).")
+        return self._subscribed
+
+    def _to_link(self, frame):
+        """ Troca o NID pelo alias da ligação, se estiverem ativos. """
+        return self._alias_encoder.encode(frame) if self._aliasing else frame
+
+    # --- STREAMING COM CRÉDITOS ---
+    async def _open_stream(self):
+        """ Pede o modo com créditos; se o servidor não responder, ficam as escritas com resposta. """
+        self._credits = 0
+        self._credit_event.clear()
+        self._stream_token = int.from_bytes(os.urandom(2), "big")
+        try:
+            if not await self._subscribe():
+                raise RuntimeError("sem notificações")
+            await self._request_credits()
+            await asyncio.wait_for(self._credit_event.wait(), CREDIT_TIMEOUT)
+        except Exception as e:
+            print(f"[STREAM] Servidor sem controlo de fluxo ({type(e).__name__}). A usar escritas com resposta.")
+            return False
+        print(f"[STREAM] Write-without-response ativo ({self._credits} créditos).")
+        return True
+
+    async def _request_credits(self):
+        request = encode_credit(self._stream_token, self.stream_window)
+        await self.client.write_gatt_char(self.chat_char, request, response=True)
+
+    def _on_notify(self, char, data):
+        self.liveness.alive()
+        if is_credit(data):
+            token, credits = decode_credit(data)
+            if token == self._stream_token:
+                self._credits += credits
+                self._credit_event.set()
+        elif is_alias_reset(data):
+            # O servidor perdeu a tabela: as próximas frames voltam a anunciar os NIDs
+            self._alias_encoder.reset()
+
+    async def _take_credit(self):
+        while self._credits <= 0:
+            self._credit_event.clear()
+            try:
+                await asyncio.wait_for(self._credit_event.wait(), CREDIT_TIMEOUT)
+            except asyncio.TimeoutError:
+                # Crédito ou escrita perdidos pelo caminho: pede a janela de novo (um pedido de cada vez)
+                if not self._resyncing:
+                    self._resyncing = True
+                    try: await self._request_credits()
+                    finally: self._resyncing = False
+        self._credits -= 1
+
+    # --- COALESCING ---
+    async def _enqueue(self, frame, on_sent=None):
+        """ Junta a frame à fila de envio; espera se a fila já tiver TX_QUEUE_WRITES escritas. """
+        while self._tx_bytes >= (self.mtu - 3) * TX_QUEUE_WRITES:
+            self._tx_space.clear()
+            await self._tx_space.wait()
+        if not self.client:
+            # A ligação caiu enquanto esperávamos
+            if on_sent: on_sent(False)
+            return
+        self._tx_queue.append((frame, on_sent))
+        self._tx_bytes += len(frame) + BATCH_ITEM_OVERHEAD
+        if 1 + self._tx_bytes >= self.mtu - 3:
+            self._tx_full.set()
+        if self._flush_task is None:
+            self._flush_task = asyncio.create_task(self._flush_loop())
+
+    def _take_batch(self):
+        """ Retira da fila as frames que cabem numa escrita; devolve o PDU e os callbacks. """
+        max_write = self.mtu - 3
+        items = [self._tx_queue.popleft()]
+        size = 1 + len(items[0][0]) + BATCH_ITEM_OVERHEAD
+        while self._tx_queue and size + len(self._tx_queue[0][0]) + BATCH_ITEM_OVERHEAD <= max_write:
+            item = self._tx_queue.popleft()
+            items.append(item)
+            size += len(item[0]) + BATCH_ITEM_OVERHEAD
+        frames = [f for f, _ in items]
+        self._tx_bytes -= sum(len(f) + BATCH_ITEM_OVERHEAD for f in frames)
+        pdu = frames[0] if len(frames) == 1 else encode_batch(frames)
+        return pdu, [cb for _, cb in items if cb]
+
+    async def _flush_loop(self):
+        callbacks = []
+        try:
+            try: await asyncio.wait_for(self._tx_full.wait(), self.coalesce_linger)
+            except asyncio.TimeoutError: pass
+            while self._tx_queue and self.client and self.chat_char:
+                pdu, callbacks = self._take_batch()
+                self._tx_space.set()
+                await self._write_frame(pdu)
+                for cb in callbacks: cb(True)
+                callbacks = []
+        except self.transport.errors:
+            for cb in callbacks: cb(False)
+            self._internal_on_disconnect(self.client)
+        except Exception as e:
+            # Erro local: perde-se este lote, a ligação fica
+            for cb in callbacks: cb(False)
+            print(f"[ERRO] Falha a enviar lote: {e}")
+        finally:
+            self._tx_full.clear()
+            self._flush_task = None
+
+    def _clear_tx_queue(self):
+        for _, cb in self._tx_queue:
+            if cb: cb(False)
+        self._tx_queue.clear()
+        self._tx_bytes = 0
+        # Quem espera por espaço acorda e vê que a ligação caiu
+        self._tx_space.set()
+        if self._flush_task:
+            self._flush_task.cancel()
+            self._flush_task = None
+
+    # --- PAI DE RESERVA (WARM STANDBY) ---
+    def _start_standby(self):
+        if self.standby_interval and not self._scanner and not self._standby_task:
+            self._standby_task = asyncio.create_task(self._standby_loop())
+
+    def _stop_standby(self):
+        if self._standby_task:
+            self._standby_task.cancel()
+            self._standby_task = None
+
+    async def _standby_loop(self):
+        """ Sem scanner contínuo: scans periódicos mantêm a tabela de candidatos fresca. """
+        while self.client and self.client.is_connected:
+            try:
+                await self._discover(STANDBY_SCAN_TIME)
+            except Exception:
+                pass
+            await asyncio.sleep(self.standby_interval)
+
+    async def failover(self):
+        """ Liga-se ao melhor pai alternativo ainda vivo na tabela. Devolve o hop dele ou False. """
+        # Hop no máximo igual ao nosso: um descendente anuncia sempre um hop maior
+        limit = (self.uplink_hop if self.uplink_hop is not None else 0) + 1
+        tried = {self.uplink_address}
+        while True:
+            c = self.selector.choose(exclude=tried, max_hop=limit)
+            if c is None:
+                return False
+            tried.add(c['device'].address)
+            print(f"[FAILOVER] A tentar pai de reserva: {c['name']} (Hop {c['hop']})")
+            if await self._connect_logic(c['device'], timeout=FAILOVER_CONNECT_TIMEOUT):
+                self.uplink_hop = c['hop']
+                return c['hop']
+
     def _internal_on_disconnect(self, client):
-        if self.client is None: return
+        # Ignora avisos de ligações antigas (ex: expulsas pelo servidor depois de já termos religado)
+        if self.client is None or client is not self.client: return
         print("\n[ALERTA] Ligação Perdida (Detetado pelo Cliente)!")
+        # Se o pai continuar vivo volta à tabela no próximo anúncio, já com a queda no histórico
+        self.history.link_closed(client.address, self.liveness, lost=True)
+        self.table.remove(client.address)
+        self.table.rerank()
         self._stop_watchdog()
+        self._stop_standby()
+        self._clear_tx_queue()
+        self._streaming = False
+        self._aliasing = False
         self.client = None 
         if self.on_disconnect_callback:
             self.on_disconnect_callback()
@@ -98,36 +461,46 @@ class NodeClient:
             self._watchdog_task = None
 
     async def _active_ping_loop(self):
-        """ Envia um pacote PING a cada 2s com TIMEOUT RÍGIDO. """
+        """
+        Heartbeat de 3 bytes com TIMEOUT RÍGIDO, mas só quando a ligação está calada:
+        o tráfego normal já prova que o uplink está vivo (ver node/liveness.py).
+        """
+        live = self.liveness
+        misses = 0
         while True:
-            await asyncio.sleep(2.0)
-            if self.client and self.client.is_connected and self.chat_char:
-                try:
-                    payload = f"{self.nid}|PING".encode("utf-8")
-                    await asyncio.wait_for(
-                        self.client.write_gatt_char(self.chat_char, payload, response=True),
-                        timeout=1.0
-                    )
-                except Exception as e:
-                    print(f"\n[WATCHDOG] Ping falhou/timeout ({type(e).__name__}). A cortar ligação...")
-                    self._internal_on_disconnect(self.client)
-                    break
-            else:
+            await asyncio.sleep(0 if misses else live.next_probe())
+            if not (self.client and self.client.is_connected and self.chat_char):
+                break
+            if not misses and live.idle() < live.interval:
+                continue
+            try:
+                await asyncio.wait_for(self._write_pdu(encode_heartbeat(live.base_interval), response=True),
+                                       timeout=live.timeout)
+                live.heartbeat_result(True)
+                misses = 0
+            except Exception as e:
+                live.heartbeat_result(False)
+                misses += 1
+                if misses < live.max_misses:
+                    print(f"\n[WATCHDOG] Heartbeat sem resposta ({misses}/{live.max_misses}). A repetir...")
+                    continue
+                print(f"\n[WATCHDOG] Heartbeat falhou/timeout ({type(e).__name__}). A cortar ligação...")
+                self._internal_on_disconnect(self.client)
                 break
     # -----------------------------
 
     async def connect_best_candidate(self):
-        if not self.candidates:
+        if not self.table:
             print("[AVISO] Lista vazia.")
             return False
-        valid = [c for c in self.candidates if c['hop'] >= 0]
-        if not valid:
+        # Histerese: o último pai fica, a não ser que haja outro claramente melhor
+        best = self.selector.choose(incumbent=self.uplink_address)
+        if best is None:
             print("[BLOQUEIO] Sem dispositivos válidos.")
             return False
-        valid.sort(key=lambda x: (x['hop'], -x['rssi']))
-        best = valid[0]
         print(f"[AUTO] A conectar a: {best['name']}")
         res = await self._connect_logic(best['device'])
+        if res: self.uplink_hop = best['hop']
         return best['hop'] if res else False
 
     async def connect_by_index(self, index):
@@ -136,22 +509,64 @@ class NodeClient:
         if t['hop'] < 0:
             print("[BLOQUEIO] Hop -1.")
             return False
-        return await self._connect_logic(t['device'])
+        res = await self._connect_logic(t['device'])
+        if res: self.uplink_hop = t['hop']
+        return res
 
-    async def send_message(self, message, is_forward=False):
+    async def send_message(self, message, is_forward=False, priority=0, on_sent=None):
+        """
+        Envia texto nosso (frame DATA nova) ou, se is_forward, uma frame já codificada.
+        on_sent(ok) é chamado depois da escrita no uplink (com coalescing, quando o lote
+        que a leva é escrito) ou com False se a frame não chegar a ser escrita.
+        Erros de codificação (ex: FrameError de um payload grande demais) chegam a quem
+        chama; só os erros do transporte contam como ligação perdida.
+        """
         if not self.client or not self.chat_char:
             print("[ERRO] Não conectado.")
+            if on_sent: on_sent(False)
             return
         try:
-            payload = message if is_forward else f"{self.nid}|{message}"
-            await self.client.write_gatt_char(self.chat_char, payload.encode("utf-8"), response=True)
-            if not is_forward: print(f"[TX] -> {message}")
+            if is_forward:
+                payload = message
+                # Frames comprimidas seguem como estão, a não ser que o uplink não as perceba
+                if is_compressed(payload) and not self.peer_caps & CAP_DEFLATE_DICT:
+                    try:
+                        payload = decompress_frame(payload)
+                    except FrameError as e:
+                        print(f"[DROP] {e}")
+                        if on_sent: on_sent(False)
+                        return
+            else:
+                payload = self._next_frame(TYPE_DATA, message.encode("utf-8"), priority & FLAG_PRIORITY_MASK)
+            payload = self._to_link(payload)
         except Exception:
-            self._internal_on_disconnect(self.client)
+            # Codificação: nada foi escrito e a ligação não está em causa
+            if on_sent: on_sent(False)
+            raise
+        if self.coalesce_linger:
+            await self._enqueue(payload, on_sent)
+        else:
+            try:
+                await self._write_frame(payload)
+            except self.transport.errors:
+                if on_sent: on_sent(False)
+                self._internal_on_disconnect(self.client)
+                return
+            except Exception:
+                if on_sent: on_sent(False)
+                raise
+            if on_sent: on_sent(True)
+        if not is_forward: print(f"[TX] -> {message}")
 
     async def disconnect(self):
         self._stop_watchdog()
+        self._stop_standby()
+        self._clear_tx_queue()
+        self._streaming = False
+        self._aliasing = False
         if self.client:
+            self.history.link_closed(self.client.address, self.liveness)
+            self.table.rerank()
             try: await self.client.disconnect()
             except: pass
         self.client = None
\ No newline at end of file
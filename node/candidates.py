@@ -0,0 +1,127 @@
+# node/candidates.py
+"""
+Tabela de pais candidatos, alimentada por cada anúncio que o scanner contínuo vê.
+
+Uma entrada por endereço, com o RSSI suavizado (EWMA), o último hop/slots/carga
+anunciados e a hora do último anúncio; sem anúncios durante `ttl` segundos a entrada
+sai da tabela. O melhor pai sai de um heap ordenado por `rank` (O(log n); as
+funções de custo estão em node/selection.py, por omissão HopScore): cada
+anúncio empurra uma versão nova da entrada e as versões antigas são descartadas
+quando chegam ao topo.
+
+Depois de um reset em cascata os anúncios dos antigos filhos ainda trazem o hop
+de antes: escolher um deles fecharia um ciclo. `hold()` faz a tabela ignorar os
+candidatos com hop > 0 até chegarem anúncios novos (o Sink nunca é descendente).
+"""
+import heapq
+import itertools
+import time
+
+from selection import HopScore
+
+# Sem anúncios durante este tempo, o vizinho é dado como fora de alcance
+CANDIDATE_TTL = 5.0
+# Peso de cada amostra de RSSI na média (o RSSI de um só anúncio varia vários dB)
+RSSI_ALPHA = 0.25
+# Depois de um reset, tempo para os downlinks expulsos atualizarem o anúncio
+CANDIDATE_HOLDDOWN = 1.0
+
+
+class CandidateTable:
+    def __init__(self, ttl=CANDIDATE_TTL, alpha=RSSI_ALPHA, rank=None):
+        self.ttl = ttl
+        self.alpha = alpha
+        self.rank = rank or HopScore()
+        self.entries = {}   # endereço -> candidato (dict, como os do scan)
+        self.updates = 0
+        self.evicted = 0
+        self.hold_until = 0.0
+        self._heap = []     # (rank, versão, endereço)
+        self._versions = itertools.count()
+
+    def __len__(self):
+        return len(self.entries)
+
+    def update(self, device, name, hop, rssi, slots=None, load=0):
+        """ Um anúncio recebido: atualiza (ou cria) a entrada e devolve-a. """
+        address = device.address
+        c = self.entries.get(address)
+        if c is None:
+            c = self.entries[address] = {'rssi': float(rssi)}
+        else:
+            c['rssi'] += self.alpha * (rssi - c['rssi'])
+        c.update(device=device, name=name, hop=hop, slots=slots, load=load, seen=time.monotonic(),
+                 version=next(self._versions))
+        self.updates += 1
+        heapq.heappush(self._heap, (self.rank(c), c['version'], address))
+        # As versões antigas só saem quando chegam ao topo: reconstrói se forem demasiadas
+        if len(self._heap) > 4 * len(self.entries) + 64:
+            self.rerank()
+        return c
+
+    def hold(self, seconds=CANDIDATE_HOLDDOWN):
+        """ Só os anúncios recebidos daqui a `seconds` segundos valem para Nodes (hop > 0). """
+        self.hold_until = time.monotonic() + seconds
+
+    def get(self, address):
+        return self.entries.get(address)
+
+    def remove(self, address):
+        self.entries.pop(address, None)
+
+    def rerank(self):
+        """ Reordena o heap (o custo mudou sem haver anúncio novo, ex: histórico da ligação). """
+        self._heap = [(self.rank(c), c['version'], a) for a, c in self.entries.items()]
+        heapq.heapify(self._heap)
+
+    def _expired(self, c, now):
+        return now - c['seen'] > self.ttl
+
+    def expire(self):
+        """ Retira da tabela os vizinhos sem anúncios há mais de `ttl` segundos. """
+        now = time.monotonic()
+        for address in [a for a, c in self.entries.items() if self._expired(c, now)]:
+            del self.entries[address]
+            self.evicted += 1
+
+    def eligible(self, c, exclude=(), min_hop=0, max_hop=None):
+        """ O candidato (ainda vivo) pode ser pai com estes limites? """
+        return (c['device'].address not in exclude and c['hop'] >= min_hop
+                and (max_hop is None or c['hop'] <= max_hop)
+                and not (c['hop'] > 0 and c['seen'] < self.hold_until)
+                and not self._expired(c, time.monotonic()))
+
+    def best(self, exclude=(), min_hop=0, max_hop=None):
+        """
+        Melhor candidato ainda vivo com min_hop <= hop <= max_hop, ou None.
+        Os candidatos excluídos ou fora dos limites que estejam à frente são retirados
+        e repostos no fim, por isso cada um custa mais O(log n).
+        """
+        now = time.monotonic()
+        heap = self._heap
+        skipped = []
+        found = None
+        while heap:
+            _, version, address = heap[0]
+            c = self.entries.get(address)
+            if c is None or c['version'] != version:
+                heapq.heappop(heap)
+                continue
+            if self._expired(c, now):
+                heapq.heappop(heap)
+                del self.entries[address]
+                self.evicted += 1
+                continue
+            if not self.eligible(c, exclude, min_hop, max_hop):
+                skipped.append(heapq.heappop(heap))
+                continue
+            found = c
+            break
+        for item in skipped:
+            heapq.heappush(heap, item)
+        return found
+
+    def ranked(self):
+        """ Todos os candidatos vivos, do melhor para o pior (para mostrar no menu). """
+        self.expire()
+        return sorted(self.entries.values(), key=self.rank)
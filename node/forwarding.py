@@ -0,0 +1,130 @@
+# node/forwarding.py
+import asyncio
+import threading
+import time
+from collections import deque
+
+# Políticas de descarte quando a fila está cheia
+TAIL_DROP = "tail-drop"      # descarta a frame que chega
+DROP_OLDEST = "drop-oldest"  # descarta a frame mais antiga
+PRIORITY = "priority"        # descarta a mais antiga de prioridade inferior à que chega
+POLICIES = (TAIL_DROP, DROP_OLDEST, PRIORITY)
+
+
+class ForwardingQueue:
+    """
+    Fila FIFO limitada entre o servidor GATT (que recebe dos downlinks, noutra thread)
+    e a única tarefa que escreve no uplink. Cada nível de prioridade tem a sua deque;
+    a ordem global é mantida por um contador, por isso a saída é sempre FIFO.
+    Também mede o tempo que cada frame passa na fila (atraso de fila deste hop).
+    """
+    def __init__(self, capacity=256, policy=TAIL_DROP, levels=4):
+        if policy not in POLICIES:
+            raise ValueError(f"Política desconhecida: {policy}")
+        self.capacity = capacity
+        self.policy = policy
+        self.levels = [deque() for _ in range(levels)]
+        self.depth = 0
+        self.max_depth = 0
+        self.enqueued = 0
+        self.forwarded = 0
+        self.dropped = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+        self._waited = 0
+        self._order = 0
+        self._lock = threading.Lock()
+        self._loop = None
+        self._wakeup = None
+
+    def bind(self, loop):
+        """ Liga a fila ao loop asyncio onde corre a tarefa de escrita. """
+        self._loop = loop
+        self._wakeup = asyncio.Event()
+
+    def put(self, item, priority=0):
+        """ Pode ser chamado de qualquer thread. Devolve False se a frame foi descartada. """
+        priority = min(max(priority, 0), len(self.levels) - 1)
+        with self._lock:
+            if self.depth >= self.capacity and not self._make_room(priority):
+                self.dropped += 1
+                return False
+            self.levels[priority].append((self._order, time.monotonic(), item))
+            self._order += 1
+            self.depth += 1
+            self.enqueued += 1
+            if self.depth > self.max_depth:
+                self.max_depth = self.depth
+        if self._loop:
+            self._loop.call_soon_threadsafe(self._wakeup.set)
+        return True
+
+    def _make_room(self, priority):
+        if self.policy == TAIL_DROP:
+            return False
+        if self.policy == DROP_OLDEST:
+            # Descartada, não encaminhada: o tempo que esperou não entra no atraso de fila
+            self._pop(record=False)
+        else:
+            victim = next((q for q in self.levels[:priority] if q), None)
+            if victim is None:
+                return False
+            victim.popleft()
+            self.depth -= 1
+        self.dropped += 1
+        return True
+
+    def _pop(self, record=True):
+        head = None
+        for q in self.levels:
+            if q and (head is None or q[0][0] < head[0][0]):
+                head = q
+        if head is None:
+            return None
+        self.depth -= 1
+        _, queued_at, item = head.popleft()
+        if not record:
+            return item
+        wait = time.monotonic() - queued_at
+        self.wait_total += wait
+        self._waited += 1
+        if wait > self.wait_max:
+            self.wait_max = wait
+        return item
+
+    async def get(self):
+        while True:
+            with self._lock:
+                item = self._pop()
+            if item is not None:
+                return item
+            self._wakeup.clear()
+            with self._lock:
+                if self.depth:
+                    continue
+            await self._wakeup.wait()
+
+    def sent(self, ok):
+        """ Resultado da escrita no uplink de uma frame que saiu da fila. """
+        if ok:
+            self.forwarded += 1
+        else:
+            self.dropped += 1
+
+    def clear(self):
+        with self._lock:
+            self.dropped += self.depth
+            for q in self.levels:
+                q.clear()
+            self.depth = 0
+
+    def stats(self):
+        return {
+            'enqueued': self.enqueued,
+            'forwarded': self.forwarded,
+            'dropped': self.dropped,
+            'depth': self.depth,
+            'max_depth': self.max_depth,
+            'wait_avg': self.wait_total / self._waited if self._waited else 0.0,
+            'wait_max': self.wait_max,
+        }
@@ -0,0 +1,69 @@
+# node/liveness.py
+import time
+
+# Limites do timeout de cada heartbeat (s) e do intervalo entre heartbeats
+MIN_TIMEOUT = 0.25
+MAX_TIMEOUT = 2.0
+MIN_INTERVAL = 0.5
+MAX_MISSES = 3
+
+
+class Liveness:
+    """
+    Estado de vida do uplink visto pelo NodeClient.
+
+    Qualquer escrita com resposta (ou notificação do servidor) conta como prova de
+    vida; o heartbeat só é preciso depois de `interval` segundos sem nenhuma.
+    O timeout de cada heartbeat segue o RTT observado (srtt + 4*rttvar, como no TCP)
+    e, em ligações com perdas, tolera-se mais do que uma falha seguida. Para a deteção
+    continuar limitada a ~interval + timeout, o intervalo encolhe o que as tentativas
+    extra gastam.
+    """
+    def __init__(self, interval=2.0):
+        self.base_interval = interval
+        self.reset()
+
+    def reset(self):
+        """ Ligação nova: esquece o RTT e as perdas do uplink anterior. """
+        self.last_ok = time.monotonic()
+        self.srtt = None
+        self.rttvar = 0.0
+        self.loss = 0.0
+        self.heartbeats = 0
+
+    def alive(self):
+        self.last_ok = time.monotonic()
+
+    def sample(self, rtt):
+        """ RTT de uma escrita com resposta bem sucedida. """
+        self.alive()
+        if self.srtt is None:
+            self.srtt, self.rttvar = rtt, rtt / 2
+        else:
+            self.rttvar = 0.75 * self.rttvar + 0.25 * abs(self.srtt - rtt)
+            self.srtt = 0.875 * self.srtt + 0.125 * rtt
+
+    def heartbeat_result(self, ok):
+        self.heartbeats += 1
+        self.loss = 0.9 * self.loss + (0.1 if not ok else 0.0)
+
+    @property
+    def timeout(self):
+        if self.srtt is None:
+            return 1.0
+        return min(max(self.srtt + 4 * self.rttvar, MIN_TIMEOUT), MAX_TIMEOUT)
+
+    @property
+    def max_misses(self):
+        return min(1 + int(self.loss * 10), MAX_MISSES)
+
+    @property
+    def interval(self):
+        return max(self.base_interval - (self.max_misses - 1) * self.timeout, MIN_INTERVAL)
+
+    def idle(self):
+        return time.monotonic() - self.last_ok
+
+    def next_probe(self):
+        """ Segundos até ser preciso um heartbeat (0 se já é). """
+        return max(self.interval - self.idle(), 0.0)
@@ -6,8 +6,12 @@ import time
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
 
 from common.utils import select_adapter
-from common.ble_server import BLEServer
+from common.transport import get_transport
+from common.frames import FrameError, TYPE_HEARTBEAT, FLAG_PRIORITY_MASK
+from common.dispatch import Dispatcher, ignore
+from common.advert import load_level
 from ble_interface import NodeClient
+from forwarding import ForwardingQueue, TAIL_DROP
 
 # --- VARIÁVEIS GLOBAIS ---
 my_node_client = None
@@ -16,6 +20,26 @@ server = None
 my_nid_short = "0000"
 MAIN_LOOP = None
 adapter_name = "hci0"
+forward_queue = None
+forward_task = None
+
+# Coalescing de envio (ms de espera para juntar frames numa só escrita; 0 = desligado)
+COALESCE_MS = float(os.environ.get("SIC_COALESCE_MS", "0"))
+# Janela de créditos do modo write-without-response (0 = escritas com resposta)
+STREAM_WINDOW = int(os.environ.get("SIC_STREAM_WINDOW", "0"))
+# Compressão do payload das nossas mensagens (negociada com o uplink)
+COMPRESS = os.environ.get("SIC_COMPRESS", "0") == "1"
+# Aliases de NID no uplink (cabeçalho curto, negociado com o uplink)
+ALIAS = os.environ.get("SIC_ALIAS", "0") == "1"
+# Segundos sem tráfego confirmado no uplink até enviar um heartbeat
+HEARTBEAT_S = float(os.environ.get("SIC_HEARTBEAT_S", "2.0"))
+# Sem scanner contínuo: intervalo dos scans que mantêm um pai de reserva (0 = sem failover)
+STANDBY_S = float(os.environ.get("SIC_STANDBY_S", "0"))
+# Função de custo na escolha do pai (node/selection.py: "etx" ou "hop")
+PARENT_SCORING = os.environ.get("SIC_PARENT_SCORING", "hop")
+# Fila de encaminhamento dos relays (capacidade e política de descarte)
+FORWARD_CAPACITY = int(os.environ.get("SIC_FORWARD_CAPACITY", "256"))
+FORWARD_POLICY = os.environ.get("SIC_FORWARD_POLICY", TAIL_DROP)
 
 # --- FUNÇÃO NUCLEAR: RESET TOTAL ---
 async def reset_network_state():
@@ -27,60 +51,150 @@ async def reset_network_state():
 
     print("\n[CASCADE] A resetar estado da rede...")
     current_hop = -1
+    if forward_queue: forward_queue.clear()
+    # Os anúncios dos downlinks que vamos expulsar ainda trazem o hop antigo
+    my_node_client.table.hold()
     new_name = f"Node-{my_nid_short} [Hop:-1]"
     
     if server:
-        # Chama o novo restart blindado
-        print("[CASCADE] A reiniciar serviços (Expulsando Downlinks)...")
-        server.restart_server(new_name)
+        # Desliga os downlinks um a um; o uplink (se já houver um novo) fica
+        print("[CASCADE] A expulsar Downlinks...")
+        client = my_node_client.client if my_node_client else None
+        keep = [client.address] if client and client.is_connected else []
+        server.restart_server(new_name, keep, hop=-1)
     else:
-        server = BLEServer(adapter_name, on_server_data_received, new_name)
+        server = get_transport().Server(adapter_name, on_server_data_received, new_name, hop=-1,
+                                        nid=my_node_client.nid_bytes)
         server.start()
     
     print("[RESET] Estado: Hop -1 (Isolado).")
 
+async def handle_uplink_lost():
+    """
+    Tenta primeiro o pai de reserva. Se o novo hop não for pior, os downlinks
+    continuam ligados e só o anúncio muda; caso contrário faz o reset em cascata.
+    """
+    old_hop = current_hop
+    can_failover = my_node_client.scanning or my_node_client.standby_interval
+    uplink_hop = await my_node_client.failover() if can_failover else False
+    if uplink_hop is False:
+        await reset_network_state()
+        return
+    if uplink_hop + 1 <= old_hop:
+        set_hop(uplink_hop)
+        print(f"[FAILOVER] Uplink trocado sem reset. Continuo Hop {current_hop}.")
+        return
+    print(f"[FAILOVER] Novo pai é Hop {uplink_hop}: os downlinks têm de se religar.")
+    await reset_network_state()
+    set_hop(uplink_hop)
+
 def on_uplink_lost():
     global MAIN_LOOP
     if MAIN_LOOP and MAIN_LOOP.is_running():
-        asyncio.run_coroutine_threadsafe(reset_network_state(), MAIN_LOOP)
+        asyncio.run_coroutine_threadsafe(handle_uplink_lost(), MAIN_LOOP)
 
 # No node/node.py
 
-def on_server_data_received(raw_data):
-    global my_node_client, MAIN_LOOP
-    
-    # --- FILTRO DE PING ---
-    # Se a mensagem for um PING de heartbeat, ignoramos silenciosamente
-    if "PING" in raw_data:
-        return
-    # ----------------------
-
-    if my_node_client and my_node_client.client and my_node_client.client.is_connected and MAIN_LOOP:
-        print(f"\n[ROUTING] Recebido: {raw_data} -> A reencaminhar...")
-        try:
-            asyncio.run_coroutine_threadsafe(
-                my_node_client.send_message(raw_data, is_forward=True), MAIN_LOOP
-            )
-        except: pass
+def forward_frame(raw_data, ftype, flags, nid, seq, length):
+    """ DATA e qualquer tipo fim-a-fim que não tratamos: segue intacto para o uplink. """
+    if my_node_client and my_node_client.client and my_node_client.client.is_connected and forward_queue:
+        print(f"\n[ROUTING] Recebido: {nid.hex()} #{seq} ({length} bytes) -> A reencaminhar...")
+        if not forward_queue.put(raw_data, flags & FLAG_PRIORITY_MASK):
+            print(f"[DROP] Fila de encaminhamento cheia ({forward_queue.depth}).")
     else:
-        print(f"\n[DROP] Recebido: {raw_data} mas não tenho Uplink.")
+        print(f"\n[DROP] Recebido: {nid.hex()} #{seq} mas não tenho Uplink.")
+
+# Despacho por tipo: só o cabeçalho é lido, o payload nunca é tocado aqui
+dispatcher = Dispatcher(default=forward_frame)
+dispatcher.register(TYPE_HEARTBEAT, ignore)  # heartbeats de Nodes antigos (frame completa)
+
+def on_server_data_received(raw_data, sender=None):
+    """ Recebe uma frame de um downlink (bytes/memoryview) e despacha-a pelo tipo. """
+    try:
+        dispatcher.dispatch(raw_data)
+    except FrameError as e:
+        print(f"\n[DROP] Frame inválida: {e}")
+
+async def forward_loop():
+    """ Única tarefa que escreve no uplink as frames recebidas dos downlinks (por ordem). """
+    load = 0
+    while True:
+        frame = await forward_queue.get()
+        # A carga anunciada só muda quando a fila muda de nível, com histerese; o servidor
+        # ainda junta as mudanças só de carga num reinício por ADV_MIN_BACKOFF
+        level = load_level(forward_queue.depth, forward_queue.capacity, load)
+        if level != load and server:
+            load = level
+            server.update_advertisement(server.local_name, load=level)
+        if my_node_client.client and my_node_client.client.is_connected:
+            # Só conta como encaminhada depois da escrita; com coalescing isto espera
+            # enquanto a fila de envio estiver cheia, e a fila de encaminhamento enche
+            try:
+                await my_node_client.send_message(frame, is_forward=True, on_sent=forward_queue.sent)
+            except Exception as e:
+                # Erro local (não do uplink): perde-se esta frame, o encaminhamento continua
+                print(f"[DROP] Frame não encaminhada: {e}")
+        else:
+            forward_queue.dropped += 1
+
+async def init_node(adapter):
+    global my_node_client, server, my_nid_short, MAIN_LOOP, adapter_name, forward_queue, forward_task
 
-async def main_menu():
-    global my_node_client, server, current_hop, my_nid_short, MAIN_LOOP, adapter_name
-    
     MAIN_LOOP = asyncio.get_running_loop()
-    adapter_name = select_adapter()
-    my_node_client = NodeClient(adapter=adapter_name)
+    adapter_name = adapter
+    forward_queue = ForwardingQueue(FORWARD_CAPACITY, FORWARD_POLICY)
+    forward_queue.bind(MAIN_LOOP)
+    forward_task = asyncio.create_task(forward_loop())
+    my_node_client = NodeClient(adapter=adapter_name, coalesce_linger=COALESCE_MS / 1000 or None,
+                                stream_window=STREAM_WINDOW or None, compress=COMPRESS, alias=ALIAS,
+                                heartbeat_interval=HEARTBEAT_S, standby_interval=STANDBY_S or None,
+                                scoring=PARENT_SCORING)
     my_node_client.set_disconnect_handler(on_uplink_lost)
+    await my_node_client.start_scanner()
     
     # Usar os últimos 4 chars do NID de 128 bits apenas para display/local name
     my_nid_short = my_node_client.nid[-4:]
     initial_name = f"Node-{my_nid_short} [Hop:-1]"
     
     print(f"[INIT] A iniciar servidor local como: {initial_name}")
-    server = BLEServer(adapter_name, on_server_data_received, initial_name)
+    server = get_transport().Server(adapter_name, on_server_data_received, initial_name, hop=-1,
+                                    nid=my_node_client.nid_bytes)
     server.start()
 
+# --- AÇÕES DO MENU (também usadas pelo harness de loopback) ---
+def set_hop(uplink_hop):
+    global current_hop
+    current_hop = uplink_hop + 1
+    new_name = f"Node-{my_nid_short} [Hop:{current_hop}]"
+    if server:
+        server.update_advertisement(new_name, hop=current_hop)
+        # O uplink também aparece ligado ao nosso adaptador e nunca escreve no servidor
+        server.keep_connected([my_node_client.uplink_address])
+
+async def auto_connect():
+    print("[AUTO] A tentar conectar ao melhor candidato...")
+    result_hop = await my_node_client.connect_best_candidate()
+    
+    if result_hop is not False:
+        set_hop(result_hop)
+        print(f"[SUCESSO] Conectado a Hop {result_hop}. Sou agora Hop {current_hop}.")
+        return True
+    print("[FALHA] Não foi possível conectar.")
+    return False
+
+async def manual_disconnect():
+    print("[MANUAL] A desligar Uplink...")
+    
+    # --- PROTEÇÃO CONTRA DUPLO RESET ---
+    my_node_client.set_disconnect_handler(None) # Desativa callback temporariamente
+    await my_node_client.disconnect()
+    my_node_client.set_disconnect_handler(on_uplink_lost) # Restaura callback
+    
+    await reset_network_state()
+
+async def main_menu():
+    await init_node(select_adapter())
+
     while True:
         status = "DESCONECTADO (Uplink)"
         if my_node_client.client and my_node_client.client.is_connected:
@@ -92,6 +206,13 @@ async def main_menu():
         print("\n" + "="*45)
         print(f"   NODE {my_nid_short} | {server_name}")
         print(f"   STATUS: {status}")
+        fwd = forward_queue.stats()
+        print(f"   FWD: fila {fwd['depth']}/{forward_queue.capacity} | enc {fwd['enqueued']} | "
+              f"env {fwd['forwarded']} | desc {fwd['dropped']} | espera {fwd['wait_avg'] * 1000:.1f}ms")
+        adv = server.adv_stats() if hasattr(server, 'adv_stats') else {}
+        if adv:
+            print(f"   ADV: reinícios {adv['restarts']} | juntos {adv['coalesced']} | "
+                  f"saltados {adv['skipped']} | erros {adv['errors']}")
         print("="*45)
         print("1. Procurar (Scan)")
         print("2. Conectar Automático")
@@ -109,53 +230,38 @@ async def main_menu():
             await my_node_client.scan_network_controls()
         
         elif choice == "2":
-            print("[AUTO] A tentar conectar ao melhor candidato...")
-            result_hop = await my_node_client.connect_best_candidate()
-            
-            if result_hop is not False:
-                uplink_hop = result_hop
-                current_hop = uplink_hop + 1
-                new_name = f"Node-{my_nid_short} [Hop:{current_hop}]"
-                if server: server.update_advertisement(new_name)
-                print(f"[SUCESSO] Conectado a Hop {uplink_hop}. Sou agora Hop {current_hop}.")
-            else:
-                print("[FALHA] Não foi possível conectar.")
+            await auto_connect()
 
         elif choice == "3":
             if not my_node_client.candidates:
                 print("\n[!] Lista vazia.")
                 continue
             for i, c in enumerate(my_node_client.candidates):
-                print(f"[{i}] {c['name']:<25} | Hop: {c['hop']} | RSSI: {c['rssi']}")
+                print(f"[{i}] {c['name']:<25} | Hop: {c['hop']} | RSSI: {c['rssi']:.0f}")
             try:
                 idx = int(await asyncio.to_thread(input, "ID > "))
                 if 0 <= idx < len(my_node_client.candidates):
                     target = my_node_client.candidates[idx]
                     if await my_node_client.connect_by_index(idx):
-                        current_hop = target['hop'] + 1
-                        new_name = f"Node-{my_nid_short} [Hop:{current_hop}]"
-                        if server: server.update_advertisement(new_name)
+                        set_hop(target['hop'])
                         print(f"[SUCESSO] Hop {current_hop}.")
             except ValueError: pass
 
         elif choice == "4":
-            print("[MANUAL] A desligar Uplink...")
-            
-            # --- PROTEÇÃO CONTRA DUPLO RESET ---
-            my_node_client.set_disconnect_handler(None) # Desativa callback temporariamente
-            await my_node_client.disconnect()
-            my_node_client.set_disconnect_handler(on_uplink_lost) # Restaura callback
-            
-            await reset_network_state()
+            await manual_disconnect()
 
         elif choice == "5":
             if my_node_client.client and my_node_client.client.is_connected:
                 msg = await asyncio.to_thread(input, "Msg > ")
-                await my_node_client.send_message(msg, is_forward=False)
+                try:
+                    await my_node_client.send_message(msg, is_forward=False)
+                except FrameError as e:
+                    print(f"[ERRO] Mensagem não enviada: {e}")
             else: print("[!] Sem conexão.")
 
         elif choice == "6":
             await my_node_client.disconnect()
+            await my_node_client.stop_scanner()
             if server: server.stop()
             break
 
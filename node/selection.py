@@ -0,0 +1,150 @@
+# node/selection.py
+"""
+Escolha do pai: funções de custo para a tabela de candidatos (node/candidates.py).
+
+Cada função recebe um candidato e devolve um custo comparável (menor = melhor):
+    hop  - a heurística original: (hop, carga, -RSSI)
+    etx  - custo de caminho ao estilo ETX: hops até ao Sink mais as transmissões
+           esperadas na ligação ao pai, mais penalizações pela carga e pelo último
+           slot livre anunciados. As transmissões esperadas vêm do histórico das
+           ligações anteriores a esse pai (RTT e perdas vistos pelo Liveness, falhas
+           de ligação) ou, sem histórico, do RSSI suavizado.
+
+A histerese fica no ParentSelector, com a margem de cada função (`keeps`): o pai
+anterior só é trocado por outro que seja melhor por mais de `margin` (no `hop`, com
+o mesmo hop e carga, por mais de RSSI_HYSTERESIS dB), para duas escolhas quase
+iguais não alternarem à medida que o RSSI varia.
+"""
+
+# Sem histórico, a probabilidade de entrega estima-se do RSSI: a partir de RSSI_GOOD
+# tudo passa à primeira, em RSSI_FLOOR (perto da sensibilidade) quase nada
+RSSI_GOOD = -60.0
+RSSI_FLOOR = -95.0
+MIN_DELIVERY = 0.05
+# Cada hop do pai até ao Sink conta como uma ligação média (o ETX dele não é anunciado)
+HOP_WEIGHT = 2.0
+# Penalização por cada nível de carga do pai e por ficar com o seu último slot
+LOAD_WEIGHT = 0.5
+LAST_SLOT_PENALTY = 1.0
+# Diferença de custo que justifica trocar de pai (~ meia transmissão)
+HYSTERESIS = 0.5
+# No `hop`: diferença de RSSI (dB, já suavizado) que justifica trocar entre pais iguais
+RSSI_HYSTERESIS = 6.0
+
+
+def rssi_delivery(rssi):
+    return min(max((rssi - RSSI_FLOOR) / (RSSI_GOOD - RSSI_FLOOR), MIN_DELIVERY), 1.0)
+
+
+class LinkHistory:
+    """ O que cada pai nos mostrou em ligações anteriores. """
+    def __init__(self):
+        self.links = {}  # endereço -> {'srtt', 'loss', 'attempts', 'failures'}
+
+    def _get(self, address):
+        return self.links.setdefault(address, {'srtt': None, 'loss': 0.0, 'attempts': 0, 'failures': 0})
+
+    def connect_result(self, address, ok):
+        link = self._get(address)
+        link['attempts'] += 1
+        if not ok:
+            link['failures'] += 1
+
+    def link_closed(self, address, liveness, lost=False):
+        """ Fim de uma ligação: guarda o RTT e as perdas; uma queda conta como falha. """
+        link = self._get(address)
+        if liveness.srtt is not None:
+            link['srtt'] = liveness.srtt
+            link['loss'] = liveness.loss
+        if lost:
+            link['failures'] += 1
+
+    def delivery(self, address):
+        """ Probabilidade de entrega estimada, ou None sem histórico. """
+        link = self.links.get(address)
+        if not link or not link['attempts']:
+            return None
+        # +1 nos dois termos: uma só falha não condena o pai para sempre
+        ok = max(link['attempts'] - link['failures'] + 1, 1) / (link['attempts'] + 1)
+        return min(ok, 1.0) * (1.0 - link['loss'])
+
+    def rtt_factor(self, address):
+        """ RTT deste pai a dividir pelo do melhor pai conhecido (>= 1), ou None. """
+        link = self.links.get(address)
+        if not link or link['srtt'] is None:
+            return None
+        best = min(l['srtt'] for l in self.links.values() if l['srtt'] is not None)
+        return max(link['srtt'] / best, 1.0) if best > 0 else 1.0
+
+
+class HopScore:
+    """ Heurística original: menos hops, menos carga, mais RSSI. """
+    margin = RSSI_HYSTERESIS
+
+    def __init__(self, history=None):
+        self.history = history
+
+    def __call__(self, c):
+        return (c['hop'], c['load'], -c['rssi'])
+
+    def keeps(self, cost, best_cost):
+        """ O pai atual (`cost`) fica perante `best_cost`? A margem só vale entre hop e carga iguais. """
+        return cost <= best_cost or (cost[:2] == best_cost[:2] and cost[2] - best_cost[2] <= self.margin)
+
+
+class EtxScore:
+    margin = HYSTERESIS
+
+    def __init__(self, history):
+        self.history = history
+
+    def link_etx(self, c):
+        address = c['device'].address
+        delivery = self.history.delivery(address)
+        if delivery is None:
+            return 1.0 / rssi_delivery(c['rssi'])
+        # Um RTT acima do melhor conhecido são retransmissões da camada de ligação
+        return (self.history.rtt_factor(address) or 1.0) / max(delivery, MIN_DELIVERY)
+
+    def __call__(self, c):
+        cost = max(c['hop'], 0) * HOP_WEIGHT + self.link_etx(c) + c['load'] * LOAD_WEIGHT
+        if c['slots'] == 1:
+            cost += LAST_SLOT_PENALTY
+        return cost
+
+    def keeps(self, cost, best_cost):
+        return cost <= best_cost + self.margin
+
+
+SCORINGS = {
+    'hop': HopScore,
+    'etx': EtxScore,
+}
+
+
+def make_score(name, history):
+    if name not in SCORINGS:
+        raise ValueError(f"Função de custo desconhecida: {name}")
+    return SCORINGS[name](history)
+
+
+class ParentSelector:
+    """ Melhor candidato da tabela, com histerese a favor do pai anterior (`score.keeps`). """
+    def __init__(self, table, score):
+        self.table = table
+        self.score = score
+        self.kept = 0
+        self.switched = 0
+
+    def choose(self, incumbent=None, **limits):
+        best = self.table.best(**limits)
+        if best is None or incumbent is None or best['device'].address == incumbent:
+            return best
+        current = self.table.get(incumbent)
+        if current is not None and self.table.eligible(current, **limits):
+            cost, best_cost = self.table.rank(current), self.table.rank(best)
+            if self.score.keeps(cost, best_cost):
+                self.kept += 1
+                return current
+        self.switched += 1
+        return best
@@ -7,6 +7,15 @@ import dbus.service
 import dbus.mainloop.glib
 from gi.repository import GLib
 
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from common.frames import encode_capabilities
+from common.link import LinkReceiver
+from common.children import WHEEL_TICK
+from common.advert import encode_adv_data, MAX_CHILDREN
+from ingest import format_stats
+from routes import format_routes
+import sink as pipeline
+
 # --- CONFIGURAÇÃO ---
 CHAT_SERVICE_UUID = "12345678-1234-5678-1234-56789abcdef0"
 CHAT_MSG_UUID     = "12345678-1234-5678-1234-56789abcdef1"
@@ -20,6 +29,7 @@ GATT_SERVICE_IFACE = 'org.bluez.GattService1'
 GATT_CHARACTERISTIC_IFACE = 'org.bluez.GattCharacteristic1'
 LE_ADVERTISING_MANAGER_IFACE = 'org.bluez.LEAdvertisingManager1'
 LE_ADVERTISEMENT_IFACE = 'org.bluez.LEAdvertisement1'
+DEVICE_IFACE = 'org.bluez.Device1'
 
 class InvalidArgsException(dbus.exceptions.DBusException):
     _dbus_error_name = 'org.freedesktop.DBus.Error.InvalidArgs'
@@ -37,9 +47,10 @@ class Advertisement(dbus.service.Object):
         self.path = self.PATH_BASE + str(index)
         self.bus = bus
         self.ad_type = advertising_type
-        self.service_uuids = [CHAT_SERVICE_UUID]
+        self.service_uuids = []  # o serviço é identificado pelo ServiceData
+        self.service_data = encode_adv_data(0, MAX_CHILDREN)
         self.local_name = LOCAL_NAME
-        self.include_tx_power = True
+        self.include_tx_power = False  # sem espaço no anúncio de 31 bytes
         dbus.service.Object.__init__(self, bus, self.path)
 
     def get_properties(self):
@@ -47,6 +58,9 @@ class Advertisement(dbus.service.Object):
         properties['Type'] = self.ad_type
         if self.service_uuids:
             properties['ServiceUUIDs'] = dbus.Array(self.service_uuids, signature='s')
+        if self.service_data:
+            properties['ServiceData'] = dbus.Dictionary(
+                {CHAT_SERVICE_UUID: dbus.Array([dbus.Byte(b) for b in self.service_data], signature='y')}, signature='sv')
         if self.local_name:
             properties['LocalName'] = dbus.String(self.local_name)
         if self.include_tx_power:
@@ -173,47 +187,54 @@ class Characteristic(dbus.service.Object):
 class ChatQueue(Characteristic):
     def __init__(self, bus, index, service):
         Characteristic.__init__(
-            self, bus, index, CHAT_MSG_UUID, ['write', 'notify'], service
+            self, bus, index, CHAT_MSG_UUID, ['read', 'write', 'write-without-response', 'notify'], service
         )
-        self.forwarding_table = {}
+        self.notifying = False
+        self.link = LinkReceiver(notify=self.notify)
 
     @dbus.service.method(GATT_CHARACTERISTIC_IFACE, in_signature='aya{sv}', out_signature='ay')
     def WriteValue(self, value, options):
-        # 1. Tentar descodificar
-        try:
-            raw = bytes(value).decode("utf-8", errors="ignore")
-            print(f"[DEBUG] Recebido raw: {raw}") # Ver se chega aqui
-        except Exception as e:
-            print(f"[ERRO] Falha no decode: {e}")
-            return dbus.Array([], signature='y')
-
-        # 2. Tentar separar NID e Mensagem
-        try:
-            if "|" in raw:
-                nid, msg = raw.split("|", 1)
-            else:
-                print(f"[ERRO] Mensagem sem '|': {raw}")
-                # Retornamos sucesso na mesma para não crashar o Node
-                return dbus.Array([], signature='y')
-        except Exception as e:
-            print(f"[ERRO] Falha no split: {e}")
-            return dbus.Array([], signature='y')
-
-        # 3. Tentar obter endereço do remetente
+        # Como o ChatChrc: um erro aqui não pode voltar ao BlueZ como erro da escrita ATT
         try:
+            # 0. Juntar fragmentos e desfazer batches (uma escrita pode trazer várias frames)
             device_path = str(options.get('device', ''))
             sender_address = "Desconhecido"
             if 'dev_' in device_path:
                 sender_address = device_path.split('dev_')[1].replace('_', ':')
-            
-            self.forwarding_table[nid] = sender_address
-            print(f"[SINK] De: {sender_address} | NID: {nid} | Msg: {msg}")
+
+            # O WriteValue só enfileira: o resto é a pipeline do sink.py (log, base, pub/sub, rotas)
+            command = str(options.get('type', '')) == 'command'
+            for data in self.link.receive(device_path, bytes(value), command):
+                pipeline.on_msg_received(data, sender_address)
         except Exception as e:
-            print(f"[ERRO] Falha ao processar remetente: {e}")
+            print(f"[ERRO] Falha ao receber escrita de {options.get('device', '?')}: {e}")
 
-        # 4. RETORNO FINAL OBRIGATÓRIO
+        # RETORNO FINAL OBRIGATÓRIO
         return dbus.Array([], signature='y')
 
+    # A leitura devolve as capacidades do Sink (codecs de compressão suportados)
+    @dbus.service.method(GATT_CHARACTERISTIC_IFACE, in_signature='a{sv}', out_signature='ay')
+    def ReadValue(self, options):
+        return dbus.Array([dbus.Byte(b) for b in encode_capabilities()], signature='y')
+
+    # --- NOTIFICAÇÕES (créditos do modo write-without-response) ---
+    @dbus.service.method(GATT_CHARACTERISTIC_IFACE)
+    def StartNotify(self):
+        self.notifying = True
+
+    @dbus.service.method(GATT_CHARACTERISTIC_IFACE)
+    def StopNotify(self):
+        self.notifying = False
+
+    @dbus.service.signal(DBUS_PROP_IFACE, signature='sa{sv}as')
+    def PropertiesChanged(self, interface, changed, invalidated):
+        pass
+
+    def notify(self, value):
+        if not self.notifying:
+            return
+        self.PropertiesChanged(GATT_CHARACTERISTIC_IFACE, {'Value': dbus.Array([dbus.Byte(b) for b in value], signature='y')}, [])
+
 
 class ChatService(Service):
     def __init__(self, bus, path, index):
@@ -239,6 +260,9 @@ def start_server(adapter_interface='hci0'):
         return
 
     app = Application(bus)
+    chat_queue = app.services[0].get_characteristics()[0]
+    # Configurada pelas mesmas variáveis SIC_* do sink.py
+    pipeline.start_pipeline()
     adv = Advertisement(bus, 0, 'peripheral')
     mainloop = GLib.MainLoop()
 
@@ -267,11 +291,12 @@ def start_server(adapter_interface='hci0'):
         except Exception:
             pass 
 
-        # 2. Sai do Loop principal
+        # 2. Sai do Loop principal e deixa os workers esvaziar a fila
         try:
             mainloop.quit()
         except:
             pass
+        pipeline.stop_pipeline()
 
     # --- DETECTOR DE TECLA '0' ---
     def stdin_handler(source, condition):
@@ -300,6 +325,8 @@ def start_server(adapter_interface='hci0'):
 
     # --- Lógica de Watchdog para manter visível ---
     def force_restart_advertising():
+        # Slots livres atualizados a cada reinício (Hop 0, sem carga)
+        adv.service_data = encode_adv_data(0, MAX_CHILDREN - len(chat_queue.link.children.connected_keys()))
         try: ad_manager.UnregisterAdvertisement(adv.get_path())
         except: pass
         try:
@@ -311,17 +338,58 @@ def start_server(adapter_interface='hci0'):
         force_restart_advertising()
         return False
 
+    # Só os dispositivos deste adaptador (outros adaptadores e processos usam o mesmo bus)
+    device_prefix = adapter_path + "/"
+
     def device_connected_handler(interface, changed, invalidated, path):
+        if not str(path).startswith(device_prefix):
+            return
         if interface == 'org.bluez.Device1':
             if 'Connected' in changed and changed['Connected']:
                 print(f"\n[EVENTO] Novo Node conectado: {path}")
+                chat_queue.link.children.connected(str(path))
                 GLib.timeout_add_seconds(5, trigger_restart)
             if 'Connected' in changed and not changed['Connected']:
                  print(f"\n[EVENTO] Node desconectado: {path}")
+                 chat_queue.link.forget(str(path))
                  GLib.timeout_add_seconds(1, trigger_restart)
 
     bus.add_signal_receiver(device_connected_handler, dbus_interface="org.freedesktop.DBus.Properties", signal_name="PropertiesChanged", path_keyword="path")
 
+    # --- Nodes calados: desliga-os para libertar slots de ligação ---
+    def reap_idle_children():
+        for path in chat_queue.link.children.expire():
+            print(f"\n[EVENTO] Node inativo: {path}. A desligar...")
+            chat_queue.link.forget(path)
+            try:
+                device = dbus.Interface(bus.get_object(BLUEZ_SERVICE_NAME, path), DEVICE_IFACE)
+                device.Disconnect(reply_handler=lambda: None, error_handler=lambda e: None)
+            except Exception as e:
+                print(f"[ERRO] Falha ao desligar {path}: {e}")
+        return True
+
+    GLib.timeout_add(int(WHEEL_TICK * 1000), reap_idle_children)
+
+    # --- Métricas da fila de ingestão (só quando houve tráfego) ---
+    last_report = [0]
+    def report_ingest():
+        stats = pipeline.ingest.stats()
+        if stats['enqueued'] != last_report[0]:
+            last_report[0] = stats['enqueued']
+            print(format_stats(stats))
+            print(format_routes(pipeline.routes.stats()))
+        return True
+
+    if pipeline.INGEST_REPORT_S:
+        GLib.timeout_add_seconds(int(pipeline.INGEST_REPORT_S), report_ingest)
+
+    # --- Instantâneo da tabela de encaminhamento (para um reinício não começar vazio) ---
+    def snapshot_routes():
+        pipeline.snapshot_routes()
+        return True
+
+    GLib.timeout_add_seconds(1, snapshot_routes)
+
     # Registar tudo
     service_manager.RegisterApplication(app.get_path(), dbus.Dictionary({}, signature='sv'), reply_handler=register_app_cb, error_handler=register_app_error_cb)
     ad_manager.RegisterAdvertisement(adv.get_path(), {}, reply_handler=register_ad_cb, error_handler=register_ad_error_cb)
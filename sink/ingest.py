@@ -0,0 +1,133 @@
+# sink/ingest.py
+"""
+Fila de ingestão do Sink: separa a receção (WriteValue, na thread do GLib) do
+tratamento das frames (descodificar, imprimir, guardar).
+
+O BlueZ só envia a resposta ATT quando o WriteValue retorna, por isso tudo o que
+lá for feito atrasa as escritas de todos os filhos. Com esta fila o WriteValue só
+faz put(): um append numa deque (atómico no CPython, sem lock) e, se os workers
+estiverem a dormir, um set() num Event. Os workers tiram lotes de até `batch`
+frames e entregam-nos ao handler de uma vez, para o custo de terminal/disco ser
+pago por lote e não por frame.
+
+A fila é limitada: cheia, a frame é descartada e contada (o GLib não pode ficar
+à espera de espaço). Com mais do que um worker a ordem só é garantida dentro de
+cada lote.
+"""
+import threading
+import time
+from collections import deque
+
+INGEST_CAPACITY = 4096
+INGEST_BATCH = 64
+# Quanto tempo um worker sem trabalho dorme antes de voltar a olhar para a fila
+IDLE_WAIT = 0.5
+
+
+class IngestQueue:
+    def __init__(self, handler, capacity=INGEST_CAPACITY, workers=1, batch=INGEST_BATCH, name="ingest"):
+        """ handler(lote): lote é uma lista de (chegada, emissor, frame), por ordem de chegada. """
+        self.handler = handler
+        self.capacity = capacity
+        self.batch = batch
+        self.items = deque()
+        # Escritas só pelo produtor (put)
+        self.enqueued = 0
+        self.dropped = 0
+        # Escritas só pelos workers (com _lock)
+        self.processed = 0
+        self.batches = 0
+        self.errors = 0
+        self.lag_total = 0.0
+        self.lag_max = 0.0
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._running = False
+        self._threads = [threading.Thread(target=self._run, name=f"{name}-{i}", daemon=True)
+                         for i in range(max(workers, 1))]
+
+    def start(self):
+        if not self._running:
+            self._running = True
+            for t in self._threads:
+                t.start()
+        return self
+
+    def stop(self, timeout=5.0):
+        """ Deixa os workers esvaziar a fila e espera por eles. """
+        self._running = False
+        self._wake.set()
+        for t in self._threads:
+            if t.is_alive():
+                t.join(timeout)
+
+    def put(self, frame, sender=None):
+        """ Chamado na thread de receção; nunca bloqueia. Devolve False se a frame foi descartada. """
+        if len(self.items) >= self.capacity:
+            self.dropped += 1
+            return False
+        self.items.append((time.monotonic(), sender, frame))
+        self.enqueued += 1
+        if not self._wake.is_set():
+            self._wake.set()
+        return True
+
+    def _take(self):
+        batch = []
+        try:
+            while len(batch) < self.batch:
+                batch.append(self.items.popleft())
+        except IndexError:
+            pass
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._take()
+            if not batch:
+                if not self._running:
+                    return
+                self._wake.clear()
+                # Um put() entre o _take() e o clear() já não acorda ninguém: volta a ver a fila
+                if not self.items:
+                    self._wake.wait(IDLE_WAIT)
+                continue
+            try:
+                self.handler(batch)
+            except Exception as e:
+                with self._lock:
+                    self.errors += 1
+                print(f"[INGEST] Erro a tratar lote de {len(batch)} frames: {e}")
+            now = time.monotonic()
+            with self._lock:
+                self.processed += len(batch)
+                self.batches += 1
+                self.lag_total += sum(now - arrival for arrival, _, _ in batch)
+                self.lag_max = max(self.lag_max, now - batch[0][0])
+
+    def oldest_age(self):
+        """ Há quanto tempo espera a frame mais antiga da fila (0 se vazia). """
+        try:
+            return time.monotonic() - self.items[0][0]
+        except IndexError:
+            return 0.0
+
+    def stats(self):
+        with self._lock:
+            return {
+                'depth': len(self.items),
+                'enqueued': self.enqueued,
+                'processed': self.processed,
+                'dropped': self.dropped,
+                'batches': self.batches,
+                'errors': self.errors,
+                'lag_avg': self.lag_total / self.processed if self.processed else 0.0,
+                'lag_max': self.lag_max,
+                'lag_now': self.oldest_age(),
+            }
+
+
+def format_stats(stats):
+    return (f"[INGEST] fila {stats['depth']} | recebidas {stats['enqueued']} | tratadas {stats['processed']} | "
+            f"desc {stats['dropped']} | lotes {stats['batches']} | atraso {stats['lag_avg'] * 1000:.1f}ms "
+            f"(máx {stats['lag_max'] * 1000:.1f}ms, agora {stats['lag_now'] * 1000:.1f}ms)")
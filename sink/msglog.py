@@ -0,0 +1,320 @@
+# sink/msglog.py
+"""
+Registo persistente das mensagens recebidas pelo Sink: log append-only em segmentos.
+
+Cada registo é binário e prefixado pelo tamanho:
+    u32 tamanho (do resto) | u32 CRC32 (do resto) | f64 chegada (epoch) |
+    u8 tamanho do emissor | 16s NID | u16 seq | emissor (ASCII) | payload
+O CRC deixa a leitura parar num registo cortado a meio (ex: falta de energia); ao
+abrir o log, o fim inválido do último segmento é truncado.
+
+Os registos acumulam-se em memória e uma thread própria escreve-os em grupo (group
+commit): write + fsync quando há `commit_bytes` pendentes ou o mais antigo espera
+há `commit_interval` segundos. Quem chama append() (o worker de ingestão, nunca o
+WriteValue) só bloqueia se o disco ficar `max_pending` bytes atrasado.
+
+Os segmentos (`00000001.log`, `00000002.log`, ...) rodam aos `segment_bytes`; os mais
+antigos são apagados quando o total passa `retention_bytes` ou quando o último registo
+de um segmento fica mais velho do que `retention_s` (0 = sem limite).
+
+Um erro de disco perde só o grupo em causa (contado em `dropped`): o segmento é
+cortado de volta ao último registo bom, para um registo escrito a meio não esconder
+os seguintes na recuperação. Se a thread de escrita morrer, append() descarta e conta
+em vez de bloquear a ingestão.
+
+Uso: python sink/msglog.py <diretório> [--tail 20]
+"""
+import os
+import struct
+import threading
+import time
+import zlib
+
+RECORD_PREFIX = struct.Struct("!II")
+RECORD_HEADER = struct.Struct("!dB16sH")
+SEGMENT_SUFFIX = ".log"
+
+SEGMENT_BYTES = 16 * 1024 * 1024
+COMMIT_BYTES = 64 * 1024
+COMMIT_INTERVAL = 0.2
+MAX_PENDING = 8 * 1024 * 1024
+
+
+def wall_time(arrival):
+    """ Converte uma chegada em time.monotonic() (como as da fila de ingestão) para epoch. """
+    return time.time() - (time.monotonic() - arrival)
+
+
+def encode_record(arrival, sender, nid, seq, payload):
+    sender = (sender or "").encode("ascii", errors="replace")[:255]
+    body = RECORD_HEADER.pack(arrival, len(sender), nid, seq) + sender + bytes(payload)
+    return RECORD_PREFIX.pack(len(body), zlib.crc32(body)) + body
+
+
+def decode_records(data):
+    """ Gera (offset do fim, (chegada, emissor, NID, seq, payload)) até ao primeiro registo inválido. """
+    offset = 0
+    while offset + RECORD_PREFIX.size <= len(data):
+        length, crc = RECORD_PREFIX.unpack_from(data, offset)
+        start = offset + RECORD_PREFIX.size
+        body = data[start:start + length]
+        if length < RECORD_HEADER.size or len(body) != length or zlib.crc32(body) != crc:
+            return
+        arrival, sender_len, nid, seq = RECORD_HEADER.unpack_from(body)
+        sender = bytes(body[RECORD_HEADER.size:RECORD_HEADER.size + sender_len]).decode("ascii", errors="replace")
+        payload = bytes(body[RECORD_HEADER.size + sender_len:])
+        offset = start + length
+        yield offset, (arrival, sender, nid, seq, payload)
+
+
+def read_segment(path):
+    with open(path, "rb") as f:
+        data = f.read()
+    for _, record in decode_records(data):
+        yield record
+
+
+class MessageLog:
+    def __init__(self, directory, segment_bytes=SEGMENT_BYTES, retention_bytes=0, retention_s=0,
+                 commit_bytes=COMMIT_BYTES, commit_interval=COMMIT_INTERVAL, max_pending=MAX_PENDING):
+        self.directory = directory
+        self.segment_bytes = segment_bytes
+        self.retention_bytes = retention_bytes
+        self.retention_s = retention_s
+        self.commit_bytes = commit_bytes
+        self.commit_interval = commit_interval
+        self.max_pending = max_pending
+        # Métricas
+        self.records = 0
+        self.commits = 0
+        self.bytes_written = 0
+        self.commit_max = 0.0
+        self.segments_removed = 0
+        self.errors = 0
+        self.dropped = 0
+
+        self._pending = []
+        self._pending_bytes = 0
+        self._pending_since = None
+        self._cond = threading.Condition()
+        self._running = True
+        self._dead = False
+        os.makedirs(directory, exist_ok=True)
+        self._open_last_segment()
+        self._apply_retention()
+        self._thread = threading.Thread(target=self._run, name="msglog", daemon=True)
+        self._thread.start()
+
+    # --- SEGMENTOS ---
+    def segments(self):
+        names = sorted(n for n in os.listdir(self.directory) if n.endswith(SEGMENT_SUFFIX))
+        return [os.path.join(self.directory, n) for n in names]
+
+    def _segment_path(self, number):
+        return os.path.join(self.directory, f"{number:08d}{SEGMENT_SUFFIX}")
+
+    def _open_last_segment(self):
+        existing = self.segments()
+        if not existing:
+            self._open_segment(1)
+            return
+        path = existing[-1]
+        # Recuperação: corta o que ficou a meio no fim do último segmento
+        with open(path, "rb") as f:
+            data = f.read()
+        valid = 0
+        for valid, _ in decode_records(data):
+            pass
+        if valid != len(data):
+            print(f"[LOG] {os.path.basename(path)}: {len(data) - valid} bytes inválidos no fim, truncados.")
+            with open(path, "r+b") as f:
+                f.truncate(valid)
+        self._number = int(os.path.basename(path)[:-len(SEGMENT_SUFFIX)])
+        self._file = open(path, "ab")
+        self._size = valid
+
+    def _open_segment(self, number):
+        self._number = number
+        self._file = open(self._segment_path(number), "ab")
+        self._size = 0
+        # O diretório também tem de ser sincronizado para o ficheiro novo sobreviver
+        self._fsync_dir()
+
+    def _fsync_dir(self):
+        try:
+            fd = os.open(self.directory, os.O_RDONLY)
+            try: os.fsync(fd)
+            finally: os.close(fd)
+        except OSError:
+            pass
+
+    def _rotate(self):
+        try:
+            self._file.close()
+        finally:
+            self._file = None
+        self._open_segment(self._number + 1)
+        self._apply_retention()
+
+    def _reopen(self):
+        """ Reabre o segmento atual, cortado no fim do último registo bom (self._size). """
+        path = self._segment_path(self._number)
+        if os.path.exists(path) and os.path.getsize(path) > self._size:
+            os.truncate(path, self._size)
+        self._file = open(path, "ab")
+        self._size = os.fstat(self._file.fileno()).st_size
+
+    def _discard_partial(self):
+        # O buffer pode ter ficado com parte do grupo: fecha sem o reaproveitar
+        if self._file is not None:
+            try: self._file.close()
+            except OSError: pass
+            self._file = None
+        try:
+            self._reopen()
+        except OSError as e:
+            print(f"[LOG] Segmento {self._number} por reabrir: {e}")
+
+    def _apply_retention(self):
+        try:
+            closed = self.segments()[:-1]
+            now = time.time()
+            total = sum(os.path.getsize(p) for p in closed) + self._size
+            for path in closed:
+                too_big = self.retention_bytes and total > self.retention_bytes
+                too_old = self.retention_s and now - os.path.getmtime(path) > self.retention_s
+                if not (too_big or too_old):
+                    break
+                total -= os.path.getsize(path)
+                os.remove(path)
+                self.segments_removed += 1
+        except OSError as e:
+            self.errors += 1
+            print(f"[LOG] Falha na retenção: {e}")
+
+    # --- ESCRITA ---
+    def append(self, arrival, sender, nid, seq, payload):
+        record = encode_record(arrival, sender, nid, seq, payload)
+        with self._cond:
+            while self._pending_bytes >= self.max_pending and self._running and not self._dead:
+                self._cond.wait()
+            if self._dead:
+                self.dropped += 1
+                return
+            first = not self._pending
+            if first:
+                self._pending_since = time.monotonic()
+            self._pending.append(record)
+            self._pending_bytes += len(record)
+            # O primeiro registo arma o prazo do grupo; o limite de bytes fecha-o já
+            if first or self._pending_bytes >= self.commit_bytes:
+                self._cond.notify_all()
+
+    def _run(self):
+        try:
+            self._write_loop()
+        except Exception as e:
+            print(f"[LOG] Thread de escrita parada: {e}. As mensagens seguintes não ficam no log.")
+        finally:
+            with self._cond:
+                self._dead = True
+                self.dropped += len(self._pending)
+                self._pending, self._pending_bytes = [], 0
+                self._cond.notify_all()
+
+    def _write_loop(self):
+        while True:
+            with self._cond:
+                while self._running:
+                    if self._pending_bytes >= self.commit_bytes:
+                        break
+                    if self._pending:
+                        remaining = self._pending_since + self.commit_interval - time.monotonic()
+                        if remaining <= 0:
+                            break
+                        self._cond.wait(remaining)
+                    else:
+                        self._cond.wait()
+                pending, self._pending, self._pending_bytes = self._pending, [], 0
+                running = self._running
+                self._cond.notify_all()
+            if pending:
+                self._commit(pending)
+            if not running:
+                return
+
+    def _commit(self, records):
+        """ Um write + fsync por grupo; roda o segmento quando passa do tamanho. """
+        start = time.monotonic()
+        data = b"".join(records)
+        try:
+            if self._file is None:
+                self._reopen()
+            self._file.write(data)
+            self._file.flush()
+            os.fsync(self._file.fileno())
+        except OSError as e:
+            self.errors += 1
+            self.dropped += len(records)
+            print(f"[LOG] Falha a escrever {len(records)} registos: {e}")
+            self._discard_partial()
+            return
+        self._size += len(data)
+        self.records += len(records)
+        self.bytes_written += len(data)
+        self.commits += 1
+        self.commit_max = max(self.commit_max, time.monotonic() - start)
+        if self._size >= self.segment_bytes:
+            try:
+                self._rotate()
+            except OSError as e:
+                # Sem segmento novo: o próximo commit volta a tentar abrir um
+                self.errors += 1
+                print(f"[LOG] Falha a rodar o segmento: {e}")
+
+    def close(self):
+        """ Escreve o que estiver pendente e fecha o segmento atual. """
+        with self._cond:
+            self._running = False
+            self._cond.notify_all()
+        self._thread.join()
+        if self._file is not None:
+            try: self._file.close()
+            except OSError: pass
+
+    def stats(self):
+        return {
+            'records': self.records,
+            'commits': self.commits,
+            'bytes': self.bytes_written,
+            'pending': self._pending_bytes,
+            'commit_max': self.commit_max,
+            'segment': self._number,
+            'segments_removed': self.segments_removed,
+            'errors': self.errors,
+            'dropped': self.dropped,
+        }
+
+    # --- LEITURA ---
+    def replay(self):
+        """ Todos os registos já escritos, do mais antigo para o mais recente. """
+        for path in self.segments():
+            yield from read_segment(path)
+
+
+if __name__ == "__main__":
+    import argparse
+    from collections import deque
+
+    parser = argparse.ArgumentParser(description="Lê o log de mensagens do Sink")
+    parser.add_argument("directory")
+    parser.add_argument("--tail", type=int, default=0, help="só os últimos N registos")
+    args = parser.parse_args()
+
+    paths = sorted(os.path.join(args.directory, n) for n in os.listdir(args.directory) if n.endswith(SEGMENT_SUFFIX))
+    records = (r for p in paths for r in read_segment(p))
+    if args.tail:
+        records = deque(records, maxlen=args.tail)
+    for arrival, sender, nid, seq, payload in records:
+        stamp = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(arrival)) + f".{int(arrival * 1000) % 1000:03d}"
+        print(f"{stamp} | {sender} | {nid.hex()} #{seq} | {payload.decode('utf-8', errors='replace')}")
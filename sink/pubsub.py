@@ -0,0 +1,347 @@
+# sink/pubsub.py
+"""
+Distribuição em direto das mensagens recebidas pelo Sink (pub/sub local).
+
+O Sink escuta num socket Unix (caminho) ou TCP (host:porta, por omissão só
+127.0.0.1). Cada subscritor liga-se e envia uma linha com o filtro, ou uma linha
+vazia para receber tudo:
+    nid=3fa2 type=0,8
+(nid = prefixo do NID em hex, type = tipos de frame, ver common/frames.py).
+
+Depois recebe uma mensagem por frame, prefixada pelo tamanho:
+    u32 tamanho | f64 chegada (epoch) | u8 tipo | 16s NID | u16 seq | u8 tamanho do emissor |
+    emissor (ASCII) | payload
+Cada mensagem é codificada uma só vez em publish() e o mesmo objeto bytes vai para
+a fila de todos os subscritores interessados.
+
+Quem publica (o worker de ingestão) nunca espera pelos subscritores: cada um tem
+uma fila limitada a `buffer` mensagens e a escrita nos sockets é feita por uma
+thread própria (selectors, sockets não bloqueantes). Com a fila cheia, a política
+`drop` descarta as mensagens novas para esse subscritor (e conta-as) e `disconnect`
+fecha-lhe a ligação; os outros subscritores e a receção rádio não dão por nada.
+
+Uso (cliente): python sink/pubsub.py <caminho|host:porta> [--nid 3fa2] [--type 0]
+"""
+import os
+import selectors
+import socket
+import struct
+import threading
+from collections import deque
+
+MESSAGE_PREFIX = struct.Struct("!I")
+MESSAGE_HEADER = struct.Struct("!dB16sHB")
+MAX_FILTER_LINE = 256
+
+SUB_BUFFER = 1024
+DROP = "drop"
+DISCONNECT = "disconnect"
+POLICIES = (DROP, DISCONNECT)
+
+
+def encode_message(arrival, sender, ftype, nid, seq, payload):
+    sender = (sender or "").encode("ascii", errors="replace")[:255]
+    body = MESSAGE_HEADER.pack(arrival, ftype, nid, seq, len(sender)) + sender + bytes(payload)
+    return MESSAGE_PREFIX.pack(len(body)) + body
+
+
+def decode_message(body):
+    """ (chegada, emissor, tipo, NID, seq, payload) de uma mensagem já sem o prefixo. """
+    arrival, ftype, nid, seq, sender_len = MESSAGE_HEADER.unpack_from(body)
+    start = MESSAGE_HEADER.size
+    sender = bytes(body[start:start + sender_len]).decode("ascii", errors="replace")
+    return arrival, sender, ftype, nid, seq, bytes(body[start + sender_len:])
+
+
+def parse_filter(line):
+    """ 'nid=3fa2 type=0,8' -> (prefixo do NID ou None, conjunto de tipos ou None). """
+    nid, types = None, None
+    for item in line.split():
+        key, _, value = item.partition("=")
+        if key == "nid" and value:
+            nid = value.lower()
+        elif key == "type" and value:
+            types = {int(t, 0) for t in value.split(",")}
+        else:
+            raise ValueError(f"filtro desconhecido: {item}")
+    return nid, types
+
+
+def _listen(endpoint):
+    host, sep, port = endpoint.rpartition(":")
+    if sep and port.isdigit():
+        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        sock.bind((host or "127.0.0.1", int(port)))
+    else:
+        # Um socket de uma execução anterior impedia o bind
+        if os.path.exists(endpoint):
+            os.unlink(endpoint)
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.bind(endpoint)
+    sock.listen(16)
+    sock.setblocking(False)
+    return sock
+
+
+def _connect(endpoint):
+    host, sep, port = endpoint.rpartition(":")
+    if sep and port.isdigit():
+        return socket.create_connection((host or "127.0.0.1", int(port)))
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    sock.connect(endpoint)
+    return sock
+
+
+class Subscriber:
+    def __init__(self, sock, address):
+        self.sock = sock
+        self.address = address or "local"
+        self.request = b""
+        self.ready = False   # só recebe mensagens depois de enviar o filtro
+        self.nid = None
+        self.types = None
+        self.out = deque()
+        self.offset = 0      # bytes já enviados da mensagem à cabeça
+        self.sent = 0
+        self.dropped = 0
+        self.closed = False
+
+    def wants(self, ftype, nid_hex):
+        return ((self.types is None or ftype in self.types)
+                and (self.nid is None or nid_hex.startswith(self.nid)))
+
+
+class Publisher:
+    def __init__(self, endpoint, buffer=SUB_BUFFER, policy=DROP):
+        if policy not in POLICIES:
+            raise ValueError(f"Política desconhecida: {policy}")
+        self.endpoint = endpoint
+        self.buffer = buffer
+        self.policy = policy
+        self.subscribers = []
+        # Métricas
+        self.published = 0
+        self.dropped = 0
+        self.disconnected = 0
+        self._lock = threading.Lock()
+        self._running = False
+        self._listener = None
+        self._selector = selectors.DefaultSelector()
+        self._wake_r, self._wake_w = socket.socketpair()
+        self._wake_r.setblocking(False)
+        self._wake_w.setblocking(False)
+        self._woken = False
+        self._thread = threading.Thread(target=self._run, name="pubsub", daemon=True)
+
+    def start(self):
+        self._listener = _listen(self.endpoint)
+        self._selector.register(self._listener, selectors.EVENT_READ, "accept")
+        self._selector.register(self._wake_r, selectors.EVENT_READ, "wake")
+        self._running = True
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._running = False
+        self._wake()
+        if self._thread.is_alive():
+            self._thread.join(5.0)
+
+    # --- PUBLICAÇÃO (worker de ingestão) ---
+    def publish(self, arrival, sender, ftype, nid, seq, payload):
+        """ Nunca bloqueia: a mensagem vai para as filas dos subscritores interessados. """
+        if not self.subscribers:
+            return
+        message = None
+        nid_hex = nid.hex()
+        wake = False
+        with self._lock:
+            self.published += 1
+            for sub in self.subscribers:
+                if not sub.ready or sub.closed or not sub.wants(ftype, nid_hex):
+                    continue
+                if len(sub.out) >= self.buffer:
+                    if self.policy == DISCONNECT:
+                        sub.closed = True
+                        wake = True
+                    else:
+                        sub.dropped += 1
+                        self.dropped += 1
+                    continue
+                if message is None:
+                    message = encode_message(arrival, sender, ftype, nid, seq, payload)
+                wake = wake or not sub.out
+                sub.out.append(message)
+        if wake:
+            self._wake()
+
+    def _wake(self):
+        if self._woken:
+            return
+        self._woken = True
+        try:
+            self._wake_w.send(b"\0")
+        except (BlockingIOError, OSError):
+            pass
+
+    # --- THREAD DE I/O ---
+    def _run(self):
+        while self._running:
+            self._update_interest()
+            for key, events in self._selector.select(timeout=1.0):
+                if key.data == "accept":
+                    self._accept()
+                elif key.data == "wake":
+                    # Antes do recv: um publish() a meio volta a escrever e não se perde
+                    self._woken = False
+                    try:
+                        self._wake_r.recv(4096)
+                    except BlockingIOError:
+                        pass
+                else:
+                    sub = key.data
+                    if events & selectors.EVENT_READ:
+                        self._read(sub)
+                    if events & selectors.EVENT_WRITE and not sub.closed:
+                        self._write(sub)
+        for sub in list(self.subscribers):
+            self._close(sub, count=False)
+        self._selector.close()
+        self._listener.close()
+        if self._listener.family == socket.AF_UNIX:
+            try: os.unlink(self.endpoint)
+            except OSError: pass
+
+    def _update_interest(self):
+        for sub in list(self.subscribers):
+            if sub.closed:
+                print(f"[PUBSUB] Subscritor {sub.address} lento (fila cheia): desligado.")
+                self._close(sub)
+                continue
+            events = selectors.EVENT_READ | (selectors.EVENT_WRITE if sub.out else 0)
+            if self._selector.get_key(sub.sock).events != events:
+                self._selector.modify(sub.sock, events, sub)
+
+    def _accept(self):
+        try:
+            sock, address = self._listener.accept()
+        except BlockingIOError:
+            return
+        sock.setblocking(False)
+        sub = Subscriber(sock, address if isinstance(address, str) else "%s:%d" % address[:2])
+        self._selector.register(sock, selectors.EVENT_READ, sub)
+        with self._lock:
+            self.subscribers.append(sub)
+
+    def _read(self, sub):
+        try:
+            data = sub.sock.recv(MAX_FILTER_LINE)
+        except BlockingIOError:
+            return
+        except OSError:
+            data = b""
+        if not data:
+            self._close(sub, count=False)
+            return
+        if sub.ready:
+            return  # depois do filtro o subscritor só ouve
+        sub.request += data
+        if b"\n" not in sub.request:
+            if len(sub.request) > MAX_FILTER_LINE:
+                self._close(sub, count=False)
+            return
+        try:
+            sub.nid, sub.types = parse_filter(sub.request.split(b"\n", 1)[0].decode("ascii"))
+        except (ValueError, UnicodeDecodeError) as e:
+            print(f"[PUBSUB] Filtro inválido de {sub.address}: {e}")
+            self._close(sub, count=False)
+            return
+        sub.ready = True
+        print(f"[PUBSUB] Novo subscritor {sub.address} (nid={sub.nid or '*'}, "
+              f"tipos={','.join(map(str, sorted(sub.types))) if sub.types else '*'}).")
+
+    def _write(self, sub):
+        out = sub.out
+        try:
+            while out:
+                view = memoryview(out[0])[sub.offset:]
+                n = sub.sock.send(view)
+                if n < len(view):
+                    sub.offset += n
+                    return
+                sub.offset = 0
+                sub.sent += 1
+                out.popleft()
+        except BlockingIOError:
+            pass
+        except OSError:
+            self._close(sub, count=False)
+
+    def _close(self, sub, count=True):
+        with self._lock:
+            if sub in self.subscribers:
+                self.subscribers.remove(sub)
+            sub.closed = True
+        if count:
+            self.disconnected += 1
+        try:
+            self._selector.unregister(sub.sock)
+        except (KeyError, ValueError):
+            pass
+        sub.sock.close()
+
+    def stats(self):
+        with self._lock:
+            return {
+                'subscribers': len(self.subscribers),
+                'published': self.published,
+                'dropped': self.dropped,
+                'disconnected': self.disconnected,
+                'backlog': max((len(s.out) for s in self.subscribers), default=0),
+            }
+
+
+# --- CLIENTE ---
+def _recv_exact(sock, n):
+    data = bytearray()
+    while len(data) < n:
+        chunk = sock.recv(n - len(data))
+        if not chunk:
+            raise ConnectionError("ligação fechada pelo Sink")
+        data += chunk
+    return data
+
+
+def subscribe(endpoint, nid=None, types=None):
+    """ Gera (chegada, emissor, tipo, NID, seq, payload) à medida que o Sink publica. """
+    sock = _connect(endpoint)
+    line = []
+    if nid:
+        line.append(f"nid={nid}")
+    if types:
+        line.append("type=" + ",".join(str(t) for t in types))
+    sock.sendall((" ".join(line) + "\n").encode("ascii"))
+    with sock:
+        while True:
+            length, = MESSAGE_PREFIX.unpack(_recv_exact(sock, MESSAGE_PREFIX.size))
+            yield decode_message(_recv_exact(sock, length))
+
+
+if __name__ == "__main__":
+    import argparse
+    import time
+
+    parser = argparse.ArgumentParser(description="Subscreve as mensagens do Sink em direto")
+    parser.add_argument("endpoint", help="caminho do socket Unix ou host:porta")
+    parser.add_argument("--nid", help="prefixo do NID (hex)")
+    parser.add_argument("--type", help="tipos de frame, ex: 0,8")
+    args = parser.parse_args()
+
+    types = [int(t, 0) for t in args.type.split(",")] if args.type else None
+    try:
+        for arrival, sender, ftype, nid, seq, payload in subscribe(args.endpoint, args.nid, types):
+            stamp = time.strftime("%H:%M:%S", time.localtime(arrival)) + f".{int(arrival * 1000) % 1000:03d}"
+            print(f"{stamp} | {sender} | tipo {ftype} | {nid.hex()} #{seq} | {payload.decode('utf-8', errors='replace')}")
+    except (KeyboardInterrupt, ConnectionError):
+        pass
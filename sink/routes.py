@@ -0,0 +1,175 @@
+# sink/routes.py
+"""
+Tabela de encaminhamento do Sink: NID -> emissor (o filho direto por onde chegou).
+
+Os Nodes geram um NID novo (os.urandom) a cada arranque, por isso um dict simples
+cresce sem limite. Aqui a tabela é limitada:
+    - cada mensagem renova a entrada e passa-a para o fim de uma OrderedDict
+      (O(1)), por isso a ordem da tabela é a ordem do último tráfego;
+    - acima de `capacity` entradas sai a da frente, a que está calada há mais tempo (LRU);
+    - uma entrada sem tráfego durante `ttl` segundos expira; como as mais velhas
+      estão sempre à frente, expirar só olha para o início da tabela.
+As consultas (get) não mexem na ordem: só o tráfego conta como uso.
+
+save() grava um instantâneo JSON (escrita atómica: ficheiro temporário + rename)
+com a idade de cada entrada; load() repõe-no ao arrancar, descontando o tempo em
+que o Sink esteve parado.
+"""
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+
+ROUTES_CAPACITY = 4096
+ROUTES_TTL = 24 * 3600
+
+
+class RouteTable:
+    def __init__(self, capacity=ROUTES_CAPACITY, ttl=ROUTES_TTL, path=None):
+        self.capacity = capacity
+        self.ttl = ttl
+        self.path = path
+        self.entries = OrderedDict()  # NID (hex) -> (emissor, último tráfego em monotonic)
+        # Métricas
+        self.updates = 0
+        self.evicted = 0
+        self.expired = 0
+        self.skipped = 0  # entradas inválidas num instantâneo
+        self.dirty = False
+        # Com vários workers de ingestão a tabela é atualizada de várias threads
+        self._lock = threading.Lock()
+        if path and os.path.exists(path):
+            self.load(path)
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __contains__(self, nid):
+        return self.get(nid) is not None
+
+    def update(self, nid, sender):
+        """ Tráfego de `nid` vindo de `sender`: renova a entrada e, se preciso, expulsa a mais antiga. """
+        now = time.monotonic()
+        with self._lock:
+            entries = self.entries
+            if nid in entries:
+                entries.move_to_end(nid)
+            entries[nid] = (sender, now)
+            self.updates += 1
+            self.dirty = True
+            self._expire(now)
+            while len(entries) > self.capacity:
+                entries.popitem(last=False)
+                self.evicted += 1
+
+    def get(self, nid):
+        """ Emissor pelo qual `nid` foi visto pela última vez, ou None (desconhecido ou expirado). """
+        with self._lock:
+            entry = self.entries.get(nid)
+            if entry is None:
+                return None
+            if self.ttl and time.monotonic() - entry[1] > self.ttl:
+                del self.entries[nid]
+                self.expired += 1
+                self.dirty = True
+                return None
+            return entry[0]
+
+    def _expire(self, now):
+        if not self.ttl:
+            return
+        entries = self.entries
+        while entries:
+            nid, (_, seen) = next(iter(entries.items()))
+            if now - seen <= self.ttl:
+                break
+            del entries[nid]
+            self.expired += 1
+            self.dirty = True
+
+    def expire(self):
+        with self._lock:
+            self._expire(time.monotonic())
+
+    def items(self):
+        """ (NID, emissor, idade em s), da entrada mais antiga para a mais recente. """
+        now = time.monotonic()
+        with self._lock:
+            self._expire(now)
+            return [(nid, sender, now - seen) for nid, (sender, seen) in self.entries.items()]
+
+    def stats(self):
+        return {
+            'size': len(self.entries),
+            'capacity': self.capacity,
+            'updates': self.updates,
+            'evicted': self.evicted,
+            'expired': self.expired,
+            'skipped': self.skipped,
+        }
+
+    # --- INSTANTÂNEO EM DISCO ---
+    def save(self, path=None):
+        """ Grava a tabela em `path` (ou no da construção). Devolve o número de entradas gravadas. """
+        path = path or self.path
+        now = time.monotonic()
+        with self._lock:
+            # Limpo antes da cópia: uma atualização a meio da gravação volta a marcar a tabela
+            self._expire(now)
+            self.dirty = False
+            routes = [(nid, sender, now - seen) for nid, (sender, seen) in self.entries.items()]
+        snapshot = {'saved_at': time.time(), 'routes': [[nid, sender, round(age, 3)] for nid, sender, age in routes]}
+        tmp = path + ".tmp"
+        try:
+            with open(tmp, "w") as f:
+                json.dump(snapshot, f)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp, path)
+        except OSError:
+            self.dirty = True  # fica para o próximo instantâneo
+            raise
+        return len(routes)
+
+    def load(self, path=None):
+        """
+        Repõe um instantâneo; as entradas que entretanto passaram do TTL ficam de fora, e
+        as inválidas (instantâneo cortado ou editado à mão) são saltadas e contadas.
+        """
+        path = path or self.path
+        try:
+            with open(path) as f:
+                snapshot = json.load(f)
+            downtime = max(time.time() - float(snapshot['saved_at']), 0.0)
+            routes = list(snapshot['routes'])
+        except (OSError, ValueError, KeyError, TypeError) as e:
+            print(f"[ROUTES] Instantâneo {path} ignorado: {e}")
+            return 0
+        now = time.monotonic()
+        skipped = 0
+        with self._lock:
+            # Do mais antigo para o mais recente, para a ordem LRU se manter
+            for entry in routes:
+                try:
+                    nid, sender, age = entry
+                    if not isinstance(nid, str) or not isinstance(sender, str):
+                        raise TypeError("NID e emissor têm de ser texto")
+                    seen = now - float(age) - downtime
+                except (ValueError, TypeError):
+                    skipped += 1
+                    continue
+                self.entries[nid] = (sender, seen)
+                self.entries.move_to_end(nid)
+            self._expire(now)
+            while len(self.entries) > self.capacity:
+                self.entries.popitem(last=False)
+        if skipped:
+            self.skipped += skipped
+            print(f"[ROUTES] {skipped} entradas inválidas em {path} saltadas.")
+        return len(self.entries)
+
+
+def format_routes(stats):
+    return (f"[ROUTES] {stats['size']}/{stats['capacity']} NIDs | atualizações {stats['updates']} | "
+            f"expulsos {stats['evicted']} | expirados {stats['expired']}")
@@ -6,27 +6,152 @@ sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
 
 try:
     from common.utils import select_adapter
-    from common.ble_server import BLEServer
+    from common.transport import get_transport
+    from common.frames import decode_frame, FrameError, TYPE_DATA, TYPE_HEARTBEAT
+    from common.compression import frame_payload
+    from common.dispatch import Dispatcher, ignore
+    from ingest import IngestQueue, format_stats
+    from msglog import MessageLog, wall_time
+    from store import MessageStore
+    from pubsub import Publisher
+    from routes import RouteTable, format_routes
 except ImportError:
     sys.exit(1)
 
-def on_msg_received(raw_data):
-    # Ignora Pings
-    if "PING" in raw_data:
+# Workers e capacidade da fila entre a receção e o tratamento das frames (sink/ingest.py)
+INGEST_WORKERS = int(os.environ.get("SIC_INGEST_WORKERS", "1"))
+INGEST_CAPACITY = int(os.environ.get("SIC_INGEST_CAPACITY", "4096"))
+# De quantos em quantos segundos o Sink imprime as métricas da fila (0 = nunca)
+INGEST_REPORT_S = float(os.environ.get("SIC_INGEST_REPORT_S", "30"))
+# Log persistente das mensagens (sink/msglog.py; vazio = desligado)
+LOG_DIR = os.environ.get("SIC_LOG_DIR", "")
+LOG_SEGMENT_MB = float(os.environ.get("SIC_LOG_SEGMENT_MB", "16"))
+LOG_RETENTION_MB = float(os.environ.get("SIC_LOG_RETENTION_MB", "0"))
+LOG_RETENTION_H = float(os.environ.get("SIC_LOG_RETENTION_H", "0"))
+LOG_COMMIT_MS = float(os.environ.get("SIC_LOG_COMMIT_MS", "200"))
+# Base SQLite para consultas (sink/store.py; vazio = desligada)
+DB_PATH = os.environ.get("SIC_DB_PATH", "")
+# Mensagens em direto para subscritores locais (sink/pubsub.py; caminho ou host:porta, vazio = desligado)
+PUBSUB = os.environ.get("SIC_PUBSUB", "")
+PUBSUB_BUFFER = int(os.environ.get("SIC_PUBSUB_BUFFER", "1024"))
+PUBSUB_POLICY = os.environ.get("SIC_PUBSUB_POLICY", "drop")
+# Tabela NID -> emissor (sink/routes.py); com ficheiro, grava-se um instantâneo a cada ROUTES_SNAPSHOT_S s
+ROUTES_FILE = os.environ.get("SIC_ROUTES_FILE", "")
+ROUTES_SNAPSHOT_S = float(os.environ.get("SIC_ROUTES_SNAPSHOT_S", "60"))
+
+# A pipeline é a mesma para todos os servidores (sink.py, supervisor.py, ble_interface.py)
+ingest = None
+message_log = None
+message_store = None
+publisher = None
+routes = None
+_last_snapshot = 0.0
+
+# Os handlers devolvem a linha a imprimir: o lote inteiro vai para o terminal de uma vez
+def on_data(raw_data, ftype, flags, nid, seq, length, sender, arrival):
+    # Payloads comprimidos por qualquer Node da cadeia só são abertos aqui
+    payload = frame_payload(decode_frame(raw_data))
+    if message_log or message_store or publisher:
+        arrival = wall_time(arrival)
+        if message_log: message_log.append(arrival, sender, nid, seq, payload)
+        if message_store: message_store.append(arrival, sender, nid, seq, payload)
+        if publisher: publisher.publish(arrival, sender, ftype, nid, seq, payload)
+    if sender: routes.update(nid.hex(), sender)
+    msg = payload.decode("utf-8", errors="replace")
+    return f"[SINK RECV] De: {nid.hex()} | Seq: {seq} | Msg: {msg}"
+
+def on_control(raw_data, ftype, flags, nid, seq, length, sender, arrival):
+    # Tipos de controlo sem handler registado: regista e segue (os subscritores recebem a frame inteira)
+    if publisher:
+        publisher.publish(wall_time(arrival), sender, ftype, nid, seq, raw_data)
+    return f"[SINK RECV] Controlo tipo {ftype} de {nid.hex()} ({length} bytes) ignorado."
+
+dispatcher = Dispatcher(default=on_control)
+dispatcher.register(TYPE_DATA, on_data)
+dispatcher.register(TYPE_HEARTBEAT, ignore)
+
+def process_batch(batch):
+    """ Corre num worker da fila de ingestão, nunca na thread de receção. """
+    lines = []
+    for arrival, sender, raw_data in batch:
+        try:
+            line = dispatcher.dispatch(raw_data, sender, arrival)
+        except FrameError as e:
+            line = f"[SINK RECV] Frame inválida: {e}"
+        if line:
+            lines.append(line)
+    if lines:
+        print("\n".join(lines))
+
+def on_msg_received(raw_data, sender=None):
+    # Chamado no WriteValue: só enfileira, para a resposta ATT sair logo
+    ingest.put(raw_data, sender)
+
+def start_pipeline():
+    """ Log, base, pub/sub, rotas e fila de ingestão: tudo o que vem depois da receção. """
+    global ingest, message_log, message_store, publisher, routes, _last_snapshot
+    if LOG_DIR:
+        message_log = MessageLog(LOG_DIR, int(LOG_SEGMENT_MB * 1024 * 1024), int(LOG_RETENTION_MB * 1024 * 1024),
+                                 LOG_RETENTION_H * 3600, commit_interval=LOG_COMMIT_MS / 1000)
+        print(f"[LOG] Mensagens guardadas em {LOG_DIR} (segmento {message_log.stats()['segment']}).")
+    if DB_PATH:
+        message_store = MessageStore(DB_PATH)
+        print(f"[STORE] Mensagens indexadas em {DB_PATH} (consultas: python sink/store.py {DB_PATH} range --since 1h).")
+    if PUBSUB:
+        publisher = Publisher(PUBSUB, PUBSUB_BUFFER, PUBSUB_POLICY).start()
+        print(f"[PUBSUB] Mensagens em direto em {PUBSUB} (cliente: python sink/pubsub.py {PUBSUB}).")
+    routes = RouteTable(path=ROUTES_FILE or None)
+    if ROUTES_FILE:
+        print(f"[ROUTES] {len(routes)} NIDs repostos de {ROUTES_FILE}.")
+    _last_snapshot = time.monotonic()
+    ingest = IngestQueue(process_batch, INGEST_CAPACITY, INGEST_WORKERS).start()
+    return ingest
+
+def stop_pipeline():
+    """ Esvazia a fila e fecha o que estiver aberto. """
+    ingest.stop()
+    if message_log: message_log.close()
+    if message_store: message_store.close()
+    if publisher: publisher.stop()
+    if ROUTES_FILE: save_routes()
+
+def save_routes():
+    try:
+        routes.save()
+    except OSError as e:
+        print(f"[ERRO] Falha ao gravar {ROUTES_FILE}: {e}")
+
+def snapshot_routes():
+    """ Chamada pelo loop principal: instantâneo das rotas a cada ROUTES_SNAPSHOT_S s, só se mudaram. """
+    global _last_snapshot
+    if not ROUTES_FILE or time.monotonic() - _last_snapshot < ROUTES_SNAPSHOT_S:
         return
+    _last_snapshot = time.monotonic()
+    routes.expire()
+    if routes.dirty:
+        save_routes()
 
-    if "|" in raw_data:
-        nid, msg = raw_data.split("|", 1)
-        print(f"[SINK RECV] De: {nid} | Msg: {msg}")
-    else:
-        print(f"[SINK RECV] {raw_data}")
+def start_sink(adapter):
+    start_pipeline()
+    server = get_transport().Server(adapter, on_msg_received, "Sink [Hop:0]", hop=0)
+    print(f"=== SINK INICIADO ({adapter}) ===")
+    server.start()
+    return server
 
 if __name__ == "__main__":
     adapter = select_adapter()
-    server = BLEServer(adapter, on_msg_received, "Sink [Hop:0]")
-    print(f"=== SINK INICIADO ({adapter}) ===")
-    server.start()
+    server = start_sink(adapter)
+    last_report = time.monotonic()
+    reported = 0
     try:
-        while True: time.sleep(1)
+        while True:
+            time.sleep(1)
+            snapshot_routes()
+            stats = ingest.stats()
+            if INGEST_REPORT_S and time.monotonic() - last_report >= INGEST_REPORT_S and stats['enqueued'] != reported:
+                print(format_stats(stats))
+                print(format_routes(routes.stats()))
+                last_report, reported = time.monotonic(), stats['enqueued']
     except KeyboardInterrupt:
         server.stop()
+        stop_pipeline()
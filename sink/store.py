@@ -0,0 +1,222 @@
+# sink/store.py
+"""
+Base de dados SQLite das mensagens recebidas pelo Sink, para consultas do tipo
+"tudo do NID X na última hora" sem andar a procurar no terminal.
+
+A base fica em modo WAL: a thread de escrita e as consultas (CLI, outros processos)
+não se bloqueiam. Quem chama append() (o worker de ingestão, nunca o WriteValue)
+só junta a linha a uma lista; a thread de escrita insere-as em lotes, uma transação
+por lote, quando há `batch` linhas pendentes ou a mais antiga espera há
+`commit_interval` segundos. Com synchronous=NORMAL o WAL só faz fsync nos checkpoints.
+
+Tabela `messages` (time em epoch, nid em hex), com índices (nid, time) e (sender, time).
+
+Uso: python sink/store.py <base.db> range  [--nid PREFIXO] [--sender MAC] [--since 1h] [--until ...] [--limit N]
+     python sink/store.py <base.db> latest [--nid PREFIXO]
+     python sink/store.py <base.db> count  [--nid PREFIXO] [--sender MAC] [--since 1h]
+"""
+import sqlite3
+import threading
+import time
+
+STORE_BATCH = 500
+STORE_COMMIT_INTERVAL = 0.5
+MAX_PENDING = 100000
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS messages (
+    id      INTEGER PRIMARY KEY,
+    time    REAL NOT NULL,
+    nid     TEXT NOT NULL,
+    seq     INTEGER NOT NULL,
+    sender  TEXT NOT NULL,
+    payload BLOB NOT NULL
+);
+CREATE INDEX IF NOT EXISTS messages_nid_time ON messages (nid, time);
+CREATE INDEX IF NOT EXISTS messages_sender_time ON messages (sender, time);
+"""
+INSERT = "INSERT INTO messages (time, nid, seq, sender, payload) VALUES (?, ?, ?, ?, ?)"
+COLUMNS = "time, nid, seq, sender, payload"
+
+
+def connect(path, readonly=False):
+    if readonly:
+        db = sqlite3.connect(f"file:{path}?mode=ro", uri=True, check_same_thread=False)
+    else:
+        db = sqlite3.connect(path, check_same_thread=False)
+        db.execute("PRAGMA journal_mode=WAL")
+        db.execute("PRAGMA synchronous=NORMAL")
+        db.executescript(SCHEMA)
+    db.execute("PRAGMA busy_timeout=5000")
+    return db
+
+
+class MessageStore:
+    def __init__(self, path, batch=STORE_BATCH, commit_interval=STORE_COMMIT_INTERVAL, max_pending=MAX_PENDING):
+        self.path = path
+        self.batch = batch
+        self.commit_interval = commit_interval
+        self.max_pending = max_pending
+        # Métricas
+        self.inserted = 0
+        self.transactions = 0
+        self.errors = 0
+        self.commit_max = 0.0
+
+        self._pending = []
+        self._pending_since = None
+        self._cond = threading.Condition()
+        self._running = True
+        self._db = connect(path)
+        self._thread = threading.Thread(target=self._run, name="store", daemon=True)
+        self._thread.start()
+
+    # --- ESCRITA ---
+    def append(self, arrival, sender, nid, seq, payload):
+        """ arrival em epoch (msglog.wall_time), nid em bytes. """
+        row = (arrival, nid.hex(), seq, sender or "", bytes(payload))
+        with self._cond:
+            while len(self._pending) >= self.max_pending and self._running:
+                self._cond.wait()
+            if not self._pending:
+                self._pending_since = time.monotonic()
+                self._cond.notify_all()
+            self._pending.append(row)
+            if len(self._pending) >= self.batch:
+                self._cond.notify_all()
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while self._running:
+                    if len(self._pending) >= self.batch:
+                        break
+                    if self._pending:
+                        remaining = self._pending_since + self.commit_interval - time.monotonic()
+                        if remaining <= 0:
+                            break
+                        self._cond.wait(remaining)
+                    else:
+                        self._cond.wait()
+                rows, self._pending = self._pending, []
+                running = self._running
+                self._cond.notify_all()
+            if rows:
+                self._insert(rows)
+            if not running:
+                return
+
+    def _insert(self, rows):
+        """ Um lote, uma transação. """
+        start = time.monotonic()
+        try:
+            with self._db:
+                self._db.executemany(INSERT, rows)
+        except sqlite3.Error as e:
+            self.errors += 1
+            print(f"[STORE] Falha a inserir {len(rows)} mensagens: {e}")
+            return
+        self.inserted += len(rows)
+        self.transactions += 1
+        self.commit_max = max(self.commit_max, time.monotonic() - start)
+
+    def close(self):
+        """ Insere o que estiver pendente e fecha a base. """
+        with self._cond:
+            self._running = False
+            self._cond.notify_all()
+        self._thread.join()
+        self._db.close()
+
+    def stats(self):
+        return {
+            'inserted': self.inserted,
+            'transactions': self.transactions,
+            'pending': len(self._pending),
+            'errors': self.errors,
+            'commit_max': self.commit_max,
+        }
+
+
+# --- CONSULTAS (abrem a base só para leitura; podem correr noutro processo) ---
+def _where(nid=None, sender=None, since=None, until=None):
+    clauses, args = [], []
+    if nid:
+        # Prefixo em hex: com o índice (nid, time) vira um intervalo
+        clauses.append("nid >= ? AND nid < ?")
+        args += [nid.lower(), nid.lower() + "g"]
+    if sender:
+        clauses.append("sender = ?")
+        args.append(sender)
+    if since is not None:
+        clauses.append("time >= ?")
+        args.append(since)
+    if until is not None:
+        clauses.append("time < ?")
+        args.append(until)
+    return (" WHERE " + " AND ".join(clauses)) if clauses else "", args
+
+
+def query_range(db, nid=None, sender=None, since=None, until=None, limit=None):
+    """ Mensagens (time, nid, seq, sender, payload) por ordem de chegada. """
+    where, args = _where(nid, sender, since, until)
+    sql = f"SELECT {COLUMNS} FROM messages{where} ORDER BY time"
+    if limit:
+        # Só as últimas `limit`, mas ainda por ordem de chegada
+        sql = f"SELECT * FROM (SELECT {COLUMNS} FROM messages{where} ORDER BY time DESC LIMIT ?) ORDER BY time"
+        args.append(limit)
+    return db.execute(sql, args).fetchall()
+
+
+def query_latest(db, nid=None):
+    """ A última mensagem de cada NID (um salto no índice por NID). """
+    where, args = _where(nid)
+    sql = (f"SELECT {COLUMNS} FROM messages AS m JOIN "
+           f"(SELECT nid AS n, MAX(time) AS t FROM messages{where} GROUP BY nid) ON m.nid = n AND m.time = t "
+           f"ORDER BY time")
+    return db.execute(sql, args).fetchall()
+
+
+def query_count(db, nid=None, sender=None, since=None, until=None):
+    where, args = _where(nid, sender, since, until)
+    return db.execute(f"SELECT COUNT(*) FROM messages{where}", args).fetchone()[0]
+
+
+def parse_time(value):
+    """ '90s', '15m', '1h', '2d' (há quanto tempo) ou epoch. """
+    if value is None:
+        return None
+    units = {'s': 1, 'm': 60, 'h': 3600, 'd': 86400}
+    if value[-1:] in units:
+        return time.time() - float(value[:-1]) * units[value[-1]]
+    return float(value)
+
+
+def format_row(row):
+    when, nid, seq, sender, payload = row
+    stamp = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(when)) + f".{int(when * 1000) % 1000:03d}"
+    return f"{stamp} | {sender} | {nid} #{seq} | {bytes(payload).decode('utf-8', errors='replace')}"
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Consultas à base de mensagens do Sink")
+    parser.add_argument("path")
+    parser.add_argument("query", choices=("range", "latest", "count"))
+    parser.add_argument("--nid", help="NID ou prefixo (hex)")
+    parser.add_argument("--sender", help="endereço do filho por onde chegou")
+    parser.add_argument("--since", help="ex: 1h, 30m, ou epoch")
+    parser.add_argument("--until", help="ex: 10m, ou epoch")
+    parser.add_argument("--limit", type=int, help="só as últimas N mensagens")
+    args = parser.parse_args()
+
+    db = connect(args.path, readonly=True)
+    since, until = parse_time(args.since), parse_time(args.until)
+    if args.query == "count":
+        print(query_count(db, args.nid, args.sender, since, until))
+    else:
+        rows = (query_latest(db, args.nid) if args.query == "latest"
+                else query_range(db, args.nid, args.sender, since, until, args.limit))
+        for row in rows:
+            print(format_row(row))
@@ -0,0 +1,246 @@
+# sink/supervisor.py
+"""
+Sink com vários adaptadores: um processo por adaptador, uma só pipeline.
+
+Um adaptador BlueZ só aceita um número limitado de ligações; com dois ou três
+dongles o Sink aceita mais Nodes diretos. Cada adaptador da lista corre um
+processo próprio com o seu BLEServer, anunciado como "Sink [Hop:0]" (para os Nodes
+são Sinks iguais). O processo não trata nada: cada frame recebida segue por um
+pipe para o supervisor, prefixada pelo emissor.
+
+No processo do adaptador o loop GLib não escreve no pipe: entrega a frame a uma
+fila limitada (WORKER_QUEUE) que uma thread envia, para um supervisor lento nunca
+atrasar as respostas ATT; com a fila cheia a frame é descartada e contada.
+Cada BLEServer conta só as ligações do seu adaptador, por isso cada um anuncia os
+seus slots livres.
+
+O supervisor lê todos os pipes numa só thread (multiprocessing.connection.wait),
+pela ordem de chegada, e entrega as frames à pipeline do sink.py (fila de
+ingestão, log, base, pub/sub, rotas). Um Node que troca de adaptador durante um
+failover pode reenviar frames já recebidas pelo outro: as frames com um (NID, seq)
+visto nas últimas `window` frames são descartadas e contadas como duplicadas.
+
+Um processo que morra é reiniciado passados RESTART_DELAY segundos.
+
+Uso: python sink/supervisor.py hci0 hci1 [hci2 ...]
+"""
+import os
+import queue
+import struct
+import sys
+import threading
+import time
+import multiprocessing
+from collections import OrderedDict
+from multiprocessing.connection import wait
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from common.frames import peek_header, FrameError
+
+# (NID, seq) recentes para descartar duplicados (o seq de cada NID só dá a volta aos 65536)
+DEDUP_WINDOW = 8192
+RESTART_DELAY = 2.0
+# Frames à espera de seguir pelo pipe, em cada processo de adaptador
+WORKER_QUEUE = 4096
+SENDER_PREFIX = struct.Struct("!B")
+
+
+def run_worker(adapter, conn):
+    """ Processo de um adaptador: BLEServer e um pipe para o supervisor. """
+    from common.transport import get_transport
+
+    # O loop GLib nunca escreve no pipe (bloquearia com o pipe cheio): entrega a
+    # uma fila limitada e uma thread própria envia; com a fila cheia a frame é descartada
+    outbox = queue.Queue(WORKER_QUEUE)
+    dropped = [0]
+
+    def on_data(frame, sender=None):
+        sender = (sender or "").encode("ascii", errors="replace")[:255]
+        try:
+            outbox.put_nowait(SENDER_PREFIX.pack(len(sender)) + sender + bytes(frame))
+        except queue.Full:
+            dropped[0] += 1
+            if dropped[0] in (1, 10, 100) or dropped[0] % 1000 == 0:
+                print(f"[SUPERVISOR] {adapter}: pipe atrasado, {dropped[0]} frames descartadas.")
+
+    def sender_loop():
+        try:
+            while True:
+                conn.send_bytes(outbox.get())
+        except (OSError, ValueError):
+            os._exit(1)  # o supervisor fechou o pipe
+
+    threading.Thread(target=sender_loop, name=f"pipe-{adapter}", daemon=True).start()
+    server = get_transport().Server(adapter, on_data, "Sink [Hop:0]", hop=0)
+    print(f"=== SINK INICIADO ({adapter}, pid {os.getpid()}) ===")
+    server.start()
+    parent = os.getppid()
+    try:
+        # Sem o supervisor não há para onde mandar as frames
+        while os.getppid() == parent:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.stop()
+
+
+class Adapter:
+    """ Processo e métricas de um adaptador. """
+    def __init__(self, name):
+        self.name = name
+        self.process = None
+        self.conn = None
+        self.restart_at = None
+        self.frames = 0
+        self.bytes = 0
+        self.duplicates = 0
+        self.restarts = 0
+        self.last_frame = None
+
+
+class Supervisor:
+    def __init__(self, adapters, on_frame, window=DEDUP_WINDOW, worker=run_worker):
+        """ on_frame(frame, emissor): a entrada da pipeline (ex: sink.on_msg_received). """
+        self.adapters = {name: Adapter(name) for name in adapters}
+        self.on_frame = on_frame
+        self.window = window
+        self.worker = worker
+        self.recent = OrderedDict()  # (NID, seq) -> None, do mais antigo para o mais recente
+        self.duplicates = 0
+        # "spawn": o pai já tem threads (ingestão, log) e fork com threads não é seguro
+        self._ctx = multiprocessing.get_context("spawn")
+        self._running = False
+
+    def start(self):
+        self._running = True
+        for adapter in self.adapters.values():
+            self._spawn(adapter)
+        return self
+
+    def _spawn(self, adapter):
+        receiver, sender = self._ctx.Pipe(duplex=False)
+        adapter.process = self._ctx.Process(target=self.worker, args=(adapter.name, sender),
+                                            name=f"sink-{adapter.name}", daemon=True)
+        adapter.process.start()
+        sender.close()  # só o filho escreve; o EOF no pai indica que ele morreu
+        adapter.conn = receiver
+        adapter.restart_at = None
+
+    def stop(self):
+        self._running = False
+        for adapter in self.adapters.values():
+            if adapter.process and adapter.process.is_alive():
+                adapter.process.terminate()
+        for adapter in self.adapters.values():
+            if adapter.process:
+                adapter.process.join(5.0)
+
+    # --- RECEÇÃO ---
+    def poll(self, timeout=1.0):
+        """ Entrega tudo o que chegou (até `timeout` s à espera) e reinicia os processos mortos. """
+        by_conn = {a.conn: a for a in self.adapters.values() if a.conn is not None}
+        if not by_conn:
+            time.sleep(timeout)
+        for conn in wait(list(by_conn), timeout) if by_conn else ():
+            adapter = by_conn[conn]
+            try:
+                # Tudo o que já estiver no pipe, antes de voltar ao wait
+                while True:
+                    self._handle(adapter, conn.recv_bytes())
+                    if not conn.poll():
+                        break
+            except (EOFError, OSError):
+                self._lost(adapter)
+        now = time.monotonic()
+        for adapter in self.adapters.values():
+            if self._running and adapter.restart_at is not None and now >= adapter.restart_at:
+                adapter.restarts += 1
+                adapter.process.join(0)  # já terminou há RESTART_DELAY s: só recolhe o código
+                print(f"[SUPERVISOR] A reiniciar {adapter.name} (código {adapter.process.exitcode}, "
+                      f"reinício {adapter.restarts}).")
+                self._spawn(adapter)
+
+    def _lost(self, adapter):
+        # Sem join aqui: os outros adaptadores não podem esperar por este processo
+        adapter.conn.close()
+        adapter.conn = None
+        print(f"[SUPERVISOR] Processo de {adapter.name} terminou.")
+        adapter.restart_at = time.monotonic() + RESTART_DELAY
+
+    def _handle(self, adapter, data):
+        sender_len, = SENDER_PREFIX.unpack_from(data)
+        start = SENDER_PREFIX.size
+        sender = data[start:start + sender_len].decode("ascii", errors="replace")
+        frame = data[start + sender_len:]
+        adapter.frames += 1
+        adapter.bytes += len(frame)
+        adapter.last_frame = time.monotonic()
+        if self._duplicate(frame):
+            adapter.duplicates += 1
+            self.duplicates += 1
+            return
+        self.on_frame(frame, sender)
+
+    def _duplicate(self, frame):
+        try:
+            _, _, nid, seq, _ = peek_header(frame)
+        except FrameError:
+            return False  # a pipeline regista-a como inválida
+        key = (nid, seq)
+        if key in self.recent:
+            return True
+        self.recent[key] = None
+        if len(self.recent) > self.window:
+            self.recent.popitem(last=False)
+        return False
+
+    # --- MÉTRICAS ---
+    def stats(self):
+        now = time.monotonic()
+        return {
+            name: {
+                'alive': bool(a.process and a.process.is_alive()),
+                'frames': a.frames,
+                'bytes': a.bytes,
+                'duplicates': a.duplicates,
+                'restarts': a.restarts,
+                'idle': None if a.last_frame is None else now - a.last_frame,
+            }
+            for name, a in self.adapters.items()
+        }
+
+
+def format_adapter(name, stats):
+    idle = "-" if stats['idle'] is None else f"{stats['idle']:.1f}s"
+    return (f"[SUPERVISOR] {name}: {'ativo' if stats['alive'] else 'parado'} | frames {stats['frames']} "
+            f"({stats['bytes']} bytes) | duplicadas {stats['duplicates']} | reinícios {stats['restarts']} | "
+            f"última há {idle}")
+
+
+if __name__ == "__main__":
+    import sink as pipeline
+    from ingest import format_stats
+    from routes import format_routes
+
+    adapters = sys.argv[1:] or ["hci0"]
+    pipeline.start_pipeline()
+    supervisor = Supervisor(adapters, pipeline.on_msg_received).start()
+    print(f"=== SUPERVISOR: {len(adapters)} adaptadores ({', '.join(adapters)}) ===")
+    last_report = time.monotonic()
+    reported = 0
+    try:
+        while True:
+            supervisor.poll(1.0)
+            pipeline.snapshot_routes()
+            stats = pipeline.ingest.stats()
+            if (pipeline.INGEST_REPORT_S and time.monotonic() - last_report >= pipeline.INGEST_REPORT_S
+                    and stats['enqueued'] != reported):
+                for name, adapter_stats in supervisor.stats().items():
+                    print(format_adapter(name, adapter_stats))
+                print(format_stats(stats))
+                print(format_routes(pipeline.routes.stats()))
+                last_report, reported = time.monotonic(), stats['enqueued']
+    except KeyboardInterrupt:
+        supervisor.stop()
+        pipeline.stop_pipeline()